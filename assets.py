@@ -0,0 +1,242 @@
+"""
+Logo e immagini delle certificazioni come asset binari
+
+I campi immagine di Esercente restano base64 (compatibilità con i client
+esistenti), ma al commit vengono decodificati nella tabella esercenti_asset
+insieme allo sha256 del contenuto. /assets serve i byte con ETag,
+Last-Modified e Cache-Control immutable: l'URL contiene l'hash, quindi
+cambia a ogni nuova immagine e i client possono tenerlo in cache senza
+rivalidarlo. Con ?asset_urls=true /vetrina, /dashboard e /esercenti
+restituiscono questi URL al posto dei blob (i valori che non sono immagini
+base64, es. URL esterni, restano invariati). Gli asset si aggiornano solo
+sul percorso di scrittura (before_commit): le letture non scrivono mai.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session, load_only
+
+from cache import LRUCache
+from models import Esercente, EsercenteAsset
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = ("logo", "immagine_certificazione_1", "immagine_certificazione_2")
+
+# lunghezza dell'hash nell'URL (il confronto completo avviene sull'ETag)
+URL_HASH_LENGTH = 16
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/bmp": "bmp",
+    "image/svg+xml": "svg",
+}
+
+_DATA_URI = re.compile(r"^data:(?P<type>[\w.+-]+/[\w.+-]+)?(?:;[\w-]+=[^;,]*)*;base64,", re.IGNORECASE)
+
+# l'URL cambia con il contenuto: i client possono tenerlo in cache senza rivalidare
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# gli SVG caricati dagli esercenti possono contenere script e sono serviti dall'origine dell'API:
+# niente content sniffing e, se aperti direttamente, documento in sandbox senza risorse esterne
+ASSET_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+}
+
+# chiavi in Session.info: esercenti da riallineare al commit, (esercente, campo) con asset cambiati
+PENDING_KEY = "assets_esercenti"
+CHANGED_KEY = "assets_changed"
+
+# byte degli asset: (id_esercente, campo, hash nell'URL, size, formato) -> (dati, content_type, etag, last_modified, cache_control)
+asset_cache = LRUCache(
+    max_bytes=int(os.getenv("ASSET_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("ASSET_CACHE_TTL", "3600")),
+)
+
+
+def _sniff(data: bytes) -> Optional[str]:
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith(b"BM"):
+        return "image/bmp"
+    if data.lstrip()[:5] in (b"<?xml", b"<svg ") or data.lstrip().startswith(b"<svg"):
+        return "image/svg+xml"
+    return None
+
+
+def decode_image(value: Optional[str]) -> Optional[Tuple[bytes, str]]:
+    """
+    Decodifica un'immagine base64 (anche in forma data URI).
+    Restituisce (byte, content type) o None se il valore è vuoto o non è un'immagine.
+    """
+    if not value:
+        return None
+    declared = None
+    match = _DATA_URI.match(value)
+    if match:
+        declared = match.group("type")
+        value = value[match.end():]
+    try:
+        data = base64.b64decode("".join(value.split()), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    content_type = _sniff(data) or declared
+    if not data or not content_type or not content_type.lower().startswith("image/"):
+        return None
+    return data, content_type.lower()
+
+
+def asset_url(asset: EsercenteAsset) -> str:
+    ext = EXTENSIONS.get(asset.content_type, "bin")
+    return f"/assets/{asset.id_esercente}/{asset.campo}/{asset.hash[:URL_HASH_LENGTH]}.{ext}"
+
+
+def sync_assets(db: Session, e: Esercente):
+    """
+    Allinea gli asset ai campi immagine dell'esercente (decodifica solo se il contenuto è cambiato)
+    """
+    existing = {a.campo: a for a in db.query(EsercenteAsset).filter(EsercenteAsset.id_esercente == e.id_esercente)}
+    changed = db.info.setdefault(CHANGED_KEY, set())
+    for campo in IMAGE_FIELDS:
+        decoded = decode_image(getattr(e, campo))
+        asset = existing.get(campo)
+        if decoded is None:
+            if getattr(e, campo):
+                logger.debug(f"Esercente {e.id_esercente}: {campo} non è un'immagine base64 valida")
+            if asset is not None:
+                db.delete(asset)
+                changed.add((e.id_esercente, campo))
+            continue
+        data, content_type = decoded
+        digest = hashlib.sha256(data).hexdigest()
+        if asset is not None and asset.hash == digest:
+            continue
+        if asset is None:
+            asset = EsercenteAsset(id_esercente=e.id_esercente, campo=campo)
+            db.add(asset)
+        asset.hash = digest
+        asset.content_type = content_type
+        asset.dimensione = len(data)
+        asset.dati = data
+        changed.add((e.id_esercente, campo))
+
+
+def _load_urls(db: Session, ids: list) -> Dict[Tuple[int, str], str]:
+    # solo le colonne per l'URL, senza i byte
+    rows = (db.query(EsercenteAsset)
+              .options(load_only(EsercenteAsset.id_esercente, EsercenteAsset.campo,
+                                 EsercenteAsset.hash, EsercenteAsset.content_type))
+              .filter(EsercenteAsset.id_esercente.in_(ids))
+              .all())
+    return {(a.id_esercente, a.campo): asset_url(a) for a in rows}
+
+
+def asset_urls(db: Session, ids: Iterable[int]) -> Dict[int, Dict[str, Optional[str]]]:
+    """
+    URL degli asset per ogni esercente ({id: {campo: url}}, None se il campo non ha asset), con una query
+    in sola lettura. Senza asset (es. URL di una CDN) il campo resta il valore originale.
+    """
+    ids = list(ids)
+    urls = _load_urls(db, ids)
+    return {i: {c: urls.get((i, c)) for c in IMAGE_FIELDS} for i in ids}
+
+
+def backfill_assets(db: Session) -> int:
+    """
+    Crea gli asset degli esercenti salvati prima della tabella esercenti_asset
+    (campi immagine valorizzati e nessun asset). Restituisce gli esercenti allineati.
+    """
+    with_assets = db.query(EsercenteAsset.id_esercente)
+    candidates = (db.query(Esercente)
+                    .filter(~Esercente.id_esercente.in_(with_assets),
+                            or_(*(getattr(Esercente, c).isnot(None) for c in IMAGE_FIELDS)))
+                    .all())
+    missing = [e for e in candidates if any(decode_image(getattr(e, c)) is not None for c in IMAGE_FIELDS)]
+    for e in missing:
+        sync_assets(db, e)
+    db.commit()
+    return len(missing)
+
+
+def get_asset(db: Session, id_esercente: int, campo: str) -> Optional[EsercenteAsset]:
+    return db.get(EsercenteAsset, (id_esercente, campo))
+
+
+def http_date(value: Optional[datetime]) -> str:
+    # updated_at è UTC senza fuso
+    return format_datetime((value or datetime.utcnow()).replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def not_modified(headers: Mapping[str, str], etag: str, last_modified: str) -> bool:
+    """
+    Richiesta condizionale soddisfatta (304): If-None-Match ha la precedenza su If-Modified-Since
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# ---------- Manutenzione automatica ----------
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_images(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, Esercente):
+            session.info.setdefault(PENDING_KEY, set()).add(obj.id_esercente)
+    for obj in session.dirty:
+        if isinstance(obj, Esercente):
+            state = inspect(obj)
+            if any(state.attrs[c].history.has_changes() for c in IMAGE_FIELDS):
+                session.info.setdefault(PENDING_KEY, set()).add(obj.id_esercente)
+
+
+@event.listens_for(Session, "before_commit")
+def _sync_changed_images(session):
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    ids = session.info.pop(PENDING_KEY, None)
+    for id_esercente in ids or ():
+        e = session.get(Esercente, id_esercente)
+        if e is not None:
+            sync_assets(session, e)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_assets(session):
+    # i byte in cache sono per URL (hash): senza invalidazione l'URL vecchio servirebbe
+    # l'immagine precedente fino al TTL invece di 404 (gli altri worker entro ASSET_CACHE_TTL)
+    changed = session.info.pop(CHANGED_KEY, None)
+    if changed:
+        asset_cache.invalidate_matching(lambda key: (key[0], key[1]) in changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_images(session):
+    session.info.pop(PENDING_KEY, None)
+    session.info.pop(CHANGED_KEY, None)
@@ -1,24 +1,34 @@
-import os, datetime as dt
+import os, time, hashlib, datetime as dt
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from fastapi import HTTPException, Query, Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, AsyncSessionLocal
 from models import User
+from cache import LRUCache
+from passwords import PasswordPoolBusy, hash_password, password_pool, pwdctx
 
 SECRET_KEY = os.getenv("JWT_SECRET", "change-me-please")
 ALGORITHM = "HS256"
 ACCESS_MIN = int(os.getenv("JWT_MINUTES", "60"))
 
-pwdctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# token già verificati: sha256(token) -> claims, fino alla scadenza (exp) del token.
+# Evita HMAC + parsing JSON a ogni richiesta dei kiosk che fanno polling.
+token_cache = LRUCache(
+    max_bytes=int(os.getenv("JWT_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+    ttl=ACCESS_MIN * 60,
+    max_entries=int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000")),
+)
 
 def get_db():
     db = SessionLocal()
     try: yield db
     finally: db.close()
 
-def hash_password(p: str) -> str:
-    return pwdctx.hash(p)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
 def verify_password(p: str, hashed: str) -> bool:
     return pwdctx.verify(p, hashed)
@@ -29,11 +39,51 @@ def create_access_token(sub: str) -> str:
 
 def authenticate(db: Session, email: str, password: str) -> bool:
     u = db.query(User).filter(User.email == email).first()
-    return bool(u and verify_password(password, u.password_hash))
+    if not u:
+        return False
+    ok, new_hash = pwdctx.verify_and_update(password, u.password_hash)
+    if ok and new_hash:
+        u.password_hash = new_hash
+        db.commit()
+    return ok
 
-def require_token(token: str = Query(..., description="JWT token")) -> str:
+async def authenticate_async(db: AsyncSession, email: str, password: str) -> bool:
+    """
+    Come authenticate, con la verifica bcrypt nel pool dedicato (passwords.py).
+    Con il pool saturo risponde 503 invece di mettere in coda la richiesta.
+    """
+    u = (await db.execute(select(User).where(User.email == email))).scalars().first()
+    if not u:
+        return False
+    try:
+        ok, new_hash = await password_pool.verify_and_update(password, u.password_hash)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Troppi login in corso, riprova tra poco",
+                            headers={"Retry-After": "1"})
+    if ok and new_hash:
+        # costo bcrypt cambiato (BCRYPT_ROUNDS): salva l'hash rigenerato
+        u.password_hash = new_hash
+        await db.commit()
+    return ok
+
+def decode_token(token: str) -> dict:
+    """
+    Verifica firma e scadenza del JWT e restituisce i claims.
+    Solo i token validi finiscono in cache, con TTL pari al tempo residuo fino a exp.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    claims = token_cache.get(key)
+    if claims is not None:
+        return claims
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub") or "unknown"
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise HTTPException(status_code=401, detail="Token non valido")
+    exp = claims.get("exp")
+    ttl = exp - time.time() if isinstance(exp, (int, float)) else None
+    if ttl is None or ttl > 0:
+        token_cache.set(key, claims, size=len(key) + len(token), ttl=ttl)
+    return claims
+
+def require_token(token: str = Query(..., description="JWT token")) -> str:
+    return decode_token(token).get("sub") or "unknown"
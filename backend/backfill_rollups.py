@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Migrazione una tantum: costruisce i rollup dei database esistenti
+
+I rollup si aggiornano da soli a ogni commit; vanno costruiti a mano solo
+per i dati scritti prima dei rollup (o fuori dagli eventi di sessione).
+Su tabelle grandi la ricostruzione dura minuti: va eseguita a server fermo,
+una volta sola, non all'avvio di ogni worker.
+
+- senza opzioni: ricostruisce i rollup che non coprono tutte le righe
+  (conteggio completo di dati_crawled e rilevazioni)
+- --force: ricostruisce comunque
+- --check: riporta solo lo stato, senza scrivere
+
+Uso: python backfill_rollups.py [--metrics | --readings] [--force | --check]
+"""
+
+import argparse
+import logging
+import time
+
+import models
+import rollup
+from database import SessionLocal, engine, sync_schema
+
+logger = logging.getLogger("backfill_rollups")
+
+TARGETS = {
+    "metrics": ("metriche_rollup da dati_crawled", rollup.rollups_cover_rows, rollup.rebuild_rollups),
+    "readings": ("rilevazioni_rollup da rilevazioni", rollup.reading_rollups_cover_rows,
+                 rollup.rebuild_reading_rollups),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    only = parser.add_mutually_exclusive_group()
+    only.add_argument("--metrics", action="store_true", help="solo i rollup delle metriche social")
+    only.add_argument("--readings", action="store_true", help="solo i rollup delle rilevazioni")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--force", action="store_true", help="ricostruisce anche se i rollup sono completi")
+    mode.add_argument("--check", action="store_true", help="riporta lo stato senza scrivere")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # tabelle e colonne nuove dei rollup, come all'avvio dell'applicazione
+    models.Base.metadata.create_all(bind=engine)
+    sync_schema(models.Base.metadata)
+
+    names = ["metrics"] if args.metrics else ["readings"] if args.readings else list(TARGETS)
+    db = SessionLocal()
+    try:
+        for name in names:
+            label, covered, rebuild = TARGETS[name]
+            complete = covered(db)
+            logger.info(f"{label}: {'completi' if complete else 'incompleti'}")
+            if args.check or (complete and not args.force):
+                continue
+            started = time.perf_counter()
+            rebuild(db)
+            logger.info(f"{label}: ricostruiti in {time.perf_counter() - started:.0f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Client HTTP asincrono per l'API Bright Data
+
+Usa un httpx.AsyncClient condiviso (connessioni keep-alive in pool) con un
+limite di richieste concorrenti e timeout separati per operazione.
+Il client vive su un event loop dedicato in un thread di background, così
+lo stesso pool è usabile sia dal codice sincrono (endpoint FastAPI def,
+WeeklyCrawlScheduler) sia da coroutine. Rate limit, retry e circuit
+breaker sono quelli del gate "brightdata" (outbound.py).
+"""
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional
+
+import httpx
+
+from outbound import OutboundGate, get_gate
+
+
+class BackgroundLoop:
+    """Event loop in un thread daemon, avviato alla prima richiesta"""
+
+    def __init__(self, name: str = "brightdata-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name=self.name, daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Esegue la coroutine sul loop e attende il risultato (da codice sincrono)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def run_async(self, coro: Awaitable) -> Any:
+        """Esegue la coroutine sul loop e la attende da un altro event loop"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+
+class AsyncBrightDataClient:
+    """
+    Wrapper delle chiamate /trigger e /snapshot/{id}.
+    Restituisce le httpx.Response: l'interpretazione resta a BrightDataService.
+    """
+
+    def __init__(self, base_url: str, api_token: Optional[str],
+                 max_connections: int = None, max_concurrency: int = None,
+                 trigger_timeout: float = None, status_timeout: float = None,
+                 snapshot_timeout: float = None):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {
+            "Authorization": f"Bearer {api_token}",
+            "Content-Type": "application/json"
+        }
+        self.max_connections = max_connections or int(os.getenv("BRIGHTDATA_MAX_CONNECTIONS", "20"))
+        self.max_concurrency = max_concurrency or int(os.getenv("BRIGHTDATA_MAX_CONCURRENCY", "10"))
+        self.timeouts = {
+            "trigger": trigger_timeout or float(os.getenv("BRIGHTDATA_TRIGGER_TIMEOUT", "30")),
+            "status": status_timeout or float(os.getenv("BRIGHTDATA_STATUS_TIMEOUT", "30")),
+            "snapshot": snapshot_timeout or float(os.getenv("BRIGHTDATA_SNAPSHOT_TIMEOUT", "60")),
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.gate: OutboundGate = get_gate("brightdata")
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        # creati pigramente dentro il loop che li userà
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _timeout(self, operation: str) -> httpx.Timeout:
+        return httpx.Timeout(self.timeouts[operation], connect=min(10.0, self.timeouts[operation]))
+
+    async def request(self, method: str, path: str, operation: str, **kwargs) -> httpx.Response:
+        client = self._ensure_client()
+        async with self._semaphore:
+            return await self.gate.request(
+                lambda: client.request(method, path, timeout=self._timeout(operation), **kwargs),
+                idempotent=method == "GET",
+            )
+
+    async def trigger(self, dataset_id: str, crawl_data: list) -> httpx.Response:
+        return await self.request(
+            "POST", "/trigger", "trigger",
+            params={"dataset_id": dataset_id, "include_errors": "true"},
+            json=crawl_data,
+        )
+
+    async def snapshot_status(self, job_id: str) -> httpx.Response:
+        return await self.request("GET", f"/snapshot/{job_id}", "status")
+
+    async def snapshot(self, job_id: str, format: str = "json") -> httpx.Response:
+        return await self.request("GET", f"/snapshot/{job_id}", "snapshot", params={"format": format})
+
+    @asynccontextmanager
+    async def stream_snapshot(self, job_id: str, format: str = "ndjson") -> AsyncIterator[httpx.Response]:
+        """Scarica lo snapshot in streaming: il body va letto con aiter_lines/aiter_bytes"""
+        client = self._ensure_client()
+        async with self._semaphore:
+            request = client.build_request("GET", f"/snapshot/{job_id}", params={"format": format},
+                                           timeout=self._timeout("snapshot"))
+            # retry solo sull'apertura dello stream: il body non è ancora stato letto
+            response = await self.gate.request(lambda: client.send(request, stream=True))
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
@@ -1,10 +1,15 @@
 import os
-import requests
+import json
+import httpx
 import uuid
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from urllib.parse import urlsplit, urlunsplit
+from typing import List, Dict, Any, Optional, Iterable, Iterator, AsyncIterator
 from datetime import datetime, timedelta
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from models import BrightDataJob, BrightDataResult, EsercenteSocialMapping, WeeklyCrawlSchedule
+from brightdata_client import AsyncBrightDataClient, BackgroundLoop
 import schemas
 import logging
 
@@ -24,17 +29,18 @@ class BrightDataService:
             "Authorization": f"Bearer {self.api_token}",
             "Content-Type": "application/json"
         }
+        
+        # righe dei risultati salvate per commit (memoria limitata anche con snapshot enormi)
+        self.results_chunk_size = int(os.getenv("BRIGHTDATA_RESULTS_CHUNK_SIZE", "200"))
+        
+        # pool HTTP condiviso da endpoint e scheduler
+        self.client = AsyncBrightDataClient(self.base_url, self.api_token)
+        self.loop = BackgroundLoop()
     
-    def trigger_crawl(self, platform: str, urls: List[str], params: Dict[str, Any] = None) -> Dict[str, Any]:
+    def build_crawl_data(self, platform: str, urls: List[str], params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
-        Trigger a crawl job on Bright Data
+        Prepara il payload di /trigger per la piattaforma
         """
-        if platform not in self.dataset_ids:
-            raise ValueError(f"Platform {platform} not supported. Supported: {list(self.dataset_ids.keys())}")
-        
-        dataset_id = self.dataset_ids[platform]
-        
-        # Prepara i dati per la richiesta
         crawl_data = []
         for url in urls:
             if platform == "facebook" and params and "num_of_reviews" in params:
@@ -49,21 +55,20 @@ class BrightDataService:
                 })
             else:
                 crawl_data.append({"url": url})
+        return crawl_data
+
+    async def trigger_crawl_async(self, platform: str, urls: List[str], params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Trigger a crawl job on Bright Data
+        """
+        if platform not in self.dataset_ids:
+            raise ValueError(f"Platform {platform} not supported. Supported: {list(self.dataset_ids.keys())}")
         
-        # Parametri della richiesta
-        request_params = {
-            "dataset_id": dataset_id,
-            "include_errors": "true"
-        }
+        dataset_id = self.dataset_ids[platform]
+        crawl_data = self.build_crawl_data(platform, urls, params)
         
         try:
-            response = requests.post(
-                f"{self.base_url}/trigger",
-                headers=self.headers,
-                params=request_params,
-                json=crawl_data,
-                timeout=30
-            )
+            response = await self.client.trigger(dataset_id, crawl_data)
             response.raise_for_status()
             
             result = response.json()
@@ -80,7 +85,7 @@ class BrightDataService:
                 "response": result
             }
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error triggering crawl for {platform}: {e}")
             return {
                 "success": False,
@@ -89,16 +94,12 @@ class BrightDataService:
                 "urls_count": len(urls)
             }
     
-    def get_job_status(self, job_id: str) -> Dict[str, Any]:
+    async def get_job_status_async(self, job_id: str) -> Dict[str, Any]:
         """
         Ottieni lo status di un job
         """
         try:
-            response = requests.get(
-                f"{self.base_url}/snapshot/{job_id}",
-                headers=self.headers,
-                timeout=30
-            )
+            response = await self.client.snapshot_status(job_id)
             
             if response.status_code == 404:
                 return {"status": "not_found", "job_id": job_id}
@@ -114,7 +115,7 @@ class BrightDataService:
                 "response": result
             }
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error getting job status {job_id}: {e}")
             return {
                 "status": "error",
@@ -122,17 +123,12 @@ class BrightDataService:
                 "error": str(e)
             }
     
-    def get_job_results(self, job_id: str, format: str = "json") -> Dict[str, Any]:
+    async def get_job_results_async(self, job_id: str, format: str = "json") -> Dict[str, Any]:
         """
         Recupera i risultati di un job completato
         """
         try:
-            response = requests.get(
-                f"{self.base_url}/snapshot/{job_id}",
-                headers=self.headers,
-                params={"format": format},
-                timeout=60
-            )
+            response = await self.client.snapshot(job_id, format=format)
             
             response.raise_for_status()
             
@@ -149,13 +145,70 @@ class BrightDataService:
                     "data": response.text
                 }
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error getting job results {job_id}: {e}")
             return {
                 "success": False,
                 "job_id": job_id,
                 "error": str(e)
             }
+
+    async def iter_job_results_async(self, job_id: str, chunk_size: int = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Scarica lo snapshot in formato NDJSON e lo restituisce a blocchi di chunk_size righe,
+        senza mai materializzare l'intero snapshot in memoria
+        """
+        chunk_size = chunk_size or self.results_chunk_size
+        async with self.client.stream_snapshot(job_id, format="ndjson") as response:
+            response.raise_for_status()
+            chunk = []
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk.append(json.loads(line))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    @staticmethod
+    async def _next_chunk(agen: AsyncIterator) -> Optional[List[Dict[str, Any]]]:
+        try:
+            return await agen.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    # --- API sincrona: wrapper sul loop del client asincrono ---
+
+    def iter_job_results(self, job_id: str, chunk_size: int = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Versione sincrona di iter_job_results_async (un blocco alla volta)
+        """
+        agen = self.iter_job_results_async(job_id, chunk_size)
+        try:
+            while True:
+                chunk = self.loop.run(self._next_chunk(agen))
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.loop.run(agen.aclose())
+
+    def trigger_crawl(self, platform: str, urls: List[str], params: Dict[str, Any] = None) -> Dict[str, Any]:
+        return self.loop.run(self.trigger_crawl_async(platform, urls, params))
+
+    def get_job_status(self, job_id: str) -> Dict[str, Any]:
+        return self.loop.run(self.get_job_status_async(job_id))
+
+    def get_job_results(self, job_id: str, format: str = "json") -> Dict[str, Any]:
+        return self.loop.run(self.get_job_results_async(job_id, format))
+
+    def close(self):
+        """
+        Chiude il pool HTTP (allo shutdown dell'applicazione)
+        """
+        self.loop.run(self.client.aclose())
     
     def save_job_to_db(self, db: Session, platform: str, urls: List[str], 
                       params: Dict[str, Any], response: Dict[str, Any]) -> BrightDataJob:
@@ -178,110 +231,212 @@ class BrightDataService:
         db.refresh(job)
         return job
     
-    def save_results_to_db(self, db: Session, job: BrightDataJob, results_data: List[Dict[str, Any]]):
+    def save_results_chunk(self, db: Session, job: BrightDataJob, results_data: List[Dict[str, Any]]):
         """
-        Salva i risultati nel database ed estrae i dati rilevanti
+        Salva un blocco di risultati con una insert Core (executemany), un commit per blocco
         """
-        for item in results_data:
-            # Estrazione dati base
-            source_url = item.get("url", "")
-            platform = job.dataset_type
-            
-            # Estrazione dati specifici per platform
-            followers_count = None
-            posts_count = None
-            reviews_count = None
-            rating = None
-            
-            if platform == "instagram":
-                followers_count = item.get("followers", item.get("follower_count"))
-                posts_count = item.get("posts", item.get("media_count"))
-            
-            elif platform == "facebook":
-                followers_count = item.get("fans", item.get("fan_count"))
-                reviews_count = len(item.get("reviews", []))
-                if item.get("rating"):
-                    rating = float(item.get("rating", 0))
-            
-            elif platform == "googlemaps":
-                reviews_count = item.get("reviews_count", len(item.get("reviews", [])))
-                if item.get("rating"):
-                    rating = float(item.get("rating", 0))
-            
-            # Crea il record del risultato
-            result = BrightDataResult(
-                job_id=job.id,
-                source_url=source_url,
-                platform=platform,
-                raw_data=item,
-                followers_count=followers_count,
-                posts_count=posts_count,
-                reviews_count=reviews_count,
-                rating=rating
-            )
-            
-            db.add(result)
-        
-        # Aggiorna il job
-        job.result_count = len(results_data)
+        rows = build_result_rows(job.id, job.dataset_type, results_data)
+        if rows:
+            db.execute(insert(BrightDataResult.__table__), rows)
+        db.commit()
+    
+    def complete_job(self, db: Session, job: BrightDataJob, result_count: int):
+        """
+        Marca il job come completato dopo il salvataggio di tutti i blocchi
+        """
+        job.result_count = result_count
         job.status = "completed"
         job.completed_at = datetime.utcnow()
-        
         db.commit()
     
+    def discard_results(self, db: Session, job: BrightDataJob):
+        """
+        Elimina i risultati parziali di un download interrotto
+        """
+        db.rollback()
+        db.query(BrightDataResult).filter(BrightDataResult.job_id == job.id).delete(synchronize_session=False)
+        db.commit()
+    
+    def fail_job(self, db: Session, job: BrightDataJob, error: str):
+        """
+        Marca il job come fallito ed elimina gli eventuali risultati parziali
+        """
+        self.discard_results(db, job)
+        job.status = "failed"
+        job.error_message = error
+        job.completed_at = datetime.utcnow()
+        db.commit()
+    
+    def save_results_to_db(self, db: Session, job: BrightDataJob, results_data: Iterable[Dict[str, Any]]) -> int:
+        """
+        Salva i risultati nel database ed estrae i dati rilevanti.
+        Accetta qualsiasi iterabile (anche uno stream) e scrive a blocchi di results_chunk_size.
+        """
+        results_iter = iter(results_data)
+        count = 0
+        while True:
+            chunk = list(islice(results_iter, self.results_chunk_size))
+            if not chunk:
+                break
+            self.save_results_chunk(db, job, chunk)
+            count += len(chunk)
+        
+        self.complete_job(db, job, count)
+        return count
+    
     def integrate_with_esercenti(self, db: Session, job: BrightDataJob):
         """
-        Integra automaticamente i dati crawlati con gli esercenti esistenti
+        Integra automaticamente i dati crawlati con gli esercenti esistenti.
+        Mappature e dati di oggi sono caricati una volta sola per tutto il job.
         """
-        from models import DatoCrawled, Esercente
+        from models import DatoCrawled
         from datetime import date
         
-        # Trova le mappings per questo job
-        results = db.query(BrightDataResult).filter(
+        # Solo i campi estratti: raw_data non serve e può essere molto grande
+        results = db.query(
+            BrightDataResult.id,
+            BrightDataResult.source_url,
+            BrightDataResult.platform,
+            BrightDataResult.followers_count,
+            BrightDataResult.rating
+        ).filter(
             BrightDataResult.job_id == job.id,
             BrightDataResult.processed == "pending"
         ).all()
+        if not results:
+            return
+        
+        # Mappature attive della piattaforma, indicizzate per URL normalizzata
+        mappings = {}
+        active_mappings = db.query(EsercenteSocialMapping).filter(
+            EsercenteSocialMapping.platform == job.dataset_type,
+            EsercenteSocialMapping.is_active == "true"
+        ).order_by(EsercenteSocialMapping.id).all()
+        for mapping in active_mappings:
+            mappings.setdefault(normalize_social_url(mapping.url, mapping.platform), mapping)
         
+        matched = []
         for result in results:
-            # Trova l'esercente mappato per questo URL
-            mapping = db.query(EsercenteSocialMapping).filter(
-                EsercenteSocialMapping.url == result.source_url,
-                EsercenteSocialMapping.platform == result.platform,
-                EsercenteSocialMapping.is_active == "true"
-            ).first()
-            
+            mapping = mappings.get(normalize_social_url(result.source_url, result.platform))
             if mapping:
-                # Crea o aggiorna i dati crawlati
-                today = date.today()
-                existing = db.query(DatoCrawled).filter(
-                    DatoCrawled.id_esercente == mapping.id_esercente,
-                    DatoCrawled.data == today
-                ).first()
-                
-                if not existing:
-                    dato = DatoCrawled(
-                        id_esercente=mapping.id_esercente,
-                        data=today,
-                        ora=datetime.now().time()
-                    )
-                    db.add(dato)
-                else:
-                    dato = existing
-                
-                # Aggiorna i campi in base al platform
-                if result.platform == "instagram" and result.followers_count:
-                    dato.n_followers_ig = result.followers_count
-                elif result.platform == "facebook" and result.followers_count:
-                    dato.n_fan_facebook = result.followers_count
-                elif result.platform == "googlemaps" and result.rating:
-                    dato.stelle_google = result.rating
-                
-                # Marca il risultato come processato
-                result.processed = "integrated"
-                
-                # Aggiorna last_crawled per il mapping
-                mapping.last_crawled = datetime.utcnow()
+                matched.append((result, mapping))
+        if not matched:
+            return
+        
+        # Dati di oggi di tutti gli esercenti coinvolti con una sola query IN
+        today = date.today()
+        esercenti_ids = {mapping.id_esercente for _, mapping in matched}
+        dati = {}
+        for dato in db.query(DatoCrawled).filter(
+            DatoCrawled.id_esercente.in_(esercenti_ids),
+            DatoCrawled.data == today
+        ).order_by(DatoCrawled.id):
+            dati.setdefault(dato.id_esercente, dato)
+        
+        now = datetime.utcnow()
+        integrated_ids = []
+        for result, mapping in matched:
+            # Crea o aggiorna i dati crawlati
+            dato = dati.get(mapping.id_esercente)
+            if dato is None:
+                dato = DatoCrawled(
+                    id_esercente=mapping.id_esercente,
+                    data=today,
+                    ora=datetime.now().time()
+                )
+                db.add(dato)
+                dati[mapping.id_esercente] = dato
+            
+            # Aggiorna i campi in base al platform
+            if result.platform == "instagram" and result.followers_count:
+                dato.n_followers_ig = result.followers_count
+            elif result.platform == "facebook" and result.followers_count:
+                dato.n_fan_facebook = result.followers_count
+            elif result.platform == "googlemaps" and result.rating:
+                dato.stelle_google = result.rating
+            
+            integrated_ids.append(result.id)
+            
+            # Aggiorna last_crawled per il mapping
+            mapping.last_crawled = now
+        
+        # Marca i risultati come processati con UPDATE a blocchi
+        for i in range(0, len(integrated_ids), 500):
+            db.query(BrightDataResult).filter(
+                BrightDataResult.id.in_(integrated_ids[i:i + 500])
+            ).update({"processed": "integrated"}, synchronize_session=False)
         
         db.commit()
 
+
+def extract_result_fields(platform: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Estrae i campi comuni (followers, post, recensioni, rating) da un risultato grezzo.
+    Funzione pura: nessun accesso al DB, applicabile a blocchi di righe.
+    """
+    followers_count = None
+    posts_count = None
+    reviews_count = None
+    rating = None
+    
+    if platform == "instagram":
+        followers_count = item.get("followers", item.get("follower_count"))
+        posts_count = item.get("posts", item.get("media_count"))
+    
+    elif platform == "facebook":
+        followers_count = item.get("fans", item.get("fan_count"))
+        reviews_count = len(item.get("reviews", []))
+        if item.get("rating"):
+            rating = float(item.get("rating", 0))
+    
+    elif platform == "googlemaps":
+        reviews_count = item.get("reviews_count", len(item.get("reviews", [])))
+        if item.get("rating"):
+            rating = float(item.get("rating", 0))
+    
+    return {
+        "followers_count": followers_count,
+        "posts_count": posts_count,
+        "reviews_count": reviews_count,
+        "rating": rating
+    }
+
+
+def build_result_rows(job_pk: int, platform: str, items: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Righe pronte per l'insert Core su brightdata_results
+    """
+    return [
+        {
+            "job_id": job_pk,
+            "source_url": item.get("url", ""),
+            "platform": platform,
+            "raw_data": item,
+            **extract_result_fields(platform, item)
+        }
+        for item in items
+    ]
+
+
+def normalize_social_url(url: str, platform: str = None) -> str:
+    """
+    Normalizza una URL social per il confronto tra mappature e risultati:
+    schema e host in minuscolo senza www./m., niente slash finale e frammento.
+    La query string è ignorata per Instagram/Facebook, non per Google Maps
+    dove identifica il luogo.
+    """
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ("www.", "m.", "mobile."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = parts.path.rstrip("/")
+    query = "" if platform in ("instagram", "facebook") else parts.query
+    if platform in ("instagram", "facebook"):
+        path = path.lower()
+    return urlunsplit(("https", host, path, query, ""))
+
 brightdata_service = BrightDataService()
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Motore dei suggerimenti per /dashboard
+
+Le regole sono una tabella dichiarativa: ogni regola ha delle soglie sugli
+indicatori dell'esercente e il testo del suggerimento. La tabella viene
+compilata una volta sola all'import; i suggerimenti sono precalcolati
+nello snapshot dell'esercente quando arrivano dati nuovi (snapshot.py),
+quindi la dashboard li legge senza rivalutare le regole.
+
+Indicatori:
+- sentiment: sentiment dell'ultima rilevazione (0.5 se assente)
+- trend_points: numero di punti dell'andamento del sentiment
+- trend_delta: ultimo punto dell'andamento meno il primo
+- follower_growth: crescita relativa di follower IG + fan Facebook nella finestra
+- tripadvisor_rating_delta, stelle_google_delta: variazione dei rating nella finestra
+Una condizione su un indicatore nullo è falsa.
+"""
+import hashlib
+import json
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# finestra (giorni) per crescita follower e variazione dei rating
+GROWTH_WINDOW_DAYS = 30
+
+RULES: List[Dict[str, Any]] = [
+    {
+        "id": "sentiment_basso",
+        "when": {"sentiment": ("<", 0.4)},
+        "tip": "Attiva campagne social mirate e rispondi a recensioni negative.",
+    },
+    {
+        "id": "sentiment_in_calo",
+        "when": {"trend_points": (">=", 3), "trend_delta": ("<", 0)},
+        "tip": "Il sentiment è in calo: pubblica contenuti positivi e offerte.",
+    },
+    {
+        "id": "sentiment_alto",
+        "when": {"sentiment": (">", 0.7)},
+        "tip": "Molto bene! Mantieni la frequenza dei post e incoraggia le recensioni.",
+    },
+    {
+        "id": "follower_in_calo",
+        "when": {"follower_growth": ("<", -0.02)},
+        "tip": "I follower sono in calo nell'ultimo mese: rivedi il piano editoriale e interagisci con i commenti.",
+    },
+    {
+        "id": "follower_in_crescita",
+        "when": {"follower_growth": (">=", 0.10)},
+        "tip": "I follower crescono: è il momento giusto per promozioni riservate ai follower.",
+    },
+    {
+        "id": "tripadvisor_in_calo",
+        "when": {"tripadvisor_rating_delta": ("<=", -0.2)},
+        "tip": "Il rating TripAdvisor è sceso: rispondi alle recensioni recenti e verifica le criticità segnalate.",
+    },
+    {
+        "id": "google_in_calo",
+        "when": {"stelle_google_delta": ("<=", -0.2)},
+        "tip": "Le stelle Google sono in calo: invita i clienti soddisfatti a lasciare una recensione.",
+    },
+]
+
+FALLBACK_TIP = "Mantieni costanza nella comunicazione e monitora i KPI settimanali."
+
+INDICATORS = ("sentiment", "trend_points", "trend_delta", "follower_growth",
+              "tripadvisor_rating_delta", "stelle_google_delta")
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+Condition = Tuple[str, Callable[[Any, Any], bool], float]
+
+
+def compile_rules(rules: List[Dict[str, Any]]) -> List[Tuple[str, Tuple[Condition, ...]]]:
+    """
+    Valida la tabella e la trasforma in (suggerimento, condizioni) con gli operatori già risolti
+    """
+    compiled = []
+    for rule in rules:
+        conditions = []
+        for indicator, (op, threshold) in rule["when"].items():
+            if indicator not in INDICATORS:
+                raise ValueError(f"Regola {rule['id']}: indicatore {indicator} non supportato")
+            if op not in OPERATORS:
+                raise ValueError(f"Regola {rule['id']}: operatore {op} non supportato")
+            conditions.append((indicator, OPERATORS[op], threshold))
+        compiled.append((rule["tip"], tuple(conditions)))
+    return compiled
+
+
+COMPILED_RULES = compile_rules(RULES)
+
+# cambia quando cambia la tabella: i suggerimenti salvati con un'altra versione vanno ricalcolati
+RULES_VERSION = hashlib.sha1(
+    json.dumps([RULES, FALLBACK_TIP], sort_keys=True, ensure_ascii=False).encode()
+).hexdigest()[:12]
+
+
+def evaluate(indicators: Dict[str, Any]) -> List[str]:
+    """
+    Suggerimenti delle regole soddisfatte, nell'ordine della tabella
+    """
+    tips = []
+    for tip, conditions in COMPILED_RULES:
+        for indicator, op, threshold in conditions:
+            value = indicators.get(indicator)
+            if value is None or not op(value, threshold):
+                break
+        else:
+            tips.append(tip)
+    return tips or [FALLBACK_TIP]
+
+
+def _delta(current: Any, baseline: Any) -> Optional[float]:
+    if current is None or baseline is None:
+        return None
+    return round(float(current) - float(baseline), 2)
+
+
+def _followers(row: Any) -> Optional[int]:
+    if row is None or (row.n_followers_ig is None and row.n_fan_facebook is None):
+        return None
+    return (row.n_followers_ig or 0) + (row.n_fan_facebook or 0)
+
+
+def build_indicators(sentiment: Optional[float], trend: List[float],
+                     current: Any = None, baseline: Any = None) -> Dict[str, Any]:
+    """
+    Indicatori delle regole. current e baseline sono l'ultimo dato crawlato e
+    quello di inizio finestra (oggetti con i campi di DatoCrawled), se noti.
+    """
+    followers_now, followers_then = _followers(current), _followers(baseline)
+    growth = None
+    if followers_now is not None and followers_then:
+        growth = round((followers_now - followers_then) / followers_then, 4)
+    return {
+        "sentiment": sentiment if sentiment is not None else 0.5,
+        "trend_points": len(trend),
+        "trend_delta": round(trend[-1] - trend[0], 4) if trend else None,
+        "follower_growth": growth,
+        "tripadvisor_rating_delta": _delta(getattr(current, "tripadvisor_rating", None),
+                                           getattr(baseline, "tripadvisor_rating", None)),
+        "stelle_google_delta": _delta(getattr(current, "stelle_google", None),
+                                      getattr(baseline, "stelle_google", None)),
+    }
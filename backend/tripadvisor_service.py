@@ -4,19 +4,104 @@ TripAdvisor API Integration Service
 Integra le API di TripAdvisor per raccogliere:
 - Recensioni e rating di location
 - Dettagli di business/location 
+
+Le chiamate passano da un httpx.AsyncClient condiviso (connessioni
+keep-alive in pool) su un event loop dedicato, come per Bright Data:
+recensioni e dettagli vengono richiesti in parallelo, ogni chiamata ha un
+timeout e get_combined_data una scadenza complessiva oltre la quale
+restituisce i dati parziali arrivati. Le risposte passano dalla cache di
+tripadvisor_cache.py (stale-while-revalidate, richieste condizionali).
 """
-import requests
+import asyncio
 import logging
 import os
-from typing import Dict, List, Optional
-from datetime import datetime
+import re
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime
+
+import httpx
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+
+import rollup
+from brightdata_client import BackgroundLoop
+from outbound import CircuitOpenError, TokenBucket, get_gate
+from models import DatoCrawled, Esercente
+from snapshot import mark_dirty
+from tripadvisor_cache import CacheKey, TripAdvisorCache
 
 logger = logging.getLogger(__name__)
 
+# chiamate all'API per location (recensioni + dettagli)
+CALLS_PER_LOCATION = 2
+
+# esercenti per query/commit nel salvataggio delle metriche
+SAVE_CHUNK_SIZE = 500
+
+# pagine TripAdvisor con una location (-g<geo>-d<location>-)
+URL_PAGE_TYPES = ("Restaurant_Review", "Hotel_Review", "Attraction_Review", "AttractionProductReview",
+                  "Attraction_Product_Review", "VacationRentalReview", "ShowUserReviews")
+
+# www., m. (mobile) o sottodomini di lingua; domini nazionali (.it, .co.uk, .com.br, ...)
+_LOCATION_URL = re.compile(
+    r"^(?i:(?:https?://)?(?:[a-z0-9-]+\.)*tripadvisor\.[a-z]{2,3}(?:\.[a-z]{2})?(?::\d+)?)"
+    r"/(?:" + "|".join(URL_PAGE_TYPES) + r")-g\d+-d(?P<location_id>\d+)(?=[-./?#]|$)"
+)
+
+
+@lru_cache(maxsize=32768)
+def parse_location_id(url: Optional[str]) -> Optional[str]:
+    """
+    Location ID da un URL TripAdvisor (None se l'URL non è una pagina di una location)
+    """
+    if not url:
+        return None
+    match = _LOCATION_URL.match(url.strip())
+    return match.group("location_id") if match else None
+
+
+def backfill_location_ids(db: Session) -> int:
+    """
+    Location ID degli esercenti salvati prima della colonna tripadvisor_location_id
+    """
+    rows = db.query(Esercente).filter(
+        Esercente.tripadvisor_url.isnot(None),
+        Esercente.tripadvisor_location_id.is_(None)
+    ).all()
+    for e in rows:
+        e.tripadvisor_location_id = parse_location_id(e.tripadvisor_url)
+    updated = sum(e.tripadvisor_location_id is not None for e in rows)
+    db.commit()
+    return updated
+
+
+@event.listens_for(Esercente.tripadvisor_url, "set")
+def _resolve_location_id(target, value, oldvalue, initiator):
+    # risolto una volta alla scrittura: refresh e integrazioni leggono la colonna
+    target.tripadvisor_location_id = parse_location_id(value)
+
+
 class TripAdvisorService:
     def __init__(self):
         self.api_key = os.getenv("TRIPADVISOR_API_KEY")
-        self.base_url = "https://api.content.tripadvisor.com/api/v1"
+        self.base_url = os.getenv("TRIPADVISOR_BASE_URL", "https://api.content.tripadvisor.com/api/v1")
+        
+        # durata massima di ogni chiamata e dell'intero get_combined_data (secondi)
+        self.timeout = float(os.getenv("TRIPADVISOR_TIMEOUT", "10"))
+        self.deadline = float(os.getenv("TRIPADVISOR_DEADLINE", "12"))
+        self.max_connections = int(os.getenv("TRIPADVISOR_MAX_CONNECTIONS", "10"))
+        
+        # pool HTTP condiviso (keep-alive) su un event loop dedicato
+        self._client: Optional[httpx.AsyncClient] = None
+        self.loop = BackgroundLoop("tripadvisor-loop")
+        # rate limit, retry e circuit breaker (outbound.py)
+        self.gate = get_gate("tripadvisor")
+        
+        # risposte in cache per (location_id, lingua, valuta) e refresh in corso (sul loop)
+        self.cache = TripAdvisorCache()
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
         
         if not self.api_key:
             logger.warning("TRIPADVISOR_API_KEY non configurata")
@@ -26,54 +111,93 @@ class TripAdvisorService:
         Estrae location ID dall'URL di TripAdvisor
         Es: https://www.tripadvisor.com/Restaurant_Review-g187849-d123456-Reviews -> 123456
         """
-        try:
-            parts = url.split('-')
-            for part in parts:
-                if part.startswith('d') and part[1:].isdigit():
-                    return part[1:]  # Rimuovi 'd' e restituisci solo il numero
-            
-            # Fallback: cerca pattern numerico
-            import re
-            pattern = r'd(\d+)'
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-                
-            return None
-        except Exception as e:
-            logger.error(f"Errore estrazione location_id da URL {url}: {e}")
-            return None
+        return parse_location_id(url)
     
-    def get_location_reviews(self, location_id: str, language: str = "it") -> Dict:
+    def _ensure_client(self) -> httpx.AsyncClient:
+        # creato pigramente dentro il loop che lo userà
+        if self._client is None:
+            headers = {"accept": "application/json"}
+            if self.api_key:
+                headers["X-TripAdvisor-API-Key"] = self.api_key
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def _get(self, path: str, params: Dict, timeout: float = None, validators: Dict = None) -> httpx.Response:
+        """
+        GET sul pool condiviso, attraverso il gate del provider (retry su 429/5xx);
+        timeout è la durata massima di ogni tentativo.
+        validators (etag/last_modified di una risposta precedente) rendono la richiesta condizionale.
+        """
+        timeout = timeout or self.timeout
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        client = self._ensure_client()
+
+        async def send() -> httpx.Response:
+            # ogni tentativo consuma quota
+            self.cache.count("upstream_calls")
+            return await asyncio.wait_for(
+                client.get(path, params=params, headers=headers,
+                           timeout=httpx.Timeout(timeout, connect=min(5.0, timeout))),
+                timeout,
+            )
+
+        return await self.gate.request(send)
+
+    @staticmethod
+    def _validators(response: httpx.Response) -> Dict:
+        return {k: v for k, v in (("etag", response.headers.get("etag")),
+                                  ("last_modified", response.headers.get("last-modified"))) if v}
+
+    def _error(self, kind: str, e: Exception) -> Dict:
+        self.cache.count("upstream_errors")
+        if isinstance(e, CircuitOpenError):
+            return {"success": False, "error": "Circuit Open", "message": str(e)}
+        if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)):
+            return {"success": False, "error": "Timeout", "message": str(e) or "Timeout"}
+        logger.error(f"Errore chiamata TripAdvisor {kind} API: {e}")
+        return {"success": False, "error": "Connection Error", "message": str(e)}
+
+    async def get_location_reviews_async(self, location_id: str, language: str = "it", timeout: float = None,
+                                         validators: Dict = None) -> Dict:
         """
         Ottiene le recensioni di una location da TripAdvisor
         
         Args:
             location_id: ID della location TripAdvisor
             language: Lingua delle recensioni (default: it)
+            timeout: Durata massima della chiamata in secondi (default: TRIPADVISOR_TIMEOUT)
+            validators: ETag/Last-Modified della risposta in cache (richiesta condizionale)
             
         Returns:
-            Dict con dati delle recensioni
+            Dict con dati delle recensioni ({"success": True, "not_modified": True} se invariate)
         """
         try:
-            url = f"{self.base_url}/location/{location_id}/reviews"
-            headers = {
-                "accept": "application/json",
-                "X-TripAdvisor-API-Key": self.api_key
-            }
-            params = {"language": language}
-            
-            response = requests.get(url, headers=headers, params=params)
+            response = await self._get(f"/location/{location_id}/reviews", {"language": language},
+                                       timeout, validators)
             
+            if response.status_code == 304 and validators:
+                return {"success": True, "not_modified": True}
             if response.status_code == 200:
                 data = response.json()
                 return {
                     "success": True,
                     "data": data,
                     "reviews_count": len(data.get("data", [])),
-                    "extracted_at": datetime.utcnow().isoformat()
+                    "extracted_at": datetime.utcnow().isoformat(),
+                    "validators": self._validators(response)
                 }
             else:
+                self.cache.count("upstream_errors")
                 logger.error(f"Errore API TripAdvisor Reviews: {response.status_code} - {response.text}")
                 return {
                     "success": False,
@@ -81,15 +205,11 @@ class TripAdvisorService:
                     "message": response.text
                 }
                 
-        except Exception as e:
-            logger.error(f"Errore chiamata TripAdvisor Reviews API: {e}")
-            return {
-                "success": False,
-                "error": "Connection Error",
-                "message": str(e)
-            }
+        except (asyncio.TimeoutError, httpx.HTTPError, ValueError) as e:
+            return self._error("Reviews", e)
     
-    def get_location_details(self, location_id: str, language: str = "it", currency: str = "EUR") -> Dict:
+    async def get_location_details_async(self, location_id: str, language: str = "it", currency: str = "EUR",
+                                         timeout: float = None, validators: Dict = None) -> Dict:
         """
         Ottiene i dettagli di una location da TripAdvisor
         
@@ -97,31 +217,28 @@ class TripAdvisorService:
             location_id: ID della location TripAdvisor
             language: Lingua dei dettagli (default: it)
             currency: Valuta per prezzi (default: EUR)
+            timeout: Durata massima della chiamata in secondi (default: TRIPADVISOR_TIMEOUT)
+            validators: ETag/Last-Modified della risposta in cache (richiesta condizionale)
             
         Returns:
-            Dict con dati della location
+            Dict con dati della location ({"success": True, "not_modified": True} se invariati)
         """
         try:
-            url = f"{self.base_url}/location/{location_id}/details"
-            headers = {
-                "accept": "application/json",
-                "X-TripAdvisor-API-Key": self.api_key
-            }
-            params = {
-                "language": language,
-                "currency": currency
-            }
-            
-            response = requests.get(url, headers=headers, params=params)
+            response = await self._get(f"/location/{location_id}/details",
+                                       {"language": language, "currency": currency}, timeout, validators)
             
+            if response.status_code == 304 and validators:
+                return {"success": True, "not_modified": True}
             if response.status_code == 200:
                 data = response.json()
                 return {
                     "success": True,
                     "data": data,
-                    "extracted_at": datetime.utcnow().isoformat()
+                    "extracted_at": datetime.utcnow().isoformat(),
+                    "validators": self._validators(response)
                 }
             else:
+                self.cache.count("upstream_errors")
                 logger.error(f"Errore API TripAdvisor Details: {response.status_code} - {response.text}")
                 return {
                     "success": False,
@@ -129,30 +246,123 @@ class TripAdvisorService:
                     "message": response.text
                 }
                 
-        except Exception as e:
-            logger.error(f"Errore chiamata TripAdvisor Details API: {e}")
-            return {
-                "success": False,
-                "error": "Connection Error",
-                "message": str(e)
-            }
+        except (asyncio.TimeoutError, httpx.HTTPError, ValueError) as e:
+            return self._error("Details", e)
     
-    def get_combined_data(self, location_id: str) -> Dict:
+    async def fetch_sides_async(self, location_id: str, language: str = "it", currency: str = "EUR",
+                                deadline: float = None, cached: Dict = None) -> Tuple[Dict, Dict]:
+        """
+        Recensioni e dettagli con due chiamate concorrenti, entro deadline secondi.
+        Con una entry in cache le chiamate sono condizionali: una risposta 304, o un
+        errore, riusa la parte in cache.
+        """
+        deadline = deadline or self.deadline
+        timeout = min(self.timeout, deadline)
+        cached = cached or {}
+        validators = {kind: cached[kind].get("validators") for kind in ("reviews", "details")
+                      if cached.get(kind, {}).get("success")}
+        calls = {
+            "reviews": asyncio.ensure_future(self.get_location_reviews_async(
+                location_id, language, timeout, validators.get("reviews"))),
+            "details": asyncio.ensure_future(self.get_location_details_async(
+                location_id, language, currency, timeout, validators.get("details"))),
+        }
+        await asyncio.wait(calls.values(), timeout=deadline)
+        results = {}
+        for kind, task in calls.items():
+            if task.done():
+                result = task.result()
+            else:
+                task.cancel()
+                self.cache.count("upstream_errors")
+                result = {"success": False, "error": "Timeout", "message": f"Nessuna risposta entro {deadline}s"}
+            if result.get("not_modified"):
+                self.cache.count("not_modified")
+                result = {k: v for k, v in cached[kind].items() if k != "stale"}
+            elif not result["success"] and cached.get(kind, {}).get("success"):
+                # la parte in cache resta servibile ma la entry non sarà fresca
+                result = {**cached[kind], "stale": True}
+            results[kind] = result
+        return results["reviews"], results["details"]
+
+    async def _refresh(self, key: CacheKey, cached: Dict = None) -> Dict:
         """
-        Ottiene sia recensioni che dettagli di una location
+        Scarica e salva in cache una location; chiamate concorrenti per la stessa chiave
+        condividono la stessa richiesta all'API
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(key, cached))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, key: CacheKey, cached: Dict = None) -> Dict:
+        reviews, details = await self.fetch_sides_async(*key, cached=cached)
+        entry = {"reviews": reviews, "details": details, "fetched_at": time.time()}
+        if reviews["success"] or details["success"]:
+            await asyncio.to_thread(self.cache.put, key, entry)
+        return entry
+
+    def _revalidate(self, key: CacheKey, cached: Dict):
+        # refresh in background: la risposta corrente usa la entry stale
+        if key in self._inflight:
+            return
+        self.cache.count("revalidations")
+        task = asyncio.ensure_future(self._refresh(key, cached))
+        task.add_done_callback(self._log_refresh_error)
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Errore refresh cache TripAdvisor: {task.exception()}")
+
+    async def get_combined_data_async(self, location_id: str, language: str = "it", currency: str = "EUR",
+                                      bypass_cache: bool = False, allow_stale: bool = True) -> Dict:
+        """
+        Recensioni e dettagli di una location, dalla cache se possibile.
+        Una entry fresca viene restituita senza chiamare l'API; una entry stale viene
+        restituita subito e aggiornata in background (con allow_stale=False viene
+        aggiornata prima di rispondere); altrimenti (o con bypass_cache) le due
+        chiamate partono in parallelo e il risultato può essere parziale
+        (partial=True) se una scade o fallisce.
         
         Returns:
-            Dict combinato con tutti i dati
+            Dict combinato con tutti i dati (cache: hit, stale, revalidated, miss, bypass)
+        """
+        key = (location_id, language, currency)
+        if bypass_cache:
+            self.cache.count("bypasses")
+            entry = await self._refresh(key)
+            return self.combine_data(location_id, entry["reviews"], entry["details"], "bypass")
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            if self.cache.is_fresh(cached):
+                self.cache.count("fresh_hits")
+                return self.combine_data(location_id, cached["reviews"], cached["details"], "hit")
+            if not allow_stale:
+                self.cache.count("revalidations")
+                entry = await self._refresh(key, cached)
+                return self.combine_data(location_id, entry["reviews"], entry["details"], "revalidated")
+            self.cache.count("stale_hits")
+            self._revalidate(key, cached)
+            return self.combine_data(location_id, cached["reviews"], cached["details"], "stale")
+        self.cache.count("misses")
+        entry = await self._refresh(key)
+        return self.combine_data(location_id, entry["reviews"], entry["details"], "miss")
+
+    def combine_data(self, location_id: str, reviews: Dict, details: Dict, cache: str = None) -> Dict:
+        """
+        Combina le risposte di recensioni e dettagli: success se almeno una è riuscita
         """
         try:
-            reviews = self.get_location_reviews(location_id)
-            details = self.get_location_details(location_id)
-            
             # Estrai metriche chiave
             extracted_data = {
                 "location_id": location_id,
                 "extracted_at": datetime.utcnow().isoformat(),
-                "success": reviews["success"] and details["success"]
+                "success": reviews["success"] or details["success"],
+                "partial": reviews["success"] != details["success"],
+                "cache": cache
             }
             
             if reviews["success"]:
@@ -173,6 +383,11 @@ class TripAdvisorService:
                     "website": details_data.get("website")
                 })
             
+            if not extracted_data["success"]:
+                # entrambe fallite: riporta il primo errore
+                extracted_data.update({"error": details.get("error") or reviews.get("error"),
+                                       "message": details.get("message") or reviews.get("message")})
+            
             # Aggiungi dati raw per debug
             extracted_data["raw_reviews"] = reviews
             extracted_data["raw_details"] = details
@@ -186,6 +401,73 @@ class TripAdvisorService:
                 "error": "Processing Error", 
                 "message": str(e)
             }
+
+    async def refresh_locations_async(self, location_ids: List[str], concurrency: int, rate: float,
+                                      max_calls: int, language: str = "it", currency: str = "EUR") -> Dict:
+        """
+        Dati di molte location (refresh periodico): al massimo concurrency location
+        in parallelo, rate chiamate all'API al secondo e max_calls chiamate in
+        tutto. Le location con una entry fresca in cache non consumano quota;
+        quelle oltre il budget vengono saltate.
+        
+        Returns:
+            {"results": {location_id: dati combinati}, "skipped": [location_id]}
+        """
+        limiter = TokenBucket(rate, burst=max(rate, CALLS_PER_LOCATION))
+        semaphore = asyncio.Semaphore(concurrency)
+        results, skipped = {}, []
+        reserved = 0  # chiamate prenotate (il loop è single thread: nessun lock)
+
+        async def refresh(location_id: str):
+            nonlocal reserved
+            async with semaphore:
+                cached = await asyncio.to_thread(self.cache.get, (location_id, language, currency))
+                if cached is None or not self.cache.is_fresh(cached):
+                    if reserved + CALLS_PER_LOCATION > max_calls:
+                        skipped.append(location_id)
+                        return
+                    reserved += CALLS_PER_LOCATION
+                    await limiter.acquire(CALLS_PER_LOCATION)
+                results[location_id] = await self.get_combined_data_async(
+                    location_id, language, currency, allow_stale=False)
+
+        await asyncio.gather(*(refresh(location_id) for location_id in location_ids))
+        return {"results": results, "skipped": skipped}
+
+    # --- API sincrona: wrapper sul loop del client asincrono ---
+
+    def get_location_reviews(self, location_id: str, language: str = "it") -> Dict:
+        return self.loop.run(self.get_location_reviews_async(location_id, language))
+
+    def get_location_details(self, location_id: str, language: str = "it", currency: str = "EUR") -> Dict:
+        return self.loop.run(self.get_location_details_async(location_id, language, currency))
+
+    def get_combined_data(self, location_id: str, language: str = "it", currency: str = "EUR",
+                          bypass_cache: bool = False) -> Dict:
+        """
+        Versione sincrona di get_combined_data_async (per gli endpoint def e lo scheduler)
+        """
+        return self.loop.run(self.get_combined_data_async(location_id, language, currency, bypass_cache))
+
+    def refresh_locations(self, location_ids: List[str], concurrency: int, rate: float, max_calls: int) -> Dict:
+        return self.loop.run(self.refresh_locations_async(location_ids, concurrency, rate, max_calls))
+
+    def cache_stats(self) -> Dict:
+        return {**self.cache.stats(), "inflight": len(self._inflight)}
+
+    async def _aclose(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def close(self):
+        """
+        Annulla i refresh in corso e chiude il pool HTTP (allo shutdown dell'applicazione)
+        """
+        if self._client is not None or self._inflight:
+            self.loop.run(self._aclose())
     
     def extract_metrics_for_integration(self, tripadvisor_data: Dict) -> Dict:
         """
@@ -218,5 +500,94 @@ class TripAdvisorService:
             return {}
 
 
+    @staticmethod
+    def metrics_from_details(tripadvisor_data: Dict) -> Optional[Dict]:
+        """
+        Rating e numero totale di recensioni dai dettagli della location (None se mancano).
+        A differenza di extract_metrics_for_integration non ripiega sul numero di
+        recensioni della pagina scaricata, che non è il totale.
+        """
+        if not tripadvisor_data.get("success") or not tripadvisor_data["raw_details"].get("success"):
+            return None
+        try:
+            rating, num_reviews = tripadvisor_data.get("rating"), tripadvisor_data.get("num_reviews")
+            metrics = {
+                "tripadvisor_rating": float(rating) if rating not in (None, "") else None,
+                "tripadvisor_reviews": int(num_reviews) if num_reviews not in (None, "") else None,
+            }
+        except (TypeError, ValueError) as e:
+            logger.error(f"Metriche TripAdvisor non valide per {tripadvisor_data.get('location_id')}: {e}")
+            return None
+        return metrics if any(v is not None for v in metrics.values()) else None
+
+    @staticmethod
+    def _latest_rows(db: Session, ids: List[int]) -> Dict[int, DatoCrawled]:
+        """
+        Ultimo dato crawlato (stesso ordinamento dello snapshot) di ogni esercente, con una query
+        """
+        if not ids:
+            return {}
+        ranked = (select(DatoCrawled.id, func.row_number().over(
+                      partition_by=DatoCrawled.id_esercente,
+                      order_by=(DatoCrawled.data.desc().nullslast(), DatoCrawled.ora.desc().nullslast())
+                  ).label("posizione"))
+                  .where(DatoCrawled.id_esercente.in_(ids))
+                  .subquery())
+        rows = (db.query(DatoCrawled)
+                  .join(ranked, ranked.c.id == DatoCrawled.id)
+                  .filter(ranked.c.posizione == 1))
+        return {row.id_esercente: row for row in rows}
+
+    def save_metrics(self, db: Session, metrics: Dict[int, Dict]) -> Dict[str, int]:
+        """
+        Upsert di rating e recensioni nel dato crawlato di oggi di ogni esercente
+        ({id_esercente: metriche}): una query per blocco di esercenti, gli
+        esistenti aggiornati solo se cambiati, i nuovi con una insert Core.
+        Le righe nuove riportano le altre metriche dall'ultimo dato crawlato:
+        lo snapshot mostra l'ultima riga, che altrimenti azzererebbe fan,
+        follower e stelle Google.
+        """
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        today = date.today()
+        ora = datetime.now().time().replace(microsecond=0)
+        ids = list(metrics)
+        for i in range(0, len(ids), SAVE_CHUNK_SIZE):
+            chunk = ids[i:i + SAVE_CHUNK_SIZE]
+            dati = {}
+            # stessa riga che lo snapshot considera l'ultima della giornata
+            for dato in db.query(DatoCrawled).filter(
+                DatoCrawled.id_esercente.in_(chunk),
+                DatoCrawled.data == today
+            ).order_by(DatoCrawled.ora.desc().nullslast(), DatoCrawled.id.desc()):
+                dati.setdefault(dato.id_esercente, dato)
+            previous = self._latest_rows(db, [id_esercente for id_esercente in chunk if id_esercente not in dati])
+            
+            new_rows = []
+            for id_esercente in chunk:
+                values = metrics[id_esercente]
+                dato = dati.get(id_esercente)
+                if dato is None:
+                    last = previous.get(id_esercente)
+                    row = {m: getattr(last, m) if last is not None else None for m in rollup.METRICS}
+                    row.update({field: value for field, value in values.items() if value is not None})
+                    new_rows.append({"id_esercente": id_esercente, "data": today, "ora": ora, **row})
+                    continue
+                changed = False
+                for field, value in values.items():
+                    current = getattr(dato, field)
+                    if value is not None and (current is None or float(current) != value):
+                        setattr(dato, field, value)
+                        changed = True
+                counts["updated" if changed else "unchanged"] += 1
+            
+            if new_rows:
+                db.execute(insert(DatoCrawled.__table__), new_rows)
+                # le insert Core non passano dagli eventi ORM: snapshot e rollup vanno aggiornati a mano
+                mark_dirty(db, {r["id_esercente"] for r in new_rows})
+                rollup.add_samples(db, new_rows)
+                counts["inserted"] += len(new_rows)
+            db.commit()
+        return counts
+
 # Istanza globale del servizio
 tripadvisor_service = TripAdvisorService()
\ No newline at end of file
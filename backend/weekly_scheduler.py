@@ -1,12 +1,16 @@
 import os
+import time
 import asyncio
 import logging
+import threading
+from collections import deque
 from datetime import datetime, date, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from database import SessionLocal
-from models import WeeklyCrawlSchedule, EsercenteSocialMapping, BrightDataJob
+from models import WeeklyCrawlSchedule, EsercenteSocialMapping, BrightDataJob, Esercente
 from brightdata_service import brightdata_service
+from tripadvisor_service import tripadvisor_service
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +18,19 @@ class WeeklyCrawlScheduler:
     def __init__(self):
         self.scheduler = BackgroundScheduler()
         self.scheduler.start()
+        self.check_concurrency = int(os.getenv("JOB_CHECKER_CONCURRENCY", "8"))
+        # secondi massimi di attesa del prossimo evento dai download (status, chunk, fine)
+        self.check_event_timeout = float(os.getenv("JOB_CHECKER_EVENT_TIMEOUT", "300"))
+        # metriche delle ultime esecuzioni del job checker
+        self.job_checker_runs = deque(maxlen=int(os.getenv("JOB_CHECKER_HISTORY", "48")))
+        # refresh TripAdvisor: concorrenza, chiamate al secondo e chiamate massime per esecuzione
+        self.tripadvisor_concurrency = int(os.getenv("TRIPADVISOR_REFRESH_CONCURRENCY", "4"))
+        self.tripadvisor_rate = float(os.getenv("TRIPADVISOR_REFRESH_RATE", "5"))
+        self.tripadvisor_max_calls = int(os.getenv("TRIPADVISOR_REFRESH_MAX_CALLS", "2000"))
+        self.tripadvisor_runs = deque(maxlen=int(os.getenv("TRIPADVISOR_REFRESH_HISTORY", "30")))
+        # metriche dell'esecuzione in corso (None se non ce n'è una)
+        self.tripadvisor_current = None
+        self._tripadvisor_lock = threading.Lock()
         logger.info("Weekly crawl scheduler started")
     
     def schedule_weekly_crawls(self):
@@ -155,12 +172,48 @@ class WeeklyCrawlScheduler:
         finally:
             db.close()
     
+    async def _poll_job(self, job_id: str, semaphore: asyncio.Semaphore, queue: asyncio.Queue):
+        """
+        Controlla lo status di un job e, se completato, ne scarica lo snapshot in streaming.
+        Gli eventi vanno in una coda limitata letta dall'unico writer su DB:
+        ("status", risposta), ("chunk", righe), ("done", None), ("error", messaggio)
+        """
+        async with semaphore:
+            try:
+                status_response = await brightdata_service.get_job_status_async(job_id)
+                await queue.put((job_id, "status", status_response))
+                if status_response.get("status") != "completed":
+                    return
+                async for chunk in brightdata_service.iter_job_results_async(job_id):
+                    await queue.put((job_id, "chunk", chunk))
+                await queue.put((job_id, "done", None))
+            except Exception as e:
+                await queue.put((job_id, "error", str(e)))
+    
     def check_and_process_completed_jobs(self):
         """
-        Controlla i job completati e li processa automaticamente
+        Controlla i job completati e li processa automaticamente.
+        Status e download sono eseguiti in parallelo (max check_concurrency),
+        le scritture su DB restano sequenziali su un'unica sessione.
+        La coda tra download e writer è limitata, quindi la memoria usata non
+        dipende dalla dimensione degli snapshot. Se per check_event_timeout secondi
+        non arriva nessun evento l'esecuzione si interrompe: i job rimasti "triggered"
+        vengono ripresi al controllo successivo.
         """
         logger.info("Checking for completed jobs to process")
+        started = time.monotonic()
+        metrics = {
+            "started_at": datetime.utcnow(),
+            "duration_seconds": None,
+            "jobs_checked": 0,
+            "jobs_processed": 0,
+            "jobs_failed": 0,
+            "results_saved": 0,
+            "errors": 0,
+        }
         
+        loop = brightdata_service.loop
+        polls = []
         db = SessionLocal()
         try:
             # Trova job completati non ancora processati
@@ -168,42 +221,102 @@ class WeeklyCrawlScheduler:
                 BrightDataJob.status == "triggered",
                 BrightDataJob.created_at >= datetime.utcnow() - timedelta(days=7)
             ).all()
+            metrics["jobs_checked"] = len(completed_jobs)
+            if not completed_jobs:
+                return
+            
+            jobs = {job.job_id: job for job in completed_jobs}
+            result_counts = {job_id: 0 for job_id in jobs}
+            semaphore, queue = loop.run(self._make_pipeline())
+            polls = loop.run(self._start_polls(list(jobs), semaphore, queue))
             
-            for job in completed_jobs:
+            # unico writer: gli eventi vengono salvati man mano che arrivano
+            pending = set(jobs)
+            broken = set()  # job con errori di scrittura: il resto dello stream viene scartato
+            while pending:
                 try:
-                    # Controlla lo status del job
-                    status_response = brightdata_service.get_job_status(job.job_id)
-                    
-                    if status_response.get("status") == "completed":
-                        logger.info(f"Processing completed job: {job.job_id}")
-                        
-                        # Recupera e processa i risultati
-                        results_response = brightdata_service.get_job_results(job.job_id)
-                        
-                        if results_response.get("success"):
-                            results_data = results_response.get("data", [])
-                            brightdata_service.save_results_to_db(db, job, results_data)
-                            brightdata_service.integrate_with_esercenti(db, job)
-                            
-                            logger.info(f"Successfully processed {len(results_data)} results for job {job.job_id}")
-                        else:
+                    job_id, kind, payload = loop.run(asyncio.wait_for(queue.get(), self.check_event_timeout))
+                except asyncio.TimeoutError:
+                    metrics["errors"] += 1
+                    logger.error(f"No job events for {self.check_event_timeout}s, "
+                                 f"{len(pending)} jobs left for the next check")
+                    for job_id in pending:
+                        if job_id in broken:
+                            brightdata_service.fail_job(db, jobs[job_id], "Error saving results")
+                            metrics["jobs_failed"] += 1
+                        elif result_counts[job_id]:
+                            # download interrotto: il controllo successivo lo riprende da zero
+                            brightdata_service.discard_results(db, jobs[job_id])
+                    break
+                job = jobs[job_id]
+                if job_id in broken:
+                    if kind in ("done", "error"):
+                        pending.discard(job_id)
+                        brightdata_service.fail_job(db, job, "Error saving results")
+                        metrics["jobs_failed"] += 1
+                    continue
+                try:
+                    if kind == "status":
+                        if payload.get("status") == "completed":
+                            logger.info(f"Processing completed job: {job_id}")
+                            continue
+                        pending.discard(job_id)
+                        if payload.get("status") == "failed":
                             job.status = "failed"
-                            job.error_message = results_response.get("error", "Failed to retrieve results")
+                            job.error_message = "Job failed on Bright Data"
+                            job.completed_at = datetime.utcnow()
                             db.commit()
-                            logger.error(f"Failed to retrieve results for job {job.job_id}")
+                            metrics["jobs_failed"] += 1
+                            logger.error(f"Job {job_id} failed on Bright Data")
                     
-                    elif status_response.get("status") == "failed":
-                        job.status = "failed"
-                        job.error_message = "Job failed on Bright Data"
-                        job.completed_at = datetime.utcnow()
-                        db.commit()
-                        logger.error(f"Job {job.job_id} failed on Bright Data")
+                    elif kind == "chunk":
+                        brightdata_service.save_results_chunk(db, job, payload)
+                        result_counts[job_id] += len(payload)
+                    
+                    elif kind == "done":
+                        pending.discard(job_id)
+                        brightdata_service.complete_job(db, job, result_counts[job_id])
+                        brightdata_service.integrate_with_esercenti(db, job)
+                        metrics["jobs_processed"] += 1
+                        metrics["results_saved"] += result_counts[job_id]
+                        logger.info(f"Successfully processed {result_counts[job_id]} results for job {job_id}")
+                    
+                    elif kind == "error":
+                        pending.discard(job_id)
+                        brightdata_service.fail_job(db, job, payload or "Failed to retrieve results")
+                        metrics["jobs_failed"] += 1
+                        logger.error(f"Failed to retrieve results for job {job_id}: {payload}")
                 
                 except Exception as e:
-                    logger.error(f"Error processing job {job.job_id}: {e}")
+                    db.rollback()
+                    metrics["errors"] += 1
+                    if kind == "chunk":
+                        broken.add(job_id)
+                    logger.error(f"Error processing job {job_id}: {e}")
         
         finally:
+            if polls:
+                # download ancora in corso (timeout o errore): fermati prima di chiudere la sessione
+                loop.run(self._stop_polls(polls))
             db.close()
+            metrics["duration_seconds"] = round(time.monotonic() - started, 3)
+            self.job_checker_runs.append(metrics)
+            logger.info(
+                f"Job checker run: {metrics['jobs_checked']} checked, {metrics['jobs_processed']} processed, "
+                f"{metrics['jobs_failed']} failed in {metrics['duration_seconds']}s"
+            )
+    
+    async def _make_pipeline(self):
+        # semaforo e coda vanno creati dentro il loop che li userà
+        return asyncio.Semaphore(self.check_concurrency), asyncio.Queue(maxsize=self.check_concurrency * 2)
+    
+    async def _start_polls(self, job_ids: list, semaphore: asyncio.Semaphore, queue: asyncio.Queue) -> list:
+        return [asyncio.create_task(self._poll_job(job_id, semaphore, queue)) for job_id in job_ids]
+    
+    async def _stop_polls(self, polls: list):
+        for task in polls:
+            task.cancel()
+        await asyncio.gather(*polls, return_exceptions=True)
     
     def schedule_job_checker(self):
         """
@@ -218,12 +331,140 @@ class WeeklyCrawlScheduler:
         )
         logger.info("Job checker scheduled to run every hour")
     
+    def run_tripadvisor_refresh(self) -> dict:
+        """
+        Aggiorna rating e recensioni TripAdvisor di tutti gli esercenti con tripadvisor_url.
+        Ogni location viene scaricata una volta sola (anche se condivisa da più esercenti),
+        con concorrenza, chiamate al secondo e chiamate totali limitate; i dati di oggi
+        vengono salvati in blocco. Le metriche dell'esecuzione finiscono in tripadvisor_runs.
+        """
+        if not self._tripadvisor_lock.acquire(blocking=False):
+            logger.info("TripAdvisor refresh already running")
+            return {"skipped": "already running"}
+        
+        logger.info("Starting TripAdvisor refresh")
+        started = time.monotonic()
+        calls_before = tripadvisor_service.cache.stats()["upstream_calls"]
+        metrics = {
+            "started_at": datetime.utcnow(),
+            "duration_seconds": None,
+            "esercenti": 0,
+            "locations": 0,
+            "invalid_urls": 0,
+            "fetched": 0,
+            "from_cache": 0,
+            "failed": 0,
+            "skipped_quota": 0,
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "api_calls": 0,
+            "max_calls": self.tripadvisor_max_calls,
+            "locations_per_second": None,
+        }
+        self.tripadvisor_current = metrics
+        
+        db = SessionLocal()
+        try:
+            esercenti = db.query(
+                Esercente.id_esercente, Esercente.tripadvisor_location_id, Esercente.tripadvisor_url
+            ).filter(
+                Esercente.tripadvisor_url.isnot(None),
+                Esercente.tripadvisor_url != ""
+            ).all()
+            metrics["esercenti"] = len(esercenti)
+            
+            # location -> esercenti che la usano (location_id salvato alla scrittura dell'URL)
+            by_location = {}
+            for id_esercente, location_id, url in esercenti:
+                location_id = location_id or tripadvisor_service.extract_location_id(url)
+                if location_id is None:
+                    metrics["invalid_urls"] += 1
+                    continue
+                by_location.setdefault(location_id, []).append(id_esercente)
+            metrics["locations"] = len(by_location)
+            if not by_location:
+                return metrics
+            
+            refreshed = tripadvisor_service.refresh_locations(
+                list(by_location), self.tripadvisor_concurrency, self.tripadvisor_rate, self.tripadvisor_max_calls
+            )
+            metrics["skipped_quota"] = len(refreshed["skipped"])
+            
+            values = {}
+            for location_id, data in refreshed["results"].items():
+                location_metrics = tripadvisor_service.metrics_from_details(data)
+                if location_metrics is None:
+                    metrics["failed"] += 1
+                    continue
+                metrics["from_cache" if data.get("cache") == "hit" else "fetched"] += 1
+                for id_esercente in by_location[location_id]:
+                    values[id_esercente] = location_metrics
+            
+            metrics.update(tripadvisor_service.save_metrics(db, values))
+            return metrics
+        
+        except Exception as e:
+            db.rollback()
+            metrics["error"] = str(e)
+            logger.error(f"Error in TripAdvisor refresh: {e}")
+            return metrics
+        finally:
+            db.close()
+            duration = time.monotonic() - started
+            metrics["duration_seconds"] = round(duration, 3)
+            metrics["api_calls"] = tripadvisor_service.cache.stats()["upstream_calls"] - calls_before
+            processed = metrics["fetched"] + metrics["from_cache"] + metrics["failed"]
+            metrics["locations_per_second"] = round(processed / duration, 2) if duration > 0 else None
+            self.tripadvisor_runs.append(metrics)
+            self.tripadvisor_current = None
+            self._tripadvisor_lock.release()
+            logger.info(
+                f"TripAdvisor refresh: {metrics['locations']} locations, {metrics['fetched']} fetched, "
+                f"{metrics['from_cache']} from cache, {metrics['failed']} failed, "
+                f"{metrics['skipped_quota']} over quota, {metrics['api_calls']} API calls "
+                f"in {metrics['duration_seconds']}s"
+            )
+    
+    def trigger_tripadvisor_refresh(self) -> bool:
+        """
+        Accoda un refresh TripAdvisor immediato nello scheduler (senza attenderne la fine).
+        False se un refresh è già in corso.
+        """
+        if self.tripadvisor_current is not None:
+            return False
+        self.scheduler.add_job(
+            func=self.run_tripadvisor_refresh,
+            trigger='date',
+            run_date=datetime.now(),
+            id='tripadvisor_refresh_now',
+            name='Manual TripAdvisor Refresh',
+            replace_existing=True
+        )
+        logger.info("TripAdvisor refresh queued")
+        return True
+    
+    def schedule_tripadvisor_refresh(self):
+        """
+        Schedula il refresh TripAdvisor ogni giorno (TRIPADVISOR_REFRESH_HOUR, default 4:00)
+        """
+        hour = int(os.getenv("TRIPADVISOR_REFRESH_HOUR", "4"))
+        self.scheduler.add_job(
+            func=self.run_tripadvisor_refresh,
+            trigger=CronTrigger(hour=hour, minute=0),
+            id='tripadvisor_refresh',
+            name='Daily TripAdvisor Refresh',
+            replace_existing=True
+        )
+        logger.info(f"TripAdvisor refresh scheduled every day at {hour}:00")
+    
     def start_all_schedules(self):
         """
         Avvia tutti gli scheduler
         """
         self.schedule_weekly_crawls()
         self.schedule_job_checker()
+        self.schedule_tripadvisor_refresh()
         logger.info("All schedulers started successfully")
     
     def stop(self):
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark di 1000 client simultanei: endpoint sync (threadpool) contro async
+
+Avvia uvicorn con l'applicazione e due route di confronto con la stessa
+logica di /dashboard:
+- /bench/dashboard-sync: def con sessione sincrona, come prima delle
+  sessioni asincrone (un thread del threadpool occupato per richiesta)
+- /bench/dashboard-async: async def sulla sessione asincrona (main.dashboard)
+Con --io-latency entrambe attendono anche una chiamata esterna simulata
+(time.sleep contro asyncio.sleep), come un provider lento.
+Ogni client ripete le richieste per --duration secondi su una connessione
+propria; si riportano req/s, latenze ed errori.
+
+Uso: python bench_async.py [--clients 1000] [--duration 15] [--io-latency 0.05]
+     [--database-url URL]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+import bench_common
+
+
+def create_app():
+    """Factory per uvicorn: l'applicazione di main.py più le route di confronto"""
+    from fastapi import Depends, HTTPException
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import Session
+
+    import main
+    from auth import get_async_db, get_db
+    from snapshot import get_esercente_with_snapshot
+
+    io_latency = float(os.getenv("BENCH_IO_LATENCY", "0"))
+
+    @main.app.get("/bench/dashboard-sync")
+    def dashboard_sync(id_esercente: int, token: str = Depends(main.require_token), db: Session = Depends(get_db)):
+        if io_latency:
+            time.sleep(io_latency)
+        e, snap = get_esercente_with_snapshot(db, id_esercente)
+        if not e:
+            raise HTTPException(404, "Esercente non trovato")
+        return {
+            **main.showcase_payload(e, snap),
+            "messaggio": "Sintesi automatica in base a sentiment e trend",
+            "andamento_sentiment": snap.andamento_sentiment or [],
+            "suggerimenti": snap.suggerimenti or [],
+        }
+
+    @main.app.get("/bench/dashboard-async")
+    async def dashboard_async(id_esercente: int, token: str = Depends(main.require_token),
+                              db: AsyncSession = Depends(get_async_db)):
+        if io_latency:
+            await asyncio.sleep(io_latency)
+        return await main.dashboard(id_esercente, False, token, db)
+
+    return main.app
+
+
+async def run_clients(base_url: str, path: str, token: str, ids: list, clients: int, duration: float) -> dict:
+    samples, errors = [], 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {token}"},
+                                 limits=limits, timeout=120) as client:
+        async def kiosk(seed: int):
+            nonlocal errors
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, params={"id_esercente": rng.choice(ids)})
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    samples.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(kiosk(i) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+    return {"req_al_secondo": round(len(samples) / elapsed), **bench_common.latency_summary(samples),
+            "errori": errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--io-latency", type=float, default=0.0, help="secondi di attesa esterna simulata")
+    parser.add_argument("--esercenti", type=int, default=500)
+    parser.add_argument("--database-url", help="database già vuoto da usare al posto di un SQLite temporaneo")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"📊 BENCHMARK {args.clients} CLIENT SIMULTANEI: SYNC CONTRO ASYNC")
+    print("=" * 60)
+    url = bench_common.use_database(args.database_url)
+    bench_common.create_schema()
+    ids = bench_common.seed_esercenti(args.esercenti)
+    bench_common.seed_dati_crawled(ids, 30)
+    bench_common.seed_rilevazioni(ids, 10)
+    print(f"🗄️  {url}: {len(ids)} esercenti, attesa esterna simulata {args.io_latency * 1000:.0f} ms")
+
+    server, base_url = bench_common.start_server(
+        "bench_async:create_app", ["--factory", "--backlog", str(max(2048, args.clients * 2))],
+        env={"BENCH_IO_LATENCY": str(args.io_latency)},
+    )
+    results = []
+    try:
+        token = httpx.post(f"{base_url}/get-token", json={"email": "admin@example.com", "password": "admin"}).json()["token"]
+        with httpx.Client(base_url=base_url, headers={"Authorization": f"Bearer {token}"}, timeout=60) as client:
+            for id_esercente in ids:
+                client.get("/dashboard", params={"id_esercente": id_esercente})
+
+        for label, path in (("sync (threadpool)", "/bench/dashboard-sync"), ("async", "/bench/dashboard-async")):
+            print(f"⏳ {label}...")
+            result = asyncio.run(run_clients(base_url, path, token, ids, args.clients, args.duration))
+            results.append({"endpoint": label, **result})
+    finally:
+        server.terminate()
+        server.wait()
+
+    print()
+    bench_common.print_table(results, ("endpoint", "req_al_secondo", "p50_ms", "p95_ms", "p99_ms", "errori"))
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
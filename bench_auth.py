@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del costo di autenticazione per richiesta, con e senza la cache dei token
+
+Per --kiosks token distinti (uno per kiosk in polling) ripete --calls
+verifiche, a rotazione, e misura il costo per chiamata di:
+- jwt.decode: firma HMAC + parsing dei claims a ogni richiesta (senza cache)
+- decode_token, cache vuota: jwt.decode + inserimento in cache
+- decode_token, cache calda: sha256 del token + lookup nella LRU
+- require_token di main.py (dipendenza Bearer) con la cache calda
+Il database non viene toccato: basta un SQLite temporaneo per l'import.
+
+Uso: python bench_auth.py [--kiosks 1000] [--calls 200000]
+"""
+
+import argparse
+import time
+
+import bench_common
+
+
+def per_call(fn, tokens: list, calls: int) -> dict:
+    samples = []
+    n = len(tokens)
+    for i in range(calls):
+        token = tokens[i % n]
+        started = time.perf_counter()
+        fn(token)
+        samples.append(time.perf_counter() - started)
+    us = lambda seconds: round(seconds * 1e6, 2)
+    return {"chiamate": calls, "us_per_chiamata": us(sum(samples) / calls),
+            "p50_us": us(bench_common.percentile(samples, 50)), "p99_us": us(bench_common.percentile(samples, 99)),
+            "chiamate_al_secondo": round(calls / sum(samples))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--kiosks", type=int, default=1000, help="token distinti in rotazione")
+    parser.add_argument("--calls", type=int, default=200_000)
+    args = parser.parse_args()
+    bench_common.use_database()
+
+    from fastapi.security import HTTPAuthorizationCredentials
+    from jose import jwt
+
+    import auth
+    import main as app_main
+
+    print("=" * 60)
+    print("📊 MICROBENCHMARK AUTENTICAZIONE PER RICHIESTA")
+    print("=" * 60)
+    tokens = [auth.create_access_token(f"kiosk{i}@example.com") for i in range(args.kiosks)]
+    print(f"🔑 {len(tokens)} token, {args.calls} verifiche per percorso")
+
+    def uncached_decode(token):
+        auth.token_cache.clear()
+        return auth.decode_token(token)
+
+    def require_token(token):
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        coroutine = app_main.require_token(credentials)
+        # nessun await all'interno: la coroutine termina al primo send
+        try:
+            coroutine.send(None)
+        except StopIteration:
+            pass
+
+    paths = {
+        "jwt.decode (senza cache)": lambda token: jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM]),
+        "decode_token, cache vuota": uncached_decode,
+        "decode_token, cache calda": auth.decode_token,
+        "require_token, cache calda": require_token,
+    }
+
+    results = []
+    for name, fn in paths.items():
+        for token in tokens:
+            auth.decode_token(token)
+        result = per_call(fn, tokens, args.calls)
+        results.append({"percorso": name, **result})
+        print(f"⏱️  {name}: {result['us_per_chiamata']} µs per chiamata")
+
+    print()
+    bench_common.print_table(results, ("percorso", "chiamate", "us_per_chiamata", "p50_us", "p99_us",
+                                       "chiamate_al_secondo"))
+    stats = auth.token_cache.stats()
+    print(f"\n📋 token_cache: {stats}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
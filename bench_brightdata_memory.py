@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Benchmark della memoria di picco nel download di uno snapshot Bright Data
+
+Uno stub locale genera al volo uno snapshot sintetico Google Maps (con le
+recensioni nel payload) della dimensione indicata, in NDJSON o JSON.
+Ogni modalità gira in un processo separato, che scarica lo snapshot e lo
+salva in brightdata_results su un SQLite temporaneo; si misura il picco
+di memoria residente (ru_maxrss) del processo:
+- stream: iter_job_results (NDJSON a blocchi) + save_results_to_db
+- json: get_job_results (response.json() dell'intero snapshot) + save_results_to_db
+
+Uso: python bench_brightdata_memory.py [--size-mb 500] [--modes stream,json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain
+from urllib.parse import parse_qs, urlsplit
+
+ITEM_REVIEWS = 20
+
+
+def synthetic_item(i: int) -> dict:
+    # ~5 KB per risultato, come un locale Google Maps con le ultime recensioni
+    return {
+        "url": f"https://www.google.com/maps/place/locale-{i}",
+        "name": f"Locale {i}",
+        "rating": round(3 + (i % 20) / 10, 1),
+        "reviews_count": 100 + i % 900,
+        "address": f"Via Roma {i % 300}, Milano",
+        "reviews": [{"author": f"utente {i}-{k}", "rating": 1 + (i + k) % 5,
+                     "text": f"Recensione {k} del locale {i}. " + "Ottimo servizio, personale gentile. " * 6}
+                    for k in range(ITEM_REVIEWS)],
+    }
+
+
+ITEM_BYTES = len(json.dumps(synthetic_item(0))) + 1
+
+
+class SnapshotStub(BaseHTTPRequestHandler):
+    # risposta chiusa dalla connessione: nessun Content-Length da calcolare in anticipo
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        items = int(url.path.rsplit("_", 1)[-1])
+        fmt = parse_qs(url.query).get("format", ["json"])[0]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson" if fmt == "ndjson" else "application/json")
+        self.end_headers()
+        buffer = [] if fmt == "ndjson" else ["["]
+        for i in range(items):
+            line = json.dumps(synthetic_item(i))
+            buffer.append(line + "\n" if fmt == "ndjson" else ("," if i else "") + line)
+            if len(buffer) >= 200:
+                self.wfile.write("".join(buffer).encode())
+                buffer = []
+        if fmt != "ndjson":
+            buffer.append("]")
+        self.wfile.write("".join(buffer).encode())
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss è in KB su Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode: str, items: int):
+    """Eseguita nel processo figlio: stampa una riga JSON con i risultati"""
+    import bench_common
+    bench_common.use_database()
+    bench_common.create_schema()
+    from brightdata_service import BrightDataService
+    from database import SessionLocal
+    from models import BrightDataJob
+
+    service = BrightDataService()
+    db = SessionLocal()
+    job = BrightDataJob(job_id=f"bench_{items}", dataset_type="googlemaps", dataset_id="bench")
+    db.add(job)
+    db.commit()
+    baseline = max_rss_mb()
+
+    started = time.perf_counter()
+    if mode == "stream":
+        count = service.save_results_to_db(db, job, chain.from_iterable(service.iter_job_results(job.job_id)))
+    else:
+        results = service.get_job_results(job.job_id)
+        if not results["success"]:
+            raise RuntimeError(results["error"])
+        count = service.save_results_to_db(db, job, results["data"])
+    elapsed = time.perf_counter() - started
+    db.close()
+    service.close()
+    print(json.dumps({"modalità": mode, "risultati": count, "secondi": round(elapsed, 1),
+                      "rss_base_mb": round(baseline), "rss_picco_mb": round(max_rss_mb()),
+                      "crescita_mb": round(max_rss_mb() - baseline)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=float, default=500)
+    parser.add_argument("--modes", default="stream,json")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    items = int(args.size_mb * 1024 * 1024 / ITEM_BYTES)
+
+    if args.child:
+        run_mode(args.child, items)
+        return
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SnapshotStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = {**os.environ,
+           "BRIGHTDATA_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}",
+           "BRIGHTDATA_API_TOKEN": "stub-token",
+           "BRIGHTDATA_SNAPSHOT_TIMEOUT": "600"}
+
+    print("=" * 60)
+    print("📊 BENCHMARK MEMORIA DOWNLOAD SNAPSHOT BRIGHT DATA")
+    print("=" * 60)
+    print(f"📦 {items} risultati da {ITEM_BYTES} byte: {items * ITEM_BYTES / 1024 / 1024:.0f} MB")
+
+    results = []
+    for mode in args.modes.split(","):
+        print(f"⏳ {mode}...")
+        child = subprocess.run([sys.executable, __file__, "--size-mb", str(args.size_mb), "--child", mode],
+                               env=env, capture_output=True, text=True)
+        lines = [l for l in child.stdout.splitlines() if l.startswith("{")]
+        if child.returncode != 0 or not lines:
+            print(f"❌ {mode} terminato con codice {child.returncode}: {child.stderr.strip()[-300:]}")
+            continue
+        results.append(json.loads(lines[-1]))
+
+    server.shutdown()
+    if results:
+        print()
+        import bench_common
+        bench_common.print_table(results, ("modalità", "risultati", "secondi", "rss_base_mb", "rss_picco_mb",
+                                           "crescita_mb"))
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Funzioni comuni agli script di benchmark (bench_*.py)
+
+Ogni benchmark lavora su un database SQLite temporaneo popolato con dati
+sintetici, oppure sul database indicato con --database-url (es. un
+PostgreSQL di prova). use_database() va chiamata prima di importare
+database/models/main, che leggono DATABASE_URL all'import.
+start_server() avvia uvicorn per i benchmark HTTP.
+"""
+import atexit
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Sequence
+
+import httpx
+
+CHUNK_SIZE = 20_000
+# cartella degli script: uvicorn importa main e bench_* da qui, qualunque sia la directory corrente
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def use_database(url: str = None) -> str:
+    """
+    Imposta DATABASE_URL (SQLite temporaneo se url non è indicato) e
+    restituisce l'URL usato
+    """
+    if not url:
+        fd, path = tempfile.mkstemp(prefix="lookatme_bench_", suffix=".db")
+        os.close(fd)
+        atexit.register(_remove_database, path)
+        url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = url
+    return url
+
+
+def _remove_database(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def create_schema():
+    import models
+    from database import engine, sync_schema
+    models.Base.metadata.create_all(bind=engine)
+    sync_schema(models.Base.metadata)
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def latency_summary(samples: Sequence[float]) -> Dict[str, float]:
+    """Latenze in secondi -> p50/p95/p99/media in ms"""
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+        "n": len(samples),
+    }
+
+
+def timed(fn: Callable, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def _insert_chunks(table, rows, chunk_size: int = CHUNK_SIZE) -> int:
+    from database import engine
+    count = 0
+    chunk = []
+    with engine.begin() as conn:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                conn.execute(table.insert(), chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            conn.execute(table.insert(), chunk)
+            count += len(chunk)
+    return count
+
+
+def seed_esercenti(n: int) -> List[int]:
+    from database import engine
+    from models import Esercente
+    _insert_chunks(Esercente.__table__, ({
+        "nome": f"Esercente {i}",
+        "colore_sfondo": "#ffffff",
+        "colore_carattere": "#000000",
+        "tripadvisor_location_id": str(100000 + i),
+    } for i in range(n)))
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(Esercente.__table__.select().with_only_columns(
+            Esercente.id_esercente).order_by(Esercente.id_esercente))]
+
+
+def crawled_rows(ids: Sequence[int], days: int, end: date = None, seed: int = 1):
+    """Un DatoCrawled al giorno per esercente, per days giorni fino a end"""
+    rng = random.Random(seed)
+    end = end or date.today()
+    for id_esercente in ids:
+        fan, followers, reviews = rng.randint(100, 5000), rng.randint(100, 8000), rng.randint(0, 500)
+        for d in range(days - 1, -1, -1):
+            fan += rng.randint(-3, 10)
+            followers += rng.randint(-3, 12)
+            reviews += rng.random() < 0.2
+            yield {
+                "id_esercente": id_esercente,
+                "data": end - timedelta(days=d),
+                "ora": dtime(rng.randint(0, 23), rng.randint(0, 59)),
+                "n_fan_facebook": fan,
+                "n_followers_ig": followers,
+                "stelle_google": round(rng.uniform(3, 5), 1),
+                "tripadvisor_rating": round(rng.uniform(3, 5), 1),
+                "tripadvisor_reviews": reviews,
+            }
+
+
+def rilevazioni_rows(ids: Sequence[int], per_esercente: int, end: datetime = None, seed: int = 2):
+    """per_esercente rilevazioni a intervalli di un'ora fino a end, sentiment già calcolato"""
+    from services import compute_sentiment
+    rng = random.Random(seed)
+    end = end or datetime.utcnow()
+    for id_esercente in ids:
+        for k in range(per_esercente - 1, -1, -1):
+            values = {c: round(rng.random(), 2) for c in
+                      ("gioia", "tristezza", "paura", "rabbia", "disgusto", "sorpresa", "neutro")}
+            yield {
+                "id_esercente": id_esercente,
+                **values,
+                "n_passanti": rng.randint(0, 40),
+                "sentiment": compute_sentiment(SimpleNamespace(**values)),
+                "rilevato_at": end - timedelta(hours=k),
+            }
+
+
+def seed_dati_crawled(ids: Sequence[int], days: int, end: date = None) -> int:
+    from models import DatoCrawled
+    return _insert_chunks(DatoCrawled.__table__, crawled_rows(ids, days, end))
+
+
+def seed_rilevazioni(ids: Sequence[int], per_esercente: int, end: datetime = None) -> int:
+    from models import Rilevazione
+    return _insert_chunks(Rilevazione.__table__, rilevazioni_rows(ids, per_esercente, end))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app: str, args: Sequence[str] = (), env: Dict[str, str] = None, show_log: bool = False) -> tuple:
+    """
+    Avvia uvicorn su app (es. "main:app") su una porta libera e attende che risponda;
+    restituisce (processo, base_url). Se il server non parte solleva RuntimeError
+    con il suo stderr (mostrato comunque con show_log).
+    """
+    port = free_port()
+    log = None if show_log else tempfile.TemporaryFile()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning", *args],
+        cwd=BENCH_DIR, env={**os.environ, **(env or {})}, stdout=subprocess.DEVNULL, stderr=log,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(120):
+        if server.poll() is not None:
+            break
+        try:
+            httpx.get(f"{base_url}/docs", timeout=1)
+            return server, base_url
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    server.terminate()
+    server.wait()
+    detail = ""
+    if log is not None:
+        log.seek(0)
+        detail = log.read().decode(errors="replace").strip()
+        log.close()
+    raise RuntimeError(f"uvicorn non è partito (exit code {server.returncode})" + (f":\n{detail}" if detail else ""))
+
+
+def print_table(rows: List[Dict], columns: Sequence[str]):
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("   " + "  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("   " + "  ".join(str(r.get(c, "")).ljust(widths[c]) for c in columns))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark dell'inserimento di dati crawlati: POST /data-crawled contro /data-crawled/batch
+
+Misura le righe al secondo dell'endpoint singolo (una richiesta e un
+commit per riga) e dell'endpoint batch con body JSON array, NDJSON e CSV.
+Le richieste passano da TestClient (applicazione in processo, senza
+rete) su un database SQLite temporaneo o su --database-url.
+
+Uso: python bench_ingest.py [--single-rows 2000] [--batch-rows 50000]
+     [--chunk-size 1000] [--database-url URL]
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+
+import bench_common
+
+COLUMNS = ("id_esercente", "data", "ora", "n_fan_facebook", "n_followers_ig",
+           "stelle_google", "tripadvisor_rating", "tripadvisor_reviews")
+
+
+def payloads(ids, n: int) -> list:
+    # una riga ogni dieci senza data/ora: valorizzate dall'endpoint
+    rows = []
+    for i, row in enumerate(bench_common.crawled_rows(ids, -(-n // len(ids)))):
+        if i >= n:
+            break
+        row = {**row, "data": row["data"].isoformat(), "ora": row["ora"].isoformat()}
+        if i % 10 == 0:
+            row["data"] = row["ora"] = None
+        rows.append(row)
+    return rows
+
+
+def to_ndjson(rows: list) -> bytes:
+    return "".join(json.dumps(r) + "\n" for r in rows).encode()
+
+
+def to_csv(rows: list) -> bytes:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+    writer.writeheader()
+    for r in rows:
+        writer.writerow({k: "" if v is None else v for k, v in r.items()})
+    return out.getvalue().encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--single-rows", type=int, default=2000)
+    parser.add_argument("--batch-rows", type=int, default=50_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--esercenti", type=int, default=100)
+    parser.add_argument("--database-url", help="database già vuoto da usare al posto di un SQLite temporaneo")
+    args = parser.parse_args()
+    url = bench_common.use_database(args.database_url)
+
+    from fastapi.testclient import TestClient
+    import auth
+    import main as app_main
+    # una riga di log per richiesta falserebbe la misura
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    print("=" * 60)
+    print("📊 BENCHMARK INSERIMENTO DATI CRAWLATI")
+    print("=" * 60)
+    print(f"🗄️  {url}")
+
+    headers = {"Authorization": f"Bearer {auth.create_access_token('bench@example.com')}"}
+    ids = bench_common.seed_esercenti(args.esercenti)
+    results = []
+
+    with TestClient(app_main.app) as client:
+        rows = payloads(ids, args.single_rows)
+        print(f"\n🐢 POST /data-crawled ({len(rows)} richieste)")
+
+        def single():
+            for row in rows:
+                client.post("/data-crawled", json=row, headers=headers).raise_for_status()
+
+        _, elapsed = bench_common.timed(single)
+        results.append({"endpoint": "singolo", "righe": len(rows), "secondi": round(elapsed, 2),
+                        "righe_al_secondo": round(len(rows) / elapsed)})
+
+        rows = payloads(ids, args.batch_rows)
+        bodies = {
+            "batch JSON": (json.dumps(rows).encode(), "application/json"),
+            "batch NDJSON": (to_ndjson(rows), "application/x-ndjson"),
+            "batch CSV": (to_csv(rows), "text/csv"),
+        }
+        for label, (body, content_type) in bodies.items():
+            print(f"🚀 POST /data-crawled/batch {content_type} ({len(rows)} righe, {len(body) / 1e6:.1f} MB)")
+            response, elapsed = bench_common.timed(
+                client.post, "/data-crawled/batch", content=body, params={"chunk_size": args.chunk_size},
+                headers={**headers, "Content-Type": content_type})
+            response.raise_for_status()
+            inserted = response.json().get("inserted")
+            if inserted != len(rows):
+                print(f"❌ inserite {inserted} righe su {len(rows)}: {response.json().get('errors', [])[:3]}")
+            results.append({"endpoint": label, "righe": inserted, "secondi": round(elapsed, 2),
+                            "righe_al_secondo": round(inserted / elapsed)})
+
+    print()
+    bench_common.print_table(results, ("endpoint", "righe", "secondi", "righe_al_secondo"))
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
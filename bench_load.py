@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Load test degli endpoint principali, per dimensionare il pool del database
+
+Genera traffico misto (vetrina, dashboard, metriche, inserimento di dati
+crawlati e rilevazioni) a livelli di concorrenza crescenti e riporta
+richieste al secondo, latenze p50/p99 ed errori per ogni livello.
+
+Senza --base-url avvia uvicorn su un database popolato con dati sintetici:
+un SQLite temporaneo o --database-url (es. PostgreSQL), con --workers
+processi e le variabili DB_POOL_SIZE/DB_MAX_OVERFLOW dell'ambiente. Con
+--base-url colpisce un server già avviato (servono esercenti esistenti).
+
+Uso: python bench_load.py [--concurrency 1,10,50,100] [--duration 10]
+     [--workers 1] [--database-url URL | --base-url http://localhost:8001]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+import bench_common
+
+# (nome, peso): la vetrina è interrogata di continuo dai kiosk
+MIX = [("GET /vetrina", 50), ("GET /dashboard", 20), ("GET /metrics", 10),
+       ("POST /data-crawled", 10), ("POST /rilevazione", 10)]
+
+
+def request_for(name: str, id_esercente: int, rng: random.Random):
+    if name == "GET /vetrina":
+        return "GET", "/vetrina", {"params": {"id_esercente": id_esercente}}
+    if name == "GET /dashboard":
+        return "GET", "/dashboard", {"params": {"id_esercente": id_esercente}}
+    if name == "GET /metrics":
+        return "GET", f"/esercenti/{id_esercente}/metrics", {"params": {"granularity": rng.choice(["day", "week"])}}
+    if name == "POST /data-crawled":
+        return "POST", "/data-crawled", {"json": {"id_esercente": id_esercente,
+                                                  "n_fan_facebook": rng.randint(100, 5000),
+                                                  "n_followers_ig": rng.randint(100, 5000)}}
+    return "POST", "/rilevazione", {"json": {"id_esercente": id_esercente,
+                                             "gioia": round(rng.random(), 2),
+                                             "tristezza": round(rng.random(), 2),
+                                             "rilevato_at": datetime.utcnow().isoformat()}}
+
+
+async def run_level(base_url: str, token: str, ids: list, concurrency: int, duration: float) -> dict:
+    names, weights = zip(*MIX)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {token}"},
+                                 limits=limits, timeout=60) as client:
+        async def user(seed: int):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                method, path, kwargs = request_for(name, rng.choice(ids), rng)
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, **kwargs)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[name].append(time.perf_counter() - started)
+                else:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    every = [s for samples in latencies.values() for s in samples]
+    return {
+        "concorrenza": concurrency,
+        "req_al_secondo": round(len(every) / elapsed),
+        **{k: v for k, v in bench_common.latency_summary(every).items() if k in ("p50_ms", "p99_ms")},
+        "errori": sum(errors.values()),
+        "per_endpoint": {name: {**bench_common.latency_summary(latencies[name]), "errori": errors[name]}
+                         for name in names},
+    }
+
+
+def start_server(args) -> tuple:
+    """Popola il database e avvia uvicorn; restituisce (processo, base_url, ids)"""
+    url = bench_common.use_database(args.database_url)
+    bench_common.create_schema()
+    ids = bench_common.seed_esercenti(args.esercenti)
+    bench_common.seed_dati_crawled(ids, args.rows)
+    bench_common.seed_rilevazioni(ids, 20)
+    print(f"🗄️  {url}: {len(ids)} esercenti, {args.rows} dati crawlati ciascuno")
+
+    server, base_url = bench_common.start_server("main:app", ["--workers", str(args.workers)],
+                                                 env={"DATABASE_URL": url}, show_log=args.server_log)
+    return server, base_url, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", help="server già avviato da colpire")
+    parser.add_argument("--database-url", help="database già vuoto per il server avviato dallo script")
+    parser.add_argument("--workers", type=int, default=1, help="processi uvicorn del server avviato dallo script")
+    parser.add_argument("--server-log", action="store_true", help="mostra il log del server avviato dallo script")
+    parser.add_argument("--concurrency", default="1,10,50,100")
+    parser.add_argument("--duration", type=float, default=10, help="secondi per livello di concorrenza")
+    parser.add_argument("--esercenti", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=365, help="dati crawlati per esercente")
+    parser.add_argument("--email", default="admin@example.com")
+    parser.add_argument("--password", default="admin")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("📊 LOAD TEST ENDPOINT PRINCIPALI")
+    print("=" * 60)
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url.rstrip("/")
+    else:
+        server, base_url, ids = start_server(args)
+    try:
+        response = httpx.post(f"{base_url}/get-token", json={"email": args.email, "password": args.password})
+        response.raise_for_status()
+        token = response.json()["token"]
+        if args.base_url:
+            esercenti = httpx.get(f"{base_url}/esercenti", headers={"Authorization": f"Bearer {token}"}, timeout=60)
+            ids = [e["id_esercente"] for e in esercenti.json()]
+        print(f"🎯 {base_url}, {len(ids)} esercenti, {args.duration:.0f}s per livello")
+
+        # riscaldamento fuori misura: snapshot costruiti alla prima lettura e cache della vetrina
+        headers = {"Authorization": f"Bearer {token}"}
+        with httpx.Client(base_url=base_url, headers=headers, timeout=60) as client:
+            for id_esercente in ids:
+                client.get("/dashboard", params={"id_esercente": id_esercente})
+
+        results = []
+        for level in (int(c) for c in args.concurrency.split(",")):
+            result = asyncio.run(run_level(base_url, token, ids, level, args.duration))
+            results.append(result)
+            print(f"⏱️  concorrenza {level}: {result['req_al_secondo']} req/s, p99 {result['p99_ms']} ms, "
+                  f"{result['errori']} errori")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print()
+    bench_common.print_table(results, ("concorrenza", "req_al_secondo", "p50_ms", "p99_ms", "errori"))
+    print(f"\n📋 Per endpoint (concorrenza {results[-1]['concorrenza']})")
+    bench_common.print_table([{"endpoint": name, **stats} for name, stats in results[-1]["per_endpoint"].items()],
+                             ("endpoint", "n", "p50_ms", "p99_ms", "errori"))
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark di una raffica di login sulla latenza delle letture concorrenti di /vetrina
+
+Per ogni modalità avvia uvicorn su un database popolato e misura la
+latenza di --readers client che interrogano /vetrina, prima a riposo e
+poi durante --logins login concorrenti ripetuti per --duration secondi:
+- inline: verifica bcrypt nel thread della richiesta (auth.authenticate in
+  un endpoint def, il percorso precedente; route aggiunta da create_app)
+- thread: POST /get-token con PASSWORD_POOL=thread
+- process: POST /get-token con PASSWORD_POOL=process
+Si riportano p50/p95/p99 delle letture, login completati e rifiutati (503).
+
+Uso: python bench_login_burst.py [--modes inline,thread,process] [--readers 20]
+     [--logins 50] [--duration 10] [--bcrypt-rounds 12]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+import httpx
+
+import bench_common
+
+CREDENTIALS = {"email": "admin@example.com", "password": "admin"}
+
+
+def create_app():
+    """Factory per uvicorn: l'applicazione di main.py più il login con bcrypt nel thread della richiesta"""
+    from fastapi import Body, Depends, HTTPException
+    from sqlalchemy.orm import Session
+
+    import main
+    import schemas
+    from auth import authenticate, create_access_token, get_db
+
+    @main.app.post("/bench/get-token-inline")
+    def get_token_inline(payload: schemas.LoginIn = Body(...), db: Session = Depends(get_db)):
+        if not authenticate(db, payload.email, payload.password):
+            raise HTTPException(401, "Credenziali non valide")
+        return {"token": create_access_token(sub=payload.email)}
+
+    return main.app
+
+
+async def read_loop(client: httpx.AsyncClient, ids: list, deadline: float, samples: list, seed: int):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/vetrina", params={"id_esercente": rng.choice(ids)})
+        if response.status_code == 200:
+            samples.append(time.perf_counter() - started)
+        await asyncio.sleep(0.01)
+
+
+async def login_loop(client: httpx.AsyncClient, path: str, deadline: float, codes: Counter):
+    while time.perf_counter() < deadline:
+        response = await client.post(path, json=CREDENTIALS)
+        codes[response.status_code] += 1
+        if response.status_code == 503:
+            await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+async def measure(base_url: str, token: str, ids: list, login_path: str, args) -> dict:
+    limits = httpx.Limits(max_connections=args.readers + args.logins)
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {token}"},
+                                 limits=limits, timeout=120) as client:
+        idle = []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*(read_loop(client, ids, deadline, idle, i) for i in range(args.readers)))
+
+        burst, codes = [], Counter()
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*(read_loop(client, ids, deadline, burst, i) for i in range(args.readers)),
+                             *(login_loop(client, login_path, deadline, codes) for _ in range(args.logins)))
+        stats = (await client.get("/get-token/stats")).json()
+
+    idle, burst = bench_common.latency_summary(idle), bench_common.latency_summary(burst)
+    return {
+        "riposo_p50_ms": idle["p50_ms"], "riposo_p99_ms": idle["p99_ms"],
+        "raffica_p50_ms": burst["p50_ms"], "raffica_p95_ms": burst["p95_ms"], "raffica_p99_ms": burst["p99_ms"],
+        "letture": burst["n"], "login_ok": codes[200], "login_503": codes[503],
+        "pool": stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modes", default="inline,thread,process")
+    parser.add_argument("--readers", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=50, help="login concorrenti durante la raffica")
+    parser.add_argument("--duration", type=float, default=10, help="secondi a riposo e secondi di raffica")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--esercenti", type=int, default=200)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("📊 BENCHMARK RAFFICA DI LOGIN E LATENZA DI /vetrina")
+    print("=" * 60)
+    print(f"👥 {args.readers} lettori, {args.logins} login concorrenti, bcrypt {args.bcrypt_rounds} round")
+
+    # stesso database per tutte le modalità: le letture non scrivono
+    url = bench_common.use_database()
+    bench_common.create_schema()
+    ids = bench_common.seed_esercenti(args.esercenti)
+    bench_common.seed_rilevazioni(ids, 10)
+
+    results = []
+    for mode in args.modes.split(","):
+        server, base_url = bench_common.start_server(
+            "bench_login_burst:create_app", ["--factory"],
+            env={"DATABASE_URL": url, "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+                 "PASSWORD_POOL": "thread" if mode == "inline" else mode},
+        )
+        try:
+            token = httpx.post(f"{base_url}/get-token", json=CREDENTIALS, timeout=60).json()["token"]
+            # riscaldamento: snapshot e cache della vetrina
+            with httpx.Client(base_url=base_url, headers={"Authorization": f"Bearer {token}"}, timeout=60) as client:
+                for id_esercente in ids:
+                    client.get("/vetrina", params={"id_esercente": id_esercente})
+            print(f"⏳ {mode}...")
+            login_path = "/bench/get-token-inline" if mode == "inline" else "/get-token"
+            result = asyncio.run(measure(base_url, token, ids, login_path, args))
+        finally:
+            server.terminate()
+            server.wait()
+        results.append({"modalità": mode, **result})
+        print(f"⏱️  {mode}: /vetrina p50 {result['riposo_p50_ms']} -> {result['raffica_p50_ms']} ms, "
+              f"p99 {result['riposo_p99_ms']} -> {result['raffica_p99_ms']} ms, "
+              f"{result['login_ok']} login ok, {result['login_503']} rifiutati")
+        print(f"   password_pool: {result['pool']}")
+
+    print()
+    bench_common.print_table(results, ("modalità", "riposo_p50_ms", "riposo_p99_ms", "raffica_p50_ms",
+                                       "raffica_p95_ms", "raffica_p99_ms", "login_ok", "login_503"))
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
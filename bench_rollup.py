@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark delle query per intervallo: rollup contro GROUP BY su dati_crawled
+
+Popola dati_crawled con un dato al giorno per --days giorni (3 anni) per
+ogni esercente, costruisce i rollup con backfill_rollups e per esercenti
+casuali confronta, a ogni granularità e sull'ultimo trimestre e sull'intero
+periodo:
+- rollup: rollup.get_range (come GET /esercenti/{id}/metrics)
+- grezzo: GROUP BY per periodo su dati_crawled con min/max delle metriche
+  e numero di campioni (la query che i rollup sostituiscono)
+
+Uso: python bench_rollup.py [--esercenti 10000] [--days 1095] [--queries 200]
+     [--database-url URL]
+"""
+
+import argparse
+import random
+from datetime import date, timedelta
+
+import bench_common
+
+
+def raw_range_query(db, id_esercente: int, granularity: str, start: date, end: date):
+    from sqlalchemy import func
+
+    import rollup
+    from models import DatoCrawled
+
+    data = DatoCrawled.data
+    if db.get_bind().dialect.name == "postgresql":
+        bucket = func.date_trunc(granularity, data)
+    elif granularity == "day":
+        bucket = data
+    elif granularity == "week":
+        bucket = func.date(data, "weekday 0", "-6 days")
+    else:
+        bucket = func.date(data, "start of month")
+    aggregates = [agg(getattr(DatoCrawled, m)) for m in rollup.METRICS for agg in (func.min, func.max)]
+    return (db.query(bucket.label("periodo"), func.count(DatoCrawled.id), *aggregates)
+              .filter(DatoCrawled.id_esercente == id_esercente,
+                      data >= rollup.bucket_start(start, granularity), data <= end)
+              .group_by(bucket)
+              .order_by(bucket)
+              .all())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--esercenti", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=1095)
+    parser.add_argument("--queries", type=int, default=200, help="esercenti interrogati per caso")
+    parser.add_argument("--database-url", help="database già vuoto da usare al posto di un SQLite temporaneo")
+    args = parser.parse_args()
+    url = bench_common.use_database(args.database_url)
+
+    print("=" * 60)
+    print("📊 BENCHMARK QUERY PER INTERVALLO: ROLLUP CONTRO GROUP BY")
+    print("=" * 60)
+    print(f"🗄️  {url}")
+    bench_common.create_schema()
+
+    import rollup
+    from database import SessionLocal
+
+    end = date.today()
+    ids = bench_common.seed_esercenti(args.esercenti)
+    righe, elapsed = bench_common.timed(bench_common.seed_dati_crawled, ids, args.days, end)
+    print(f"📦 {righe} dati crawlati ({len(ids)} esercenti x {args.days} giorni) in {elapsed:.0f}s")
+
+    db = SessionLocal()
+    try:
+        _, elapsed = bench_common.timed(rollup.backfill_rollups, db)
+        print(f"🔧 rollup costruiti con backfill_rollups in {elapsed:.0f}s")
+
+        rng = random.Random(13)
+        sample_ids = [rng.choice(ids) for _ in range(args.queries)]
+        ranges = {"90 giorni": end - timedelta(days=89), f"{args.days} giorni": end - timedelta(days=args.days - 1)}
+        paths = {"rollup": rollup.get_range, "grezzo": raw_range_query}
+
+        results = []
+        for granularity in rollup.GRANULARITIES:
+            for label, start in ranges.items():
+                for name, query in paths.items():
+                    samples, periods = [], 0
+                    for id_esercente in sample_ids:
+                        rows, elapsed = bench_common.timed(query, db, id_esercente, granularity, start, end)
+                        samples.append(elapsed)
+                        periods += len(rows)
+                    db.expunge_all()
+                    results.append({"granularità": granularity, "intervallo": label, "percorso": name,
+                                    "periodi": periods // len(sample_ids),
+                                    **bench_common.latency_summary(samples)})
+                print(f"⏱️  {granularity} {label}: rollup p50 {results[-2]['p50_ms']} ms, "
+                      f"grezzo p50 {results[-1]['p50_ms']} ms")
+    finally:
+        db.close()
+
+    print()
+    bench_common.print_table(results, ("granularità", "intervallo", "percorso", "periodi", "p50_ms", "p95_ms",
+                                       "p99_ms"))
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark della lettura di /vetrina e /dashboard: tre query contro lo snapshot
+
+Confronta p50/p99 del vecchio percorso di lettura (db.get dell'esercente,
+ultimo DatoCrawled ordinato per data/ora, ultima Rilevazione) con la
+lettura dello snapshot (snapshot.get_esercente_with_snapshot: una query
+per chiave primaria). Ogni lettura usa una sessione nuova, come una
+richiesta HTTP; la cache in memoria di /vetrina non è coinvolta.
+
+Uso: python bench_snapshot.py [--esercenti 10000] [--rows 1000] [--reads 2000]
+     [--database-url URL]
+"""
+
+import argparse
+import random
+
+import bench_common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--esercenti", type=int, default=10_000)
+    parser.add_argument("--rows", type=int, default=1000, help="DatoCrawled per esercente")
+    parser.add_argument("--rilevazioni", type=int, default=20, help="Rilevazioni per esercente")
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--database-url", help="database già vuoto da usare al posto di un SQLite temporaneo")
+    args = parser.parse_args()
+    url = bench_common.use_database(args.database_url)
+
+    from database import SessionLocal
+    from models import DatoCrawled, Esercente, Rilevazione
+    from services import compute_sentiment
+    from snapshot import get_esercente_with_snapshot
+
+    def three_queries(db, id_esercente):
+        # percorso precedente allo snapshot
+        e = db.get(Esercente, id_esercente)
+        last_crawled = (db.query(DatoCrawled)
+                          .filter(DatoCrawled.id_esercente == id_esercente)
+                          .order_by(DatoCrawled.data.desc().nullslast(), DatoCrawled.ora.desc().nullslast())
+                          .first())
+        last_ril = (db.query(Rilevazione)
+                      .filter(Rilevazione.id_esercente == id_esercente)
+                      .order_by(Rilevazione.id.desc())
+                      .first())
+        return e, last_crawled, compute_sentiment(last_ril)
+
+    def measure(read, ids):
+        samples = []
+        for id_esercente in ids:
+            db = SessionLocal()
+            try:
+                _, elapsed = bench_common.timed(read, db, id_esercente)
+            finally:
+                db.close()
+            samples.append(elapsed)
+        return bench_common.latency_summary(samples)
+
+    print("=" * 60)
+    print("📊 BENCHMARK LETTURA VETRINA: TRE QUERY CONTRO SNAPSHOT")
+    print("=" * 60)
+    print(f"🗄️  {url}")
+
+    bench_common.create_schema()
+    ids, elapsed = bench_common.timed(bench_common.seed_esercenti, args.esercenti)
+    crawled, elapsed_crawled = bench_common.timed(bench_common.seed_dati_crawled, ids, args.rows)
+    rilevazioni, elapsed_ril = bench_common.timed(bench_common.seed_rilevazioni, ids, args.rilevazioni)
+    print(f"🌱 {len(ids)} esercenti, {crawled} dati crawlati, {rilevazioni} rilevazioni "
+          f"({elapsed + elapsed_crawled + elapsed_ril:.1f}s)")
+
+    sample = random.Random(3).choices(ids, k=args.reads)
+    # snapshot costruiti alla prima lettura: fuori dalla misura
+    _, elapsed = bench_common.timed(measure, get_esercente_with_snapshot, sorted(set(sample)))
+    print(f"🧱 {len(set(sample))} snapshot costruiti in {elapsed:.1f}s")
+    # una passata di riscaldamento per entrambi (cache di pagine del database)
+    measure(three_queries, sample[:200])
+    measure(get_esercente_with_snapshot, sample[:200])
+
+    results = [
+        {"percorso": "tre query", **measure(three_queries, sample)},
+        {"percorso": "snapshot", **measure(get_esercente_with_snapshot, sample)},
+    ]
+    print(f"\n⏱️  {args.reads} letture")
+    bench_common.print_table(results, ("percorso", "p50_ms", "p95_ms", "p99_ms", "mean_ms"))
+    print(f"\n   p50 {results[0]['p50_ms'] / results[1]['p50_ms']:.1f}x, "
+          f"p99 {results[0]['p99_ms'] / results[1]['p99_ms']:.1f}x")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark della valutazione delle regole dei suggerimenti su tutti gli esercenti
+
+- in memoria: suggestions.evaluate su --indicatori insiemi di indicatori
+  sintetici, in un solo passaggio
+- database: su --esercenti esercenti con dati crawlati e rilevazioni
+  - refresh: refresh_snapshot per ogni esercente (rilegge le tabelle
+    sorgente, come all'arrivo di dati nuovi)
+  - un passaggio: reevaluate_suggestions dopo un cambio di versione delle
+    regole (dagli indicatori già salvati nello snapshot)
+  - lettura: get_esercente_with_snapshot con i suggerimenti precalcolati
+    (il lavoro di /dashboard per richiesta)
+Gira su un SQLite temporaneo o su --database-url.
+
+Uso: python bench_suggestions.py [--indicatori 100000] [--esercenti 10000]
+     [--database-url URL]
+"""
+
+import argparse
+import random
+
+import bench_common
+
+
+def synthetic_indicators(n: int, seed: int = 16) -> list:
+    rng = random.Random(seed)
+    maybe = lambda value: None if rng.random() < 0.2 else value
+    return [{
+        "sentiment": round(rng.random(), 4),
+        "trend_points": rng.randint(0, 7),
+        "trend_delta": maybe(round(rng.uniform(-0.5, 0.5), 4)),
+        "follower_growth": maybe(round(rng.uniform(-0.1, 0.2), 4)),
+        "tripadvisor_rating_delta": maybe(round(rng.uniform(-0.5, 0.5), 2)),
+        "stelle_google_delta": maybe(round(rng.uniform(-0.5, 0.5), 2)),
+    } for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--indicatori", type=int, default=100_000)
+    parser.add_argument("--esercenti", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=60, help="dati crawlati per esercente")
+    parser.add_argument("--database-url", help="database già vuoto da usare al posto di un SQLite temporaneo")
+    args = parser.parse_args()
+    url = bench_common.use_database(args.database_url)
+
+    print("=" * 60)
+    print("📊 BENCHMARK VALUTAZIONE REGOLE DEI SUGGERIMENTI")
+    print("=" * 60)
+
+    import suggestions
+    results = []
+
+    indicators = synthetic_indicators(args.indicatori)
+    _, elapsed = bench_common.timed(lambda: [suggestions.evaluate(i) for i in indicators])
+    results.append({"percorso": "evaluate in memoria", "esercenti": len(indicators), "secondi": round(elapsed, 3),
+                    "esercenti_al_secondo": round(len(indicators) / elapsed)})
+    print(f"⏱️  evaluate: {len(indicators)} esercenti in {elapsed:.3f}s")
+
+    print(f"🗄️  {url}")
+    bench_common.create_schema()
+    from database import SessionLocal
+    from models import EsercenteSnapshot
+    from snapshot import get_esercente_with_snapshot, refresh_snapshot, reevaluate_suggestions
+
+    ids = bench_common.seed_esercenti(args.esercenti)
+    bench_common.seed_dati_crawled(ids, args.days)
+    bench_common.seed_rilevazioni(ids, 10)
+
+    db = SessionLocal()
+    try:
+        def refresh_all():
+            for i, id_esercente in enumerate(ids, 1):
+                refresh_snapshot(db, id_esercente)
+                if i % 1000 == 0:
+                    db.commit()
+            db.commit()
+
+        _, elapsed = bench_common.timed(refresh_all)
+        results.append({"percorso": "refresh_snapshot per esercente", "esercenti": len(ids),
+                        "secondi": round(elapsed, 2), "esercenti_al_secondo": round(len(ids) / elapsed)})
+        print(f"⏱️  refresh_snapshot: {len(ids)} esercenti in {elapsed:.2f}s")
+        db.expunge_all()
+
+        # come dopo una modifica di suggestions.RULES
+        db.query(EsercenteSnapshot).update({EsercenteSnapshot.versione_regole: "precedente"})
+        db.commit()
+        updated, elapsed = bench_common.timed(reevaluate_suggestions, db)
+        results.append({"percorso": "reevaluate_suggestions", "esercenti": updated, "secondi": round(elapsed, 2),
+                        "esercenti_al_secondo": round(updated / elapsed)})
+        print(f"⏱️  reevaluate_suggestions: {updated} esercenti in {elapsed:.2f}s")
+        db.expunge_all()
+
+        samples = []
+        rng = random.Random(16)
+        for id_esercente in (rng.choice(ids) for _ in range(2000)):
+            _, elapsed = bench_common.timed(get_esercente_with_snapshot, db, id_esercente)
+            samples.append(elapsed)
+        db.expunge_all()
+        reads = bench_common.latency_summary(samples)
+        print(f"⏱️  lettura dello snapshot: p50 {reads['p50_ms']} ms, p99 {reads['p99_ms']} ms")
+    finally:
+        db.close()
+
+    print()
+    bench_common.print_table(results, ("percorso", "esercenti", "secondi", "esercenti_al_secondo"))
+    print(f"\n📋 get_esercente_with_snapshot ({reads['n']} letture)")
+    bench_common.print_table([reads], ("n", "p50_ms", "p95_ms", "p99_ms", "mean_ms"))
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Cache in-process delle risposte di /vetrina
+
+Una entry per id_esercente, con TTL, eviction LRU e budget di memoria.
+Le entry vengono invalidate al commit di ogni sessione che modifica
+l'esercente o il suo snapshot (quindi dati crawlati e rilevazioni);
+il TTL copre le scritture fatte da altri processi/worker. Un valore
+costruito mentre la chiave veniva invalidata non entra in cache
+(generation() prima della lettura, set(..., generation=...)).
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Esercente, EsercenteSnapshot
+
+
+class LRUCache:
+    """Cache LRU thread-safe con TTL e limite sulla dimensione stimata delle entry"""
+
+    def __init__(self, max_bytes: int, ttl: float, max_entries: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        # generazione per chiave, incrementata a ogni invalidazione (anche senza entry in cache):
+        # un set con la generazione letta prima della query viene scartato se nel frattempo è cambiata
+        self._generations: Dict[Hashable, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    @staticmethod
+    def estimate_size(value: Any) -> int:
+        return len(json.dumps(value, default=str))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, key: Hashable) -> tuple:
+        """Da leggere prima di costruire il valore e da passare a set()"""
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, size: Optional[int] = None, ttl: Optional[float] = None,
+            generation: Optional[tuple] = None):
+        size = self.estimate_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                # invalidata durante la costruzione: il valore può essere precedente alla scrittura
+                self.stale_sets += 1
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._data and (self._bytes > self.max_bytes or
+                                  (self.max_entries and len(self._data) > self.max_entries)):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if key in self._data:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_matching(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Rimuove le entry con chiave che soddisfa predicate (scansione completa: per eventi rari).
+        Incrementa l'epoca: i set in corso con una generazione precedente vengono scartati.
+        """
+        with self._lock:
+            self._epoch += 1
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                self._remove(k)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale_sets": self.stale_sets,
+            }
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+
+vetrina_cache = LRUCache(
+    max_bytes=int(os.getenv("VETRINA_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl=float(os.getenv("VETRINA_CACHE_TTL", "60")),
+)
+
+
+# ---------- Invalidazione ----------
+
+# chiave in Session.info con gli esercenti da invalidare dopo il commit
+INVALIDATE_KEY = "vetrina_cache_invalidate"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_touched_esercenti(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Esercente, EsercenteSnapshot)):
+            session.info.setdefault(INVALIDATE_KEY, set()).add(obj.id_esercente)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_touched_esercenti(session):
+    for id_esercente in session.info.pop(INVALIDATE_KEY, ()):
+        vetrina_cache.invalidate(id_esercente)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_touched_esercenti(session):
+    session.info.pop(INVALIDATE_KEY, None)
@@ -0,0 +1,239 @@
+"""
+Ingestione batch per gli endpoint /.../batch
+
+Legge il body come JSON array, NDJSON in streaming (Content-Type
+application/x-ndjson) o CSV (text/csv oppure upload multipart), e scrive
+le righe valide con insert Core (executemany) a blocchi, un commit per
+blocco. Gli errori di validazione o di scrittura vengono riportati per
+singolo elemento senza interrompere il batch.
+"""
+import codecs
+import csv
+import io
+import json
+import os
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, Request
+from sqlalchemy import Table, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from snapshot import mark_dirty
+
+DEFAULT_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+MAX_CHUNK_SIZE = 5000
+
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines"}
+CSV_TYPES = {"text/csv", "application/csv"}
+
+
+class InvalidRecord(Exception):
+    """Elemento del body non decodificabile (es. riga NDJSON malformata)"""
+
+
+def content_type(request: Request) -> str:
+    return request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return InvalidRecord(f"JSON non valido: {e}")
+
+
+async def iter_json_records(request: Request) -> AsyncIterator[Any]:
+    """
+    Restituisce gli elementi del body uno alla volta.
+    NDJSON viene letto in streaming, senza caricare tutto il body in memoria.
+    """
+    if content_type(request) in NDJSON_TYPES:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+        if buffer.strip():
+            yield _parse_line(buffer)
+        return
+
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Body JSON non valido")
+    if not isinstance(body, list):
+        raise HTTPException(400, "Il body deve essere un array JSON o NDJSON")
+    for item in body:
+        yield item
+
+
+def is_csv(request: Request) -> bool:
+    return content_type(request) in CSV_TYPES | {"multipart/form-data"}
+
+
+def _csv_row(header: List[str], values: List[str]) -> Dict[str, str]:
+    # le celle vuote sono campi assenti, così valgono i default dello schema
+    return {k: v for k, v in zip(header, values) if k and v != ""}
+
+
+async def _iter_text_lines(request: Request) -> AsyncIterator[str]:
+    # righe con il terminatore, come le legge csv.reader da un file aperto con newline=""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+class _LineFeed:
+    """
+    Sorgente di righe per un unico csv.reader alimentato dallo stream della richiesta.
+    Conta i record completi: una riga chiude un record se le virgolette lette finora
+    sono pari, altrimenti il campo quotato (con a capo) continua nella riga successiva.
+    """
+
+    def __init__(self):
+        self.lines = deque()
+        self.records = 0
+        self._open_quote = False
+
+    def feed(self, line: str):
+        self.lines.append(line)
+        self._open_quote ^= bool(line.count('"') % 2)
+        if not self._open_quote:
+            self.records += 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        # a differenza di un generatore può riprendere dopo StopIteration (fine dello stream)
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def iter_csv_records(request: Request, field: str = "file") -> AsyncIterator[Dict[str, str]]:
+    """
+    Restituisce le righe di un CSV con intestazione come dict.
+    Accetta il CSV come body (text/csv, letto in streaming) o come file multipart nel campo `field`.
+    """
+    if content_type(request) == "multipart/form-data":
+        form = await request.form()
+        upload = form.get(field)
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(400, f"File CSV mancante nel campo '{field}'")
+        reader = csv.reader(io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline=""))
+        header = [h.strip() for h in next(reader, [])]
+        for values in reader:
+            if values:
+                yield _csv_row(header, values)
+        return
+
+    # un solo reader per tutto il body: i campi quotati possono contenere a capo.
+    # next(reader) solo a record completo, così non resta mai senza righe a metà record
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    header = None
+    async for line in _iter_text_lines(request):
+        feed.feed(line)
+        while feed.records:
+            feed.records -= 1
+            values = next(reader, None)
+            if values is None or not any(v.strip() for v in values):
+                continue
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            yield _csv_row(header, values)
+    # virgolette non chiuse: il resto del body come ultimo record, come da file
+    for values in reader:
+        if header is not None and any(v.strip() for v in values):
+            yield _csv_row(header, values)
+
+
+class BatchWriter:
+    """
+    Accumula righe già validate e le scrive con executemany a blocchi di chunk_size.
+    Se un blocco fallisce lo riprova riga per riga per isolare gli elementi in errore.
+    """
+
+    def __init__(self, db: Session, table: Table, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 on_chunk: Optional[Callable[[Session, List[Dict[str, Any]]], None]] = None):
+        self.db = db
+        self.table = table
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk or self._mark_esercenti
+        self.received = 0
+        self.inserted = 0
+        self.chunks = 0
+        self.errors: List[Dict[str, Any]] = []
+        self._rows: List[Dict[str, Any]] = []
+        self._indexes: List[int] = []
+
+    @staticmethod
+    def _mark_esercenti(db: Session, rows: List[Dict[str, Any]]):
+        # le insert Core non passano dagli eventi ORM: aggiorna lo snapshot a mano
+        mark_dirty(db, {r.get("id_esercente") for r in rows})
+
+    @property
+    def full(self) -> bool:
+        return len(self._rows) >= self.chunk_size
+
+    def add(self, index: int, row: Dict[str, Any]):
+        self.received += 1
+        self._rows.append(row)
+        self._indexes.append(index)
+
+    def add_error(self, index: int, error: Any):
+        self.received += 1
+        self.errors.append({"index": index, "error": error})
+
+    def flush(self):
+        if not self._rows:
+            return
+        rows, indexes = self._rows, self._indexes
+        self._rows, self._indexes = [], []
+        self.chunks += 1
+
+        try:
+            self._write(rows)
+            self.inserted += len(rows)
+            return
+        except SQLAlchemyError:
+            self.db.rollback()
+
+        for index, row in zip(indexes, rows):
+            try:
+                self._write([row])
+                self.inserted += 1
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                self.errors.append({"index": index, "error": str(getattr(e, "orig", None) or e)})
+
+    def flush_session(self, db: Session):
+        """flush() nella forma richiesta da AsyncSession.run_sync"""
+        self.flush()
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        self.db.execute(insert(self.table), rows)
+        self.on_chunk(self.db, rows)
+        self.db.commit()
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": len(self.errors),
+            "chunks": self.chunks,
+            "errors": sorted(self.errors, key=lambda e: e["index"]),
+        }
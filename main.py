@@ -1,12 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi import FastAPI, Depends, HTTPException, Body, Query, Request, Response
+from pydantic import ValidationError
+from types import SimpleNamespace
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from datetime import datetime, date
-from database import SessionLocal, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, date, timedelta, timezone
+import hmac
+from database import SessionLocal, async_engine, engine, sync_schema
 import models
 import schemas
-from auth import authenticate, create_access_token, hash_password, get_db
-from services import compute_sentiment, sentiment_trend, build_suggestions
+from auth import authenticate_async, create_access_token, decode_token, hash_password, get_db, get_async_db
+from passwords import password_pool
+from services import compute_sentiment
+from snapshot import get_esercente_with_snapshot, mark_dirty, reevaluate_suggestions
+import rollup
+from cache import vetrina_cache
+from tripadvisor_service import backfill_location_ids
+from thumbnails import can_render, negotiate_format, pick_variant, size_bucket, thumbnail_worker
+from assets import (ASSET_CACHE_CONTROL, ASSET_SECURITY_HEADERS, IMAGE_FIELDS, URL_HASH_LENGTH, asset_cache, asset_urls,
+                    backfill_assets, get_asset, http_date, not_modified)
+from ingest import (BatchWriter, InvalidRecord, iter_json_records, iter_csv_records, is_csv,
+                    DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE)
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 
@@ -16,6 +31,7 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 models.Base.metadata.create_all(bind=engine)
+sync_schema(models.Base.metadata)
 
 # Avvia lo scheduler settimanale
 from weekly_scheduler import weekly_scheduler
@@ -29,6 +45,15 @@ def start_scheduler():
 def stop_scheduler():
     weekly_scheduler.stop()
     logger.info("Weekly scheduler stopped")
+    brightdata_service.close()
+    password_pool.shutdown()
+    thumbnail_worker.shutdown()
+    tripadvisor_service.close()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    # le connessioni aiosqlite hanno un thread non daemon: senza dispose il processo non termina
+    await async_engine.dispose()
 
 # configurazione CORS
 origins = [
@@ -51,11 +76,12 @@ app.add_middleware(
 # --- SECURITY: Bearer Token ---
 security = HTTPBearer()
 
-def require_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def require_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
-    # qui puoi validare il token con la tua logica (jwt decode, ecc.)
     if not token:
         raise HTTPException(status_code=401, detail="Token mancante o non valido")
+    # firma e scadenza verificate; i token già visti sono serviti dalla cache
+    decode_token(token)
     return token
 
 
@@ -79,18 +105,84 @@ def seed_user():
         db.close()
 
 
+@app.on_event("startup")
+def refresh_suggestions():
+    # dopo una modifica di suggestions.RULES: un solo passaggio su tutti gli snapshot
+    db = SessionLocal()
+    try:
+        updated = reevaluate_suggestions(db)
+        if updated:
+            logger.info(f"Suggerimenti ricalcolati per {updated} esercenti")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def resolve_tripadvisor_location_ids():
+    # esercenti salvati prima di Esercente.tripadvisor_location_id
+    db = SessionLocal()
+    try:
+        updated = backfill_location_ids(db)
+        if updated:
+            logger.info(f"Location TripAdvisor risolte per {updated} esercenti")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def sync_missing_assets():
+    # esercenti salvati prima di esercenti_asset: le letture non creano asset
+    db = SessionLocal()
+    try:
+        updated = backfill_assets(db)
+        if updated:
+            logger.info(f"Asset creati per {updated} esercenti")
+    except IntegrityError:
+        # un altro worker li ha creati nello stesso momento
+        db.rollback()
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def warn_missing_rollups():
+    # la ricostruzione è una migrazione (backfill_rollups.py): all'avvio solo un controllo EXISTS
+    db = SessionLocal()
+    try:
+        missing = rollup.rollups_missing(db)
+        if missing:
+            logger.warning(f"Rollup vuoti con dati presenti ({', '.join(missing)}): "
+                           f"eseguire python backfill_rollups.py")
+    finally:
+        db.close()
+
+
 # ---------- /get-token ----------
 @app.post("/get-token", response_model=schemas.TokenOut)
-def get_token(payload: schemas.LoginIn = Body(...), db: Session = Depends(get_db)):
-    if not authenticate(db, payload.email, payload.password):
+async def get_token(payload: schemas.LoginIn = Body(...), db: AsyncSession = Depends(get_async_db)):
+    # bcrypt gira nel pool dedicato: i login non occupano il threadpool degli altri endpoint
+    if not await authenticate_async(db, payload.email, payload.password):
         raise HTTPException(401, "Credenziali non valide")
     return {"token": create_access_token(sub=payload.email)}
 
 
+@app.get("/get-token/stats")
+async def password_pool_stats(token: str = Depends(require_token)):
+    return password_pool.stats()
+
+
 # ---------- /esercenti ----------
 @app.get("/esercenti", response_model=list[schemas.Esercente])
-def lista_esercenti(token: str = Depends(require_token), db: Session = Depends(get_db)):
-    return db.query(models.Esercente).all()
+def lista_esercenti(
+    asset_urls_: bool = Query(False, alias="asset_urls", description="URL degli asset al posto delle immagini base64"),
+    token: str = Depends(require_token),
+    db: Session = Depends(get_db)
+):
+    esercenti = db.query(models.Esercente).all()
+    if not asset_urls_:
+        return esercenti
+    urls = asset_urls(db, [e.id_esercente for e in esercenti])
+    return [with_asset_urls(schemas.Esercente.model_validate(e).model_dump(), urls[e.id_esercente]) for e in esercenti]
 
 
 @app.post("/esercenti", response_model=schemas.Esercente)
@@ -118,115 +210,335 @@ def update_esercente(
     return row
 
 
+@app.get("/esercenti/{id_esercente}/metrics", response_model=schemas.MetricheOut)
+async def metriche_esercente(
+    id_esercente: int,
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    start: date | None = Query(None, alias="from"),
+    end: date | None = Query(None, alias="to"),
+    token: str = Depends(require_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Andamento delle metriche social servito dai rollup (mai dalla tabella grezza)
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=90)
+    if start > end:
+        raise HTTPException(400, "'from' deve precedere 'to'")
+    buckets = await db.run_sync(rollup.get_range, id_esercente, granularity, start, end)
+    return {
+        "id_esercente": id_esercente,
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "buckets": buckets,
+    }
+
+
+def utc_naive(value: datetime | None) -> datetime | None:
+    # rilevato_at e i periodi dei rollup sono salvati in UTC senza fuso
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@app.get("/esercenti/{id_esercente}/rilevazioni/metrics", response_model=schemas.RilevazioniAggregateOut)
+async def metriche_rilevazioni(
+    id_esercente: int,
+    granularity: str = Query("hour", pattern="^(hour|day)$"),
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    token: str = Depends(require_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Medie orarie/giornaliere di emozioni e sentiment e totale passanti (UTC), dai rollup
+    """
+    end = utc_naive(end) or datetime.utcnow()
+    start = utc_naive(start) or end - timedelta(days=7)
+    if start > end:
+        raise HTTPException(400, "'from' deve precedere 'to'")
+    buckets = await db.run_sync(rollup.get_reading_range, id_esercente, granularity, start, end)
+    return {
+        "id_esercente": id_esercente,
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "buckets": buckets,
+    }
+
+
 # ---------- /data-crawled ----------
-@app.post("/data-crawled")
-def crea_dato(payload: schemas.DatoCrawledCreate, token: str = Depends(require_token), db: Session = Depends(get_db)):
-    now = datetime.now()
+def apply_crawl_defaults(payload: schemas.DatoCrawledCreate, now: datetime):
     if payload.data is None:
         payload.data = date.today()
     if payload.ora is None:
         payload.ora = now.time().replace(microsecond=0)
+
+
+@app.post("/data-crawled")
+async def crea_dato(payload: schemas.DatoCrawledCreate, token: str = Depends(require_token), db: AsyncSession = Depends(get_async_db)):
+    apply_crawl_defaults(payload, datetime.now())
     row = models.DatoCrawled(**payload.model_dump())
     db.add(row)
-    db.commit()
-    db.refresh(row)
+    await db.commit()
     return {"id": row.id}
 
 
+def after_crawled_chunk(db: Session, rows: list[dict]):
+    # le insert Core non passano dagli eventi ORM: snapshot e rollup vanno aggiornati a mano
+    mark_dirty(db, {r["id_esercente"] for r in rows})
+    rollup.add_samples(db, rows)
+
+
+@app.post("/data-crawled/batch")
+async def crea_dati_batch(
+    request: Request,
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=MAX_CHUNK_SIZE),
+    token: str = Depends(require_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Inserimento massivo di dati crawlati (JSON array, NDJSON o CSV con intestazione).
+    data/ora mancanti vengono valorizzati come in POST /data-crawled.
+    """
+    writer = BatchWriter(db.sync_session, models.DatoCrawled.__table__, chunk_size, on_chunk=after_crawled_chunk)
+    records = iter_csv_records(request) if is_csv(request) else iter_json_records(request)
+    index = 0
+    async for item in records:
+        try:
+            if isinstance(item, InvalidRecord):
+                raise item
+            payload = schemas.DatoCrawledCreate.model_validate(item)
+        except ValidationError as e:
+            writer.add_error(index, e.errors(include_url=False, include_context=False))
+        except InvalidRecord as e:
+            writer.add_error(index, str(e))
+        else:
+            apply_crawl_defaults(payload, datetime.now())
+            writer.add(index, payload.model_dump())
+            if writer.full:
+                await db.run_sync(writer.flush_session)
+        index += 1
+    await db.run_sync(writer.flush_session)
+    return writer.result()
+
+
 # ---------- /rilevazione ----------
+def apply_rilevazione_defaults(payload: schemas.RilevazioneCreate, now: datetime):
+    # se assente, rilevato_at vale l'istante di ricezione
+    payload.rilevato_at = utc_naive(payload.rilevato_at) if payload.rilevato_at else now
+
+
+def after_rilevazioni_chunk(db: Session, rows: list[dict]):
+    # come after_crawled_chunk: snapshot e rollup delle rilevazioni aggiornati a mano
+    mark_dirty(db, {r["id_esercente"] for r in rows})
+    rollup.add_readings(db, rows)
+
+
 @app.post("/rilevazione")
-def crea_rilevazione(payload: schemas.RilevazioneCreate, token: str = Depends(require_token), db: Session = Depends(get_db)):
+async def crea_rilevazione(payload: schemas.RilevazioneCreate, token: str = Depends(require_token), db: AsyncSession = Depends(get_async_db)):
+    apply_rilevazione_defaults(payload, datetime.utcnow())
     row = models.Rilevazione(**payload.model_dump())
     db.add(row)
-    db.commit()
-    db.refresh(row)
+    await db.commit()
     return {"id": row.id}
 
 
-# ---------- /vetrina ----------
-@app.get("/vetrina", response_model=schemas.VetrinaOut)
-def vetrina(id_esercente: int, token: str = Depends(require_token), db: Session = Depends(get_db)):
-    e = db.get(models.Esercente, id_esercente)
-    if not e:
-        raise HTTPException(404, "Esercente non trovato")
+@app.post("/rilevazione/batch")
+async def crea_rilevazioni_batch(
+    request: Request,
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=MAX_CHUNK_SIZE),
+    token: str = Depends(require_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Inserimento massivo di rilevazioni (JSON array o NDJSON).
+    Ogni elemento è validato con RilevazioneCreate; gli errori sono riportati per indice.
+    """
+    writer = BatchWriter(db.sync_session, models.Rilevazione.__table__, chunk_size, on_chunk=after_rilevazioni_chunk)
+    index = 0
+    async for item in iter_json_records(request):
+        try:
+            if isinstance(item, InvalidRecord):
+                raise item
+            payload = schemas.RilevazioneCreate.model_validate(item)
+        except ValidationError as e:
+            writer.add_error(index, e.errors(include_url=False, include_context=False))
+        except InvalidRecord as e:
+            writer.add_error(index, str(e))
+        else:
+            apply_rilevazione_defaults(payload, datetime.utcnow())
+            row = payload.model_dump()
+            # le insert Core non passano dall'evento before_insert
+            row["sentiment"] = compute_sentiment(SimpleNamespace(**row))
+            writer.add(index, row)
+            if writer.full:
+                await db.run_sync(writer.flush_session)
+        index += 1
+    await db.run_sync(writer.flush_session)
+    return writer.result()
 
-    last_crawled = (db.query(models.DatoCrawled)
-                      .filter(models.DatoCrawled.id_esercente == id_esercente)
-                      .order_by(models.DatoCrawled.data.desc().nullslast(),
-                                models.DatoCrawled.ora.desc().nullslast())
-                      .first())
-    last_ril = (db.query(models.Rilevazione)
-                  .filter(models.Rilevazione.id_esercente == id_esercente)
-                  .order_by(models.Rilevazione.id.desc())
-                  .first())
-
-    sent = compute_sentiment(last_ril)
-    msg = ("Ottimo andamento!" if sent and sent >= 0.7
-           else "Situazione da monitorare" if sent and sent >= 0.5
-           else "Attiva azioni correttive")
 
+# ---------- /assets ----------
+def with_asset_urls(payload: dict, urls: dict) -> dict:
+    # URL degli asset (assets.py) al posto dei blob base64; senza asset il valore resta quello originale
+    return {**payload, **{campo: url for campo, url in urls.items() if campo in payload and url is not None}}
+
+
+@app.get("/assets/{id_esercente}/{campo}/{filename}")
+async def get_asset_file(
+    id_esercente: int,
+    campo: str,
+    filename: str,
+    request: Request,
+    size: int | None = Query(None, ge=1, le=4096, description="Lato massimo in px: serve la miniatura (WebP/PNG secondo Accept)"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Logo e immagini delle certificazioni decodificati, con ETag/Last-Modified.
+    Senza token: gli URL sono usati direttamente nei tag <img> e contengono l'hash del contenuto,
+    che deve corrispondere (404 altrimenti, anche dopo un cambio di immagine).
+    """
+    if campo not in IMAGE_FIELDS:
+        raise HTTPException(404, "Asset non trovato")
+    url_hash = filename.split(".", 1)[0]
+    if size:
+        # una sola entry di cache per variante, qualunque sia il size richiesto
+        size = size_bucket(size)
+    fmt = negotiate_format(request.headers.get("accept")) if size else None
+    key = (id_esercente, campo, url_hash, size, fmt)
+    # generazione prima della lettura: un cambio di immagine durante la query fa scartare il set
+    generation = asset_cache.generation(key)
+    entry = asset_cache.get(key)
+    if entry is None:
+        asset = await db.run_sync(get_asset, id_esercente, campo)
+        if asset is None:
+            raise HTTPException(404, "Asset non trovato")
+        if not hmac.compare_digest(url_hash, asset.hash[:URL_HASH_LENGTH]):
+            # l'hash è l'unica protezione degli URL senza token: niente redirect a quello attuale,
+            # i client con un URL vecchio lo rileggono da /vetrina o /esercenti
+            raise HTTPException(404, "Asset non trovato")
+
+        variant = await db.run_sync(pick_variant, asset, size, fmt) if size else None
+        if variant is not None:
+            entry = (variant.dati, variant.content_type, f'"{asset.hash}-{variant.larghezza}.{fmt}"',
+                     http_date(variant.created_at), ASSET_CACHE_CONTROL)
+        elif size and can_render(asset):
+            # miniature non ancora pronte: originale, senza cache lunga
+            thumbnail_worker.schedule(id_esercente, campo)
+            entry = (asset.dati, asset.content_type, f'"{asset.hash}"', http_date(asset.updated_at), "public, max-age=60")
+        else:
+            # con size: immagine non ridimensionabile (es. SVG), l'originale è la risposta definitiva
+            entry = (asset.dati, asset.content_type, f'"{asset.hash}"', http_date(asset.updated_at), ASSET_CACHE_CONTROL)
+        if entry[4] == ASSET_CACHE_CONTROL:
+            asset_cache.set(key, entry, size=len(entry[0]), generation=generation)
+
+    data, content_type, etag, last_modified, cache_control = entry
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": cache_control, **ASSET_SECURITY_HEADERS}
+    if size:
+        headers["Vary"] = "Accept"
+    if not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=content_type, headers=headers)
+
+
+# ---------- /vetrina ----------
+def showcase_payload(e: models.Esercente, snap: models.EsercenteSnapshot) -> dict:
+    """Campi comuni a /vetrina e /dashboard, letti dallo snapshot dell'esercente"""
+    has_crawled = snap.id_dato_crawled is not None
     return {
         "nome": e.nome,
         "logo": e.logo,
         "colore_sfondo": e.colore_sfondo,
         "colore_carattere": e.colore_carattere,
-        "n_fan_facebook": int(last_crawled.n_fan_facebook) if last_crawled else None,
-        "n_followers_ig": int(last_crawled.n_followers_ig) if last_crawled else None,
-        "stelle_google": last_crawled.stelle_google if last_crawled else None,
-        "tripadvisor_rating": last_crawled.tripadvisor_rating if last_crawled else None,
-        "tripadvisor_reviews": int(last_crawled.tripadvisor_reviews) if last_crawled and last_crawled.tripadvisor_reviews else None,
+        "n_fan_facebook": snap.n_fan_facebook if has_crawled else None,
+        "n_followers_ig": snap.n_followers_ig if has_crawled else None,
+        "stelle_google": snap.stelle_google if has_crawled else None,
+        "tripadvisor_rating": snap.tripadvisor_rating if has_crawled else None,
+        "tripadvisor_reviews": snap.tripadvisor_reviews or None,
         "certificazione_1": e.certificazione_1,
         "immagine_certificazione_1": e.immagine_certificazione_1,
         "certificazione_2": e.certificazione_2,
         "immagine_certificazione_2": e.immagine_certificazione_2,
-        "messaggio": msg,
-        "sentiment": sent,
+        "sentiment": snap.sentiment,
     }
 
 
+@app.get("/vetrina", response_model=schemas.VetrinaOut)
+async def vetrina(
+    id_esercente: int,
+    asset_urls_: bool = Query(False, alias="asset_urls", description="URL degli asset al posto delle immagini base64"),
+    token: str = Depends(require_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # generazione letta prima della cache e delle query: un commit che invalida l'esercente
+    # nel frattempo fa scartare il set, così la scrittura non resta nascosta per tutto il TTL
+    generation = vetrina_cache.generation(id_esercente)
+    cached = vetrina_cache.get(id_esercente)
+    if cached is None:
+        cached = await build_vetrina(db, id_esercente, generation, asset_urls_)
+    payload, urls = cached
+    if not asset_urls_:
+        return payload
+    if urls is None:
+        # URL degli asset solo per chi li chiede, poi in cache insieme al payload
+        urls = (await db.run_sync(asset_urls, [id_esercente]))[id_esercente]
+        vetrina_cache.set(id_esercente, (payload, urls), generation=generation)
+    return with_asset_urls(payload, urls)
+
+
+async def build_vetrina(db: AsyncSession, id_esercente: int, generation: tuple,
+                        with_urls: bool) -> tuple[dict, dict | None]:
+    e, snap = await db.run_sync(get_esercente_with_snapshot, id_esercente)
+    if not e:
+        raise HTTPException(404, "Esercente non trovato")
+
+    sent = snap.sentiment
+    msg = ("Ottimo andamento!" if sent and sent >= 0.7
+           else "Situazione da monitorare" if sent and sent >= 0.5
+           else "Attiva azioni correttive")
+
+    payload = {**showcase_payload(e, snap), "messaggio": msg}
+    urls = (await db.run_sync(asset_urls, [id_esercente]))[id_esercente] if with_urls else None
+    vetrina_cache.set(id_esercente, (payload, urls), generation=generation)
+    return payload, urls
+
+
+@app.get("/vetrina/cache/stats")
+async def vetrina_cache_stats(token: str = Depends(require_token)):
+    return vetrina_cache.stats()
+
+
 # ---------- /dashboard ----------
 @app.get("/dashboard", response_model=schemas.DashboardOut)
-def dashboard(id_esercente: int, token: str = Depends(require_token), db: Session = Depends(get_db)):
-    e = db.get(models.Esercente, id_esercente)
+async def dashboard(
+    id_esercente: int,
+    asset_urls_: bool = Query(False, alias="asset_urls", description="URL degli asset al posto delle immagini base64"),
+    token: str = Depends(require_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # andamento e suggerimenti sono precalcolati nello snapshot quando arrivano dati nuovi
+    e, snap = await db.run_sync(get_esercente_with_snapshot, id_esercente)
     if not e:
         raise HTTPException(404, "Esercente non trovato")
 
-    last_crawled = (db.query(models.DatoCrawled)
-                      .filter(models.DatoCrawled.id_esercente == id_esercente)
-                      .order_by(models.DatoCrawled.data.desc().nullslast(),
-                                models.DatoCrawled.ora.desc().nullslast())
-                      .first())
-    rilevazioni = (db.query(models.Rilevazione)
-                     .filter(models.Rilevazione.id_esercente == id_esercente)
-                     .order_by(models.Rilevazione.id.asc())
-                     .all())
-    sent = compute_sentiment(rilevazioni[-1] if rilevazioni else None)
-    trend = sentiment_trend(rilevazioni, last_n=7)
-    tips = build_suggestions(sent, trend)
-
-    return {
-        "nome": e.nome,
-        "logo": e.logo,
-        "colore_sfondo": e.colore_sfondo,
-        "colore_carattere": e.colore_carattere,
-        "n_fan_facebook": int(last_crawled.n_fan_facebook) if last_crawled else None,
-        "n_followers_ig": int(last_crawled.n_followers_ig) if last_crawled else None,
-        "stelle_google": last_crawled.stelle_google if last_crawled else None,
-        "tripadvisor_rating": last_crawled.tripadvisor_rating if last_crawled else None,
-        "tripadvisor_reviews": int(last_crawled.tripadvisor_reviews) if last_crawled and last_crawled.tripadvisor_reviews else None,
-        "certificazione_1": e.certificazione_1,
-        "immagine_certificazione_1": e.immagine_certificazione_1,
-        "certificazione_2": e.certificazione_2,
-        "immagine_certificazione_2": e.immagine_certificazione_2,
+    payload = {
+        **showcase_payload(e, snap),
         "messaggio": "Sintesi automatica in base a sentiment e trend",
-        "sentiment": sent,
-        "andamento_sentiment": trend,
-        "suggerimenti": tips,
+        "andamento_sentiment": snap.andamento_sentiment or [],
+        "suggerimenti": snap.suggerimenti or [],
     }
+    if asset_urls_:
+        payload = with_asset_urls(payload, (await db.run_sync(asset_urls, [id_esercente]))[id_esercente])
+    return payload
 
 # ---------- BRIGHT DATA INTEGRATION ENDPOINTS ----------
 
 from brightdata_service import brightdata_service
+from itertools import chain
+import httpx
 from models import BrightDataJob, BrightDataResult, EsercenteSocialMapping, WeeklyCrawlSchedule
 from datetime import timedelta
 import logging
@@ -326,16 +638,13 @@ def get_crawl_results(
         if status_response.get("status") != "completed":
             raise HTTPException(400, "Job non ancora completato")
     
-    # Recupera i risultati da Bright Data
-    results_response = brightdata_service.get_job_results(job_id)
-    
-    if not results_response.get("success"):
-        raise HTTPException(500, f"Errore nel recupero risultati: {results_response.get('error')}")
-    
-    results_data = results_response.get("data", [])
-    
-    # Salva i risultati nel database
-    brightdata_service.save_results_to_db(db, job, results_data)
+    # Scarica i risultati in streaming (NDJSON) e li salva a blocchi
+    try:
+        results_chunks = brightdata_service.iter_job_results(job_id)
+        results_count = brightdata_service.save_results_to_db(db, job, chain.from_iterable(results_chunks))
+    except (httpx.HTTPError, ValueError) as e:
+        brightdata_service.discard_results(db, job)
+        raise HTTPException(500, f"Errore nel recupero risultati: {str(e)}")
     
     # Integrazione automatica con esercenti se richiesta
     if auto_integrate:
@@ -343,7 +652,7 @@ def get_crawl_results(
     
     return {
         "job_id": job_id,
-        "results_count": len(results_data),
+        "results_count": results_count,
         "status": "processed",
         "integrated": auto_integrate
     }
@@ -570,6 +879,18 @@ def get_weekly_crawl_status(
         ]
     }
 
+@app.get("/api/brightdata/job-checker/stats")
+def get_job_checker_stats(token: str = Depends(require_token)):
+    """
+    Metriche delle ultime esecuzioni del controllo orario dei job
+    """
+    runs = list(weekly_scheduler.job_checker_runs)
+    return {
+        "concurrency": weekly_scheduler.check_concurrency,
+        "last_run": runs[-1] if runs else None,
+        "runs": runs
+    }
+
 # ---------- TRIPADVISOR INTEGRATION ENDPOINTS ----------
 
 from tripadvisor_service import tripadvisor_service
@@ -577,11 +898,12 @@ from tripadvisor_service import tripadvisor_service
 @app.post("/api/tripadvisor/crawl", response_model=schemas.TripAdvisorResponse)
 def crawl_tripadvisor(
     payload: schemas.TripAdvisorCrawlRequest,
+    bypass_cache: bool = False,
     token: str = Depends(require_token),
     db: Session = Depends(get_db)
 ):
     """
-    Crawl TripAdvisor data per una location
+    Crawl TripAdvisor data per una location (dalla cache se disponibile; bypass_cache=true forza la chiamata all'API)
     """
     try:
         # Estrai location_id dall'URL
@@ -591,7 +913,9 @@ def crawl_tripadvisor(
             raise HTTPException(400, "Impossibile estrarre location_id dall'URL TripAdvisor")
         
         # Ottieni i dati combinati
-        combined_data = tripadvisor_service.get_combined_data(location_id)
+        combined_data = tripadvisor_service.get_combined_data(
+            location_id, payload.language or "it", payload.currency or "EUR", bypass_cache
+        )
         
         if not combined_data.get("success"):
             return schemas.TripAdvisorResponse(
@@ -602,6 +926,8 @@ def crawl_tripadvisor(
         
         return schemas.TripAdvisorResponse(
             success=True,
+            partial=combined_data.get("partial", False),
+            cache=combined_data.get("cache"),
             location_id=location_id,
             name=combined_data.get("name"),
             rating=combined_data.get("rating"),
@@ -621,6 +947,7 @@ def crawl_tripadvisor(
 def integrate_tripadvisor_data(
     id_esercente: int,
     tripadvisor_url: str,
+    bypass_cache: bool = False,
     token: str = Depends(require_token),
     db: Session = Depends(get_db)
 ):
@@ -640,54 +967,31 @@ def integrate_tripadvisor_data(
             raise HTTPException(400, "Impossibile estrarre location_id dall'URL TripAdvisor")
         
         # Ottieni i dati TripAdvisor
-        combined_data = tripadvisor_service.get_combined_data(location_id)
+        combined_data = tripadvisor_service.get_combined_data(location_id, bypass_cache=bypass_cache)
         
         if not combined_data.get("success"):
             raise HTTPException(500, f"Errore nel crawl TripAdvisor: {combined_data.get('error')}")
         
+        # solo dai dettagli: con i soli dati delle recensioni (dettagli scaduti o in errore)
+        # il numero di recensioni sarebbe quello della pagina scaricata, non il totale
+        metrics = tripadvisor_service.metrics_from_details(combined_data)
+        if metrics is None:
+            raise HTTPException(500, f"Errore nel crawl TripAdvisor: dettagli della location non disponibili "
+                                     f"({combined_data['raw_details'].get('error')})")
+        
         # Aggiorna l'esercente con l'URL TripAdvisor
         esercente.tripadvisor_url = tripadvisor_url
         
-        # Ottieni o crea un nuovo record dati_crawled per oggi
-        today = date.today()
+        # dato crawlato di oggi (le altre metriche vengono riportate dall'ultimo dato)
         now = datetime.now()
-        
-        dato_crawled = db.query(models.DatoCrawled).filter(
-            models.DatoCrawled.id_esercente == id_esercente,
-            models.DatoCrawled.data == today
-        ).first()
-        
-        if not dato_crawled:
-            dato_crawled = models.DatoCrawled(
-                id_esercente=id_esercente,
-                data=today,
-                ora=now.time().replace(microsecond=0),
-                n_fan_facebook=0,
-                n_followers_ig=0,
-                stelle_google=None,
-                tripadvisor_rating=None,
-                tripadvisor_reviews=None
-            )
-            db.add(dato_crawled)
-        
-        # Aggiorna con i dati TripAdvisor
-        if combined_data.get("rating"):
-            dato_crawled.tripadvisor_rating = float(combined_data["rating"])
-        
-        if combined_data.get("num_reviews"):
-            dato_crawled.tripadvisor_reviews = int(combined_data["num_reviews"])
-        elif combined_data.get("reviews_count"):
-            dato_crawled.tripadvisor_reviews = int(combined_data["reviews_count"])
-        
-        db.commit()
-        db.refresh(dato_crawled)
+        tripadvisor_service.save_metrics(db, {id_esercente: metrics})
         
         return {
             "success": True,
             "esercente_id": id_esercente,
             "location_id": location_id,
-            "tripadvisor_rating": dato_crawled.tripadvisor_rating,
-            "tripadvisor_reviews": dato_crawled.tripadvisor_reviews,
+            "tripadvisor_rating": metrics["tripadvisor_rating"],
+            "tripadvisor_reviews": metrics["tripadvisor_reviews"],
             "updated_at": now.isoformat(),
             "message": "Dati TripAdvisor integrati con successo"
         }
@@ -700,6 +1004,7 @@ def integrate_tripadvisor_data(
 @app.get("/api/tripadvisor/test")
 def test_tripadvisor_api(
     location_id: str = "123456",
+    bypass_cache: bool = False,
     token: str = Depends(require_token)
 ):
     """
@@ -707,7 +1012,7 @@ def test_tripadvisor_api(
     """
     try:
         # Test con location_id di esempio
-        combined_data = tripadvisor_service.get_combined_data(location_id)
+        combined_data = tripadvisor_service.get_combined_data(location_id, bypass_cache=bypass_cache)
         
         return {
             "test_location_id": location_id,
@@ -724,3 +1029,51 @@ def test_tripadvisor_api(
             "error": str(e),
             "timestamp": datetime.utcnow().isoformat()
         }
+
+
+@app.get("/api/tripadvisor/cache/stats")
+def tripadvisor_cache_stats(token: str = Depends(require_token)):
+    """
+    Statistiche della cache TripAdvisor (hit fresche/stale, refresh, chiamate all'API)
+    """
+    return tripadvisor_service.cache_stats()
+
+
+@app.post("/api/tripadvisor/refresh", status_code=202)
+def run_tripadvisor_refresh(token: str = Depends(require_token)):
+    """
+    Avvia subito, in background, il refresh TripAdvisor di tutti gli esercenti (di solito
+    giornaliero). L'avanzamento e l'esito si leggono da /api/tripadvisor/refresh/stats.
+    """
+    if not weekly_scheduler.trigger_tripadvisor_refresh():
+        raise HTTPException(status_code=409, detail="Refresh TripAdvisor già in corso")
+    return {"status": "scheduled", "stats": "/api/tripadvisor/refresh/stats"}
+
+
+@app.get("/api/tripadvisor/refresh/stats")
+def get_tripadvisor_refresh_stats(token: str = Depends(require_token)):
+    """
+    Metriche delle ultime esecuzioni del refresh TripAdvisor (throughput e chiamate all'API)
+    """
+    runs = list(weekly_scheduler.tripadvisor_runs)
+    return {
+        "concurrency": weekly_scheduler.tripadvisor_concurrency,
+        "rate_per_second": weekly_scheduler.tripadvisor_rate,
+        "max_calls_per_run": weekly_scheduler.tripadvisor_max_calls,
+        "running": weekly_scheduler.tripadvisor_current is not None,
+        "current_run": weekly_scheduler.tripadvisor_current,
+        "last_run": runs[-1] if runs else None,
+        "runs": runs
+    }
+
+
+# ---------- CHIAMATE IN USCITA (Bright Data, TripAdvisor) ----------
+
+import outbound
+
+@app.get("/api/outbound/stats")
+def get_outbound_stats(token: str = Depends(require_token)):
+    """
+    Stato del circuit breaker e contatori (tentativi, retry, 429/5xx, attesa del rate limit) per provider
+    """
+    return outbound.stats()
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, Time, Numeric, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, Time, Numeric, DateTime, Text, JSON, Float, Index, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -28,6 +28,7 @@ class Esercente(Base):
     pagina_ig = Column(String)
     google_recensioni = Column(String)
     tripadvisor_url = Column(String)
+    tripadvisor_location_id = Column(String, nullable=True)  # estratto da tripadvisor_url alla scrittura
     certificazione_1 = Column(String)
     immagine_certificazione_1 = Column(String)
     certificazione_2 = Column(String)
@@ -36,6 +37,32 @@ class Esercente(Base):
     dati = relationship("DatoCrawled", back_populates="esercente", cascade="all, delete")
     rilevazioni = relationship("Rilevazione", back_populates="esercente", cascade="all, delete")
 
+class EsercenteAsset(Base):
+    """Immagini dell'esercente decodificate dal base64, servite da /assets (assets.py)"""
+    __tablename__ = "esercenti_asset"
+
+    id_esercente = Column(Integer, ForeignKey("esercenti.id_esercente", ondelete="CASCADE"), primary_key=True)
+    campo = Column(String, primary_key=True)  # logo, immagine_certificazione_1, immagine_certificazione_2
+    hash = Column(String(64), nullable=False)  # sha256 del contenuto
+    content_type = Column(String, nullable=False)
+    dimensione = Column(Integer)
+    dati = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EsercenteAssetVariante(Base):
+    """Miniature di un asset (thumbnails.py), generate fuori dal percorso della richiesta"""
+    __tablename__ = "esercenti_asset_varianti"
+
+    id_esercente = Column(Integer, ForeignKey("esercenti.id_esercente", ondelete="CASCADE"), primary_key=True)
+    campo = Column(String, primary_key=True)
+    larghezza = Column(Integer, primary_key=True)  # lato massimo richiesto (64, 128, 512)
+    formato = Column(String, primary_key=True)  # webp, png
+    hash_originale = Column(String(64), nullable=False)  # EsercenteAsset.hash da cui è generata
+    content_type = Column(String, nullable=False)
+    dimensione = Column(Integer)
+    dati = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class DatoCrawled(Base):
     __tablename__ = "dati_crawled"
 
@@ -51,6 +78,12 @@ class DatoCrawled(Base):
 
     esercente = relationship("Esercente", back_populates="dati")
 
+    __table_args__ = (
+        # ultimo dato per esercente (ORDER BY data, ora DESC) e dato del giorno
+        # (id_esercente, data) per le integrazioni: basta il prefisso dell'indice
+        Index("ix_dati_crawled_esercente_data_ora", "id_esercente", "data", "ora"),
+    )
+
 class Rilevazione(Base):
     __tablename__ = "rilevazioni"
 
@@ -64,9 +97,46 @@ class Rilevazione(Base):
     sorpresa = Column(Numeric(3, 2))
     neutro = Column(Numeric(3, 2))
     n_passanti = Column(Integer)
+    sentiment = Column(Float, nullable=True)  # calcolato all'inserimento (services.compute_sentiment)
+    rilevato_at = Column(DateTime, default=datetime.utcnow)  # istante della lettura (UTC)
 
     esercente = relationship("Esercente", back_populates="rilevazioni")
 
+    __table_args__ = (
+        # ultime rilevazioni per esercente (ORDER BY id DESC)
+        Index("ix_rilevazioni_esercente_id", "id_esercente", "id"),
+        Index("ix_rilevazioni_esercente_rilevato_at", "id_esercente", "rilevato_at"),
+    )
+
+
+class EsercenteSnapshot(Base):
+    """Ultimo stato noto di un esercente (ultimo dato crawlato e ultima rilevazione)"""
+    __tablename__ = "esercenti_snapshot"
+
+    id_esercente = Column(Integer, ForeignKey("esercenti.id_esercente", ondelete="CASCADE"), primary_key=True)
+
+    # ultimo DatoCrawled
+    id_dato_crawled = Column(Integer, nullable=True)
+    data = Column(Date)
+    ora = Column(Time)
+    n_fan_facebook = Column(Integer)
+    n_followers_ig = Column(Integer)
+    stelle_google = Column(Numeric(2, 1))
+    tripadvisor_rating = Column(Numeric(2, 1))
+    tripadvisor_reviews = Column(Integer)
+
+    # ultima Rilevazione
+    id_rilevazione = Column(Integer, nullable=True)
+    sentiment = Column(Float, nullable=True)
+    andamento_sentiment = Column(JSON)  # ultime rilevazioni (snapshot.TREND_WINDOW)
+
+    # suggerimenti precalcolati (suggestions.py)
+    indicatori = Column(JSON)
+    suggerimenti = Column(JSON)
+    versione_regole = Column(String)
+
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 
 # --------- BRIGHT DATA INTEGRATION MODELS ---------
 
@@ -110,6 +180,11 @@ class BrightDataResult(Base):
     # Relazioni
     job = relationship("BrightDataJob", back_populates="results")
 
+    __table_args__ = (
+        # risultati da integrare per job (integrate_with_esercenti)
+        Index("ix_brightdata_results_job_processed", "job_id", "processed"),
+    )
+
 
 class EsercenteSocialMapping(Base):
     """Mappatura tra esercenti e URL social per crawling automatico"""
@@ -129,6 +204,10 @@ class EsercenteSocialMapping(Base):
     # Relazione con esercente
     esercente = relationship("Esercente")
 
+    __table_args__ = (
+        Index("ix_social_mapping_platform_url", "platform", "url"),
+    )
+
 
 class WeeklyCrawlSchedule(Base):
     """Schedulazione settimanale dei crawl"""
@@ -143,3 +222,92 @@ class WeeklyCrawlSchedule(Base):
     completed_jobs = Column(Integer, default=0)
     failed_jobs = Column(Integer, default=0)
     notes = Column(Text, nullable=True)
+
+
+# --------- TRIPADVISOR ---------
+
+class TripAdvisorCache(Base):
+    """Ultime risposte TripAdvisor per location (tripadvisor_cache.py), sopravvivono ai riavvii"""
+    __tablename__ = "tripadvisor_cache"
+
+    location_id = Column(String, primary_key=True)
+    lingua = Column(String, primary_key=True)
+    valuta = Column(String, primary_key=True)
+    recensioni = Column(JSON)  # risposta di /reviews (con ETag/Last-Modified se presenti)
+    dettagli = Column(JSON)  # risposta di /details
+    aggiornato_at = Column(DateTime, nullable=False)  # ultima risposta dell'API (UTC)
+
+
+# --------- ROLLUP METRICHE SOCIAL ---------
+
+class MetricheRollup(Base):
+    """Aggregati giornalieri/settimanali/mensili di dati_crawled per esercente (min/max/ultimo)"""
+    __tablename__ = "metriche_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    id_esercente = Column(Integer, ForeignKey("esercenti.id_esercente", ondelete="CASCADE"), nullable=False)
+    granularita = Column(String, nullable=False)  # 'day', 'week', 'month'
+    periodo = Column(Date, nullable=False)  # inizio del periodo (giorno, lunedì, primo del mese)
+    campioni = Column(Integer, default=0)
+    ultimo_at = Column(DateTime, nullable=True)  # data/ora del campione più recente
+    # {metrica}_last_at: data/ora del campione da cui viene {metrica}_last (può precedere ultimo_at)
+
+    n_fan_facebook_min = Column(Integer)
+    n_fan_facebook_max = Column(Integer)
+    n_fan_facebook_last = Column(Integer)
+    n_fan_facebook_last_at = Column(DateTime)
+    n_followers_ig_min = Column(Integer)
+    n_followers_ig_max = Column(Integer)
+    n_followers_ig_last = Column(Integer)
+    n_followers_ig_last_at = Column(DateTime)
+    stelle_google_min = Column(Numeric(2, 1))
+    stelle_google_max = Column(Numeric(2, 1))
+    stelle_google_last = Column(Numeric(2, 1))
+    stelle_google_last_at = Column(DateTime)
+    tripadvisor_rating_min = Column(Numeric(2, 1))
+    tripadvisor_rating_max = Column(Numeric(2, 1))
+    tripadvisor_rating_last = Column(Numeric(2, 1))
+    tripadvisor_rating_last_at = Column(DateTime)
+    tripadvisor_reviews_min = Column(Integer)
+    tripadvisor_reviews_max = Column(Integer)
+    tripadvisor_reviews_last = Column(Integer)
+    tripadvisor_reviews_last_at = Column(DateTime)
+
+    __table_args__ = (
+        # serve anche le letture per intervallo (esercente, granularità, periodo BETWEEN ...)
+        UniqueConstraint("id_esercente", "granularita", "periodo", name="uq_metriche_rollup_periodo"),
+    )
+
+
+class RilevazioniRollup(Base):
+    """Aggregati orari/giornalieri delle rilevazioni per esercente (somme e conteggi per le medie)"""
+    __tablename__ = "rilevazioni_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    id_esercente = Column(Integer, ForeignKey("esercenti.id_esercente", ondelete="CASCADE"), nullable=False)
+    granularita = Column(String, nullable=False)  # 'hour', 'day'
+    periodo = Column(DateTime, nullable=False)  # inizio del periodo (UTC)
+    campioni = Column(Integer, default=0)
+    n_passanti = Column(Integer, default=0)  # somma
+
+    # somma e numero di valori non nulli: media = somma / conteggio
+    gioia_sum = Column(Float, default=0.0)
+    gioia_count = Column(Integer, default=0)
+    tristezza_sum = Column(Float, default=0.0)
+    tristezza_count = Column(Integer, default=0)
+    paura_sum = Column(Float, default=0.0)
+    paura_count = Column(Integer, default=0)
+    rabbia_sum = Column(Float, default=0.0)
+    rabbia_count = Column(Integer, default=0)
+    disgusto_sum = Column(Float, default=0.0)
+    disgusto_count = Column(Integer, default=0)
+    sorpresa_sum = Column(Float, default=0.0)
+    sorpresa_count = Column(Integer, default=0)
+    neutro_sum = Column(Float, default=0.0)
+    neutro_count = Column(Integer, default=0)
+    sentiment_sum = Column(Float, default=0.0)
+    sentiment_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("id_esercente", "granularita", "periodo", name="uq_rilevazioni_rollup_periodo"),
+    )
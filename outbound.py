@@ -0,0 +1,273 @@
+"""
+Chiamate in uscita verso i provider esterni (Bright Data, TripAdvisor)
+
+Ogni provider ha un OutboundGate condiviso da tutte le sue chiamate:
+- token bucket: al massimo N richieste al secondo (con burst), le altre aspettano
+- retry con backoff esponenziale e jitter su 429/5xx ed errori di rete,
+  rispettando Retry-After quando il provider lo indica
+- circuit breaker: dopo troppi fallimenti consecutivi le chiamate falliscono
+  subito (CircuitOpenError) per reset_timeout secondi, poi passa una sola
+  chiamata di prova; se riesce il circuito si richiude
+
+Configurazione per provider da variabili d'ambiente con prefisso il nome
+del provider, es. TRIPADVISOR_RATE_LIMIT, BRIGHTDATA_MAX_RETRIES.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Circuito aperto: la chiamata non è stata eseguita"""
+
+
+class TokenBucket:
+    """Token bucket asincrono: rate token al secondo, al massimo burst accumulati"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """Attende i token; restituisce i secondi di attesa"""
+        # il lock va creato dentro il loop che lo userà
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class CircuitBreaker:
+    """
+    closed -> open dopo failure_threshold fallimenti consecutivi;
+    open -> half_open dopo reset_timeout secondi (una chiamata di prova alla volta);
+    half_open -> closed se la prova riesce, altrimenti di nuovo open
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self):
+        """Chiamata terminata senza esito (es. annullata): libera l'eventuale prova half-open"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 3)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout_seconds": self.reset_timeout,
+                "retry_in_seconds": retry_in,
+                "times_opened": self.times_opened,
+            }
+
+
+def _retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        # la forma HTTP-date non viene usata dai provider: si ripiega sul backoff
+        return None
+
+
+class OutboundGate:
+    """Rate limit, retry e circuit breaker delle chiamate verso un provider"""
+
+    COUNTERS = ("requests", "attempts", "retries", "successes", "failures", "rejected",
+                "status_429", "status_5xx", "transport_errors")
+
+    def __init__(self, name: str, rate: float = None, burst: float = None, max_retries: int = None,
+                 backoff_base: float = None, backoff_max: float = None,
+                 failure_threshold: int = None, reset_timeout: float = None):
+        prefix = name.upper()
+
+        def env(key: str, default: str) -> str:
+            return os.getenv(f"{prefix}_{key}", default)
+
+        self.name = name
+        self.bucket = TokenBucket(rate or float(env("RATE_LIMIT", "10")),
+                                  burst or float(env("RATE_BURST", "0")) or None)
+        self.max_retries = max_retries if max_retries is not None else int(env("MAX_RETRIES", "3"))
+        self.backoff_base = backoff_base or float(env("BACKOFF_BASE", "0.5"))
+        self.backoff_max = backoff_max or float(env("BACKOFF_MAX", "10"))
+        self.breaker = CircuitBreaker(failure_threshold or int(env("BREAKER_THRESHOLD", "5")),
+                                      reset_timeout or float(env("BREAKER_RESET", "30")))
+        self._counters = dict.fromkeys(self.COUNTERS, 0)
+        self._throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full jitter: uniforme in [0, base * 2^attempt], almeno Retry-After, al massimo backoff_max"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return min(delay, self.backoff_max)
+
+    async def request(self, send: Callable[[], Awaitable[httpx.Response]],
+                      idempotent: bool = True) -> httpx.Response:
+        """
+        Esegue send() con rate limit e retry. Restituisce l'ultima risposta anche se
+        è un errore (l'interpretazione resta al chiamante); rilancia l'ultimo errore
+        di rete se tutti i tentativi falliscono e CircuitOpenError se il circuito è aperto.
+        Le richieste non idempotenti (es. trigger di un job) sono ritentate solo quando
+        il provider non le ha eseguite: 429 o connessione non riuscita.
+        """
+        self._count("requests")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name}: circuito aperto, chiamata non eseguita")
+        try:
+            return await self._attempts(send, idempotent)
+        except BaseException:
+            # cancellazione o errore del chiamante: non dice nulla sullo stato del provider
+            self.breaker.release()
+            raise
+
+    def _retryable(self, response: Optional[httpx.Response], error: Optional[BaseException],
+                   idempotent: bool) -> bool:
+        if response is not None:
+            return response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+        return idempotent or isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+    async def _attempts(self, send: Callable[[], Awaitable[httpx.Response]], idempotent: bool) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            waited = await self.bucket.acquire()
+            with self._lock:
+                self._counters["attempts"] += 1
+                self._throttled_seconds += waited
+            try:
+                response, error = await send(), None
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                response, error = None, e
+                self._count("transport_errors")
+
+            if response is not None:
+                if response.status_code == 429:
+                    self._count("status_429")
+                elif response.status_code >= 500:
+                    self._count("status_5xx")
+                if response.status_code not in RETRY_STATUSES:
+                    self._count("successes")
+                    self.breaker.record_success()
+                    return response
+            if attempt == self.max_retries or not self._retryable(response, error, idempotent):
+                break
+
+            delay = self.backoff(attempt, _retry_after(response))
+            if response is not None:
+                await response.aclose()
+            self._count("retries")
+            logger.warning(
+                f"{self.name}: tentativo {attempt + 1} fallito "
+                f"({response.status_code if response is not None else type(error).__name__}), "
+                f"nuovo tentativo tra {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+        self._count("failures")
+        self.breaker.record_failure()
+        if response is not None:
+            return response
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            throttled = round(self._throttled_seconds, 3)
+        return {
+            **counters,
+            "throttled_seconds": throttled,
+            "rate_per_second": self.bucket.rate,
+            "burst": self.bucket.burst,
+            "max_retries": self.max_retries,
+            "circuit": self.breaker.stats(),
+        }
+
+
+_gates: Dict[str, OutboundGate] = {}
+_gates_lock = threading.Lock()
+
+
+def get_gate(name: str) -> OutboundGate:
+    """Gate condiviso del provider (creato al primo uso)"""
+    with _gates_lock:
+        if name not in _gates:
+            _gates[name] = OutboundGate(name)
+        return _gates[name]
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    with _gates_lock:
+        gates = dict(_gates)
+    return {name: gate.stats() for name, gate in gates.items()}
@@ -0,0 +1,112 @@
+"""
+Hash e verifica delle password (bcrypt) fuori dal thread della richiesta
+
+La verifica bcrypt è CPU-bound e, con il backend os_crypt, tiene il GIL:
+eseguita nel threadpool di FastAPI, una raffica di login rallenta tutti gli
+altri endpoint. Qui gira in un pool dedicato (processi di default) con un
+limite sulle verifiche in coda: oltre il limite il login viene rifiutato
+subito invece di accumulare attesa.
+
+Il costo bcrypt è configurabile (BCRYPT_ROUNDS): gli hash con un costo
+diverso vengono rigenerati al primo login riuscito (verify_and_update).
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwdctx = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def hash_password(p: str) -> str:
+    return pwdctx.hash(p)
+
+
+def verify_and_update(p: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """(password corretta, nuovo hash se il costo è cambiato)"""
+    return pwdctx.verify_and_update(p, hashed)
+
+
+class PasswordPoolBusy(Exception):
+    """Troppe verifiche in coda"""
+
+
+class PasswordPool:
+    """
+    Pool dedicato per le operazioni bcrypt.
+    kind="process" (default) non contende il GIL con gli endpoint;
+    kind="thread" basta se il backend bcrypt rilascia il GIL (pacchetto bcrypt).
+    """
+
+    def __init__(self, kind: str = None, workers: int = None, max_pending: int = None):
+        self.kind = kind or os.getenv("PASSWORD_POOL", "process")
+        if self.kind not in ("process", "thread"):
+            raise ValueError(f"PASSWORD_POOL {self.kind} non supportato. Supportati: ['process', 'thread']")
+        self.workers = workers or int(os.getenv("PASSWORD_WORKERS", "2"))
+        self.max_pending = max_pending or int(os.getenv("PASSWORD_MAX_PENDING", "32"))
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _ensure_executor(self) -> Executor:
+        # creato alla prima richiesta; spawn: nessun fork di un processo con thread attivi
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _release(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordPoolBusy(f"{self._pending} verifiche in coda (max {self.max_pending})")
+            executor = self._ensure_executor()
+            self._pending += 1
+        # il contatore scende quando il lavoro finisce davvero, anche se la richiesta è stata annullata
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def verify_and_update(self, p: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        return await self.run(verify_and_update, p, hashed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,526 @@
+"""
+Rollup per esercente delle metriche social (dati_crawled) e delle rilevazioni
+
+Per ogni esercente e periodo (giorno, settimana, mese) la tabella
+metriche_rollup tiene min, max e ultimo valore di follower, fan, stelle
+Google e rating/recensioni TripAdvisor. La tabella rilevazioni_rollup
+tiene, per ora e giorno, somme e conteggi di emozioni e sentiment (da cui
+le medie) e il totale dei passanti. Grafici e dashboard leggono solo i
+rollup, mai le tabelle grezze.
+
+Aggiornamento al commit:
+- righe nuove: upsert (INSERT ... ON CONFLICT DO UPDATE) dei periodi che le
+  contengono, con gli aggregati combinati nel database
+- righe modificate o eliminate: ricalcolo dei soli periodi coinvolti
+Le insert Core (endpoint batch) passano i campioni con add_samples() e
+add_readings(). I database con dati precedenti ai rollup si allineano una
+volta sola con backfill_rollups.py.
+"""
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session
+
+from database import upsert
+from models import DatoCrawled, MetricheRollup, Rilevazione, RilevazioniRollup
+from services import stored_sentiments
+
+GRANULARITIES = ("day", "week", "month")
+METRICS = ("n_fan_facebook", "n_followers_ig", "stelle_google", "tripadvisor_rating", "tripadvisor_reviews")
+
+READING_GRANULARITIES = ("hour", "day")
+EMOTIONS = ("gioia", "tristezza", "paura", "rabbia", "disgusto", "sorpresa", "neutro")
+READING_AVERAGES = EMOTIONS + ("sentiment",)
+
+# chiavi in Session.info
+SAMPLES_KEY = "rollup_samples"
+RECOMPUTE_KEY = "rollup_recompute"
+READINGS_KEY = "rollup_readings"
+READINGS_RECOMPUTE_KEY = "rollup_readings_recompute"
+
+
+def bucket_start(d: date, granularity: str) -> date:
+    if granularity == "day":
+        return d
+    if granularity == "week":
+        return d - timedelta(days=d.weekday())
+    if granularity == "month":
+        return d.replace(day=1)
+    raise ValueError(f"Granularità {granularity} non supportata. Supportate: {list(GRANULARITIES)}")
+
+
+def bucket_end(start: date, granularity: str) -> date:
+    """Primo giorno del periodo successivo"""
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _sample_from_row(row: Any) -> Dict[str, Any]:
+    get = row.get if isinstance(row, dict) else lambda k: getattr(row, k, None)
+    sample = {"id_esercente": get("id_esercente"), "data": get("data"), "ora": get("ora")}
+    sample.update({m: get(m) for m in METRICS})
+    return sample
+
+
+def _sample_at(sample: Dict[str, Any]) -> datetime:
+    return datetime.combine(sample["data"], sample["ora"] or time.min)
+
+
+def merge_sample(rollup: MetricheRollup, sample: Dict[str, Any]):
+    """
+    Aggiunge un campione agli aggregati del periodo
+    """
+    at = _sample_at(sample)
+    for m in METRICS:
+        v = sample.get(m)
+        if v is None:
+            continue
+        cur_min, cur_max = getattr(rollup, f"{m}_min"), getattr(rollup, f"{m}_max")
+        if cur_min is None or v < cur_min:
+            setattr(rollup, f"{m}_min", v)
+        if cur_max is None or v > cur_max:
+            setattr(rollup, f"{m}_max", v)
+        last_at = _last_at(rollup, m)
+        if getattr(rollup, f"{m}_last") is None or last_at is None or at >= last_at:
+            setattr(rollup, f"{m}_last", v)
+            setattr(rollup, f"{m}_last_at", at)
+    rollup.campioni = (rollup.campioni or 0) + 1
+    if rollup.ultimo_at is None or at >= rollup.ultimo_at:
+        rollup.ultimo_at = at
+
+
+def _last_at(rollup: MetricheRollup, m: str) -> Optional[datetime]:
+    # rollup precedenti a {m}_last_at: il valore è al più recente quanto ultimo_at
+    return getattr(rollup, f"{m}_last_at") or rollup.ultimo_at
+
+
+def add_samples(db: Session, rows: Iterable[Any]):
+    """
+    Accoda righe di dati_crawled (dict o oggetti) da aggregare al prossimo commit
+    """
+    samples = [_sample_from_row(r) for r in rows]
+    db.info.setdefault(SAMPLES_KEY, []).extend(s for s in samples if s["id_esercente"] and s["data"])
+
+
+def _least(current, new):
+    # come LEAST/GREATEST ma portabile: i NULL non vincono mai
+    return case((new.is_(None), current), ((current.is_(None)) | (new < current), new), else_=current)
+
+
+def _greatest(current, new):
+    return case((new.is_(None), current), ((current.is_(None)) | (new > current), new), else_=current)
+
+
+def _partial_buckets(samples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Aggregati dei soli campioni nuovi per periodo, nella forma dei parametri di apply_samples.
+    {metrica}_last_at è l'istante dell'ultimo campione con quella metrica valorizzata.
+    """
+    partial = {}
+    for sample in sorted(samples, key=_sample_at):
+        at = _sample_at(sample)
+        for g in GRANULARITIES:
+            key = (sample["id_esercente"], g, bucket_start(sample["data"], g))
+            row = partial.get(key)
+            if row is None:
+                row = partial[key] = {"id_esercente": key[0], "granularita": g, "periodo": key[2],
+                                      "campioni": 0, "ultimo_at": None}
+                row.update({f"{m}_{suffix}": None for m in METRICS for suffix in ("min", "max", "last", "last_at")})
+            row["campioni"] += 1
+            row["ultimo_at"] = at
+            for m in METRICS:
+                v = sample.get(m)
+                if v is None:
+                    continue
+                if row[f"{m}_min"] is None or v < row[f"{m}_min"]:
+                    row[f"{m}_min"] = v
+                if row[f"{m}_max"] is None or v > row[f"{m}_max"]:
+                    row[f"{m}_max"] = v
+                row[f"{m}_last"], row[f"{m}_last_at"] = v, at
+    return list(partial.values())
+
+
+def apply_samples(db: Session, samples: List[Dict[str, Any]]):
+    """
+    Merge incrementale dei campioni con un upsert per periodo: gli aggregati si
+    combinano nel database (campioni + n, min/max, ultimo valore se più recente),
+    così due commit concorrenti sullo stesso periodo non perdono aggiornamenti e
+    la creazione contemporanea di un periodo non viola uq_metriche_rollup_periodo.
+    """
+    if not samples:
+        return
+    table = MetricheRollup.__table__
+    stmt = upsert(db, table)
+    t, new = table.c, stmt.excluded
+    newer = t.ultimo_at.is_(None) | (new.ultimo_at >= t.ultimo_at)
+    values = {
+        "campioni": func.coalesce(t.campioni, 0) + new.campioni,
+        "ultimo_at": case((newer, new.ultimo_at), else_=t.ultimo_at),
+    }
+    for m in METRICS:
+        last, last_at = t[f"{m}_last"], t[f"{m}_last_at"]
+        values[f"{m}_min"] = _least(t[f"{m}_min"], new[f"{m}_min"])
+        values[f"{m}_max"] = _greatest(t[f"{m}_max"], new[f"{m}_max"])
+        # confronto con l'istante del valore salvato, non con ultimo_at: l'ultimo campione
+        # del periodo può non avere la metrica (rollup precedenti a {m}_last_at: ultimo_at)
+        stored_at = func.coalesce(last_at, t.ultimo_at)
+        newer_value = new[f"{m}_last"].isnot(None) & (
+            last.is_(None) | stored_at.is_(None) | (new[f"{m}_last_at"] >= stored_at))
+        values[f"{m}_last"] = case((newer_value, new[f"{m}_last"]), else_=last)
+        values[f"{m}_last_at"] = case((newer_value, new[f"{m}_last_at"]), else_=last_at)
+    stmt = stmt.on_conflict_do_update(index_elements=["id_esercente", "granularita", "periodo"], set_=values)
+    db.execute(stmt, _partial_buckets(samples))
+
+
+def recompute_buckets(db: Session, id_esercente: int, d: date):
+    """
+    Ricalcola dai dati grezzi i periodi che contengono la data d
+    """
+    for g in GRANULARITIES:
+        start = bucket_start(d, g)
+        # populate_existing: gli upsert Core non aggiornano gli oggetti già in sessione
+        rollup = db.query(MetricheRollup).populate_existing().filter(
+            MetricheRollup.id_esercente == id_esercente,
+            MetricheRollup.granularita == g,
+            MetricheRollup.periodo == start
+        ).first()
+        rows = (db.query(DatoCrawled)
+                  .filter(DatoCrawled.id_esercente == id_esercente,
+                          DatoCrawled.data >= start,
+                          DatoCrawled.data < bucket_end(start, g))
+                  .order_by(DatoCrawled.data, DatoCrawled.ora)
+                  .all())
+        if not rows:
+            if rollup is not None:
+                db.delete(rollup)
+            continue
+        if rollup is None:
+            rollup = MetricheRollup(id_esercente=id_esercente, granularita=g, periodo=start)
+            db.add(rollup)
+        rollup.campioni = 0
+        rollup.ultimo_at = None
+        for m in METRICS:
+            for suffix in ("min", "max", "last", "last_at"):
+                setattr(rollup, f"{m}_{suffix}", None)
+        for row in rows:
+            merge_sample(rollup, _sample_from_row(row))
+
+
+def rebuild_rollups(db: Session):
+    """
+    Ricostruisce tutti i rollup da dati_crawled (database esistenti)
+    """
+    db.query(MetricheRollup).delete(synchronize_session=False)
+    db.flush()
+    query = (db.query(DatoCrawled)
+               .filter(DatoCrawled.id_esercente.isnot(None), DatoCrawled.data.isnot(None))
+               .order_by(DatoCrawled.id))
+    batch = []
+    for row in query.yield_per(1000):
+        batch.append(_sample_from_row(row))
+        if len(batch) >= 1000:
+            apply_samples(db, batch)
+            db.flush()
+            batch = []
+    apply_samples(db, batch)
+    db.commit()
+
+
+def rollups_cover_rows(db: Session) -> bool:
+    """
+    True se i rollup coprono tutte le righe di dati_crawled: ogni riga conta come
+    un campione in esattamente un periodo mensile. Conta l'intera tabella.
+    """
+    campioni = (db.query(func.coalesce(func.sum(MetricheRollup.campioni), 0))
+                  .filter(MetricheRollup.granularita == "month")
+                  .scalar())
+    righe = (db.query(func.count(DatoCrawled.id))
+               .filter(DatoCrawled.id_esercente.isnot(None), DatoCrawled.data.isnot(None))
+               .scalar())
+    return campioni == righe
+
+
+def backfill_rollups(db: Session) -> bool:
+    """
+    Ricostruisce i rollup se non coprono tutte le righe di dati_crawled (database
+    precedenti ai rollup o popolati senza gli eventi di sessione). True se li ha
+    ricostruiti. Passo di migrazione (backfill_rollups.py), non da avvio del server.
+    """
+    if rollups_cover_rows(db):
+        return False
+    rebuild_rollups(db)
+    return True
+
+
+def rollups_missing(db: Session) -> List[str]:
+    """
+    Tabelle di rollup vuote con dati grezzi presenti (database precedenti ai rollup).
+    Solo query EXISTS: adatta all'avvio del server, a differenza dei conteggi completi.
+    """
+    missing = []
+    for raw, rollup_model, label in ((DatoCrawled, MetricheRollup, "metriche_rollup"),
+                                     (Rilevazione, RilevazioniRollup, "rilevazioni_rollup")):
+        if db.query(raw.id).first() is not None and db.query(rollup_model.id).first() is None:
+            missing.append(label)
+    return missing
+
+
+def get_range(db: Session, id_esercente: int, granularity: str, start: date, end: date) -> List[MetricheRollup]:
+    """
+    Rollup di un esercente con periodo in [inizio periodo di start, end]
+    """
+    return (db.query(MetricheRollup)
+              .filter(MetricheRollup.id_esercente == id_esercente,
+                      MetricheRollup.granularita == granularity,
+                      MetricheRollup.periodo >= bucket_start(start, granularity),
+                      MetricheRollup.periodo <= end)
+              .order_by(MetricheRollup.periodo)
+              .all())
+
+
+# ---------- Rilevazioni ----------
+
+def period_start(at: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Granularità {granularity} non supportata. Supportate: {list(READING_GRANULARITIES)}")
+
+
+def period_end(start: datetime, granularity: str) -> datetime:
+    """Inizio del periodo successivo"""
+    return start + (timedelta(hours=1) if granularity == "hour" else timedelta(days=1))
+
+
+def _reading_from_row(row: Any) -> Dict[str, Any]:
+    get = row.get if isinstance(row, dict) else lambda k: getattr(row, k, None)
+    sample = {"id_esercente": get("id_esercente"), "rilevato_at": get("rilevato_at"), "n_passanti": get("n_passanti")}
+    sample.update({m: get(m) for m in READING_AVERAGES})
+    return sample
+
+
+def _readings_from_rows(rows: List[Rilevazione]) -> List[Dict[str, Any]]:
+    # le righe precedenti alla colonna sentiment hanno NULL: calcolato in blocco
+    samples = [_reading_from_row(r) for r in rows]
+    for sample, value in zip(samples, stored_sentiments(rows)):
+        sample["sentiment"] = value
+    return samples
+
+
+def merge_reading(rollup: RilevazioniRollup, sample: Dict[str, Any]):
+    """
+    Aggiunge una rilevazione agli aggregati del periodo (i valori nulli non entrano nelle medie)
+    """
+    for m in READING_AVERAGES:
+        v = sample.get(m)
+        if v is None:
+            continue
+        setattr(rollup, f"{m}_sum", (getattr(rollup, f"{m}_sum") or 0.0) + float(v))
+        setattr(rollup, f"{m}_count", (getattr(rollup, f"{m}_count") or 0) + 1)
+    rollup.n_passanti = (rollup.n_passanti or 0) + (sample.get("n_passanti") or 0)
+    rollup.campioni = (rollup.campioni or 0) + 1
+
+
+def add_readings(db: Session, rows: Iterable[Any]):
+    """
+    Accoda rilevazioni (dict o oggetti) da aggregare al prossimo commit
+    """
+    samples = [_reading_from_row(r) for r in rows]
+    db.info.setdefault(READINGS_KEY, []).extend(s for s in samples if s["id_esercente"] and s["rilevato_at"])
+
+
+def _partial_reading_buckets(samples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Somme e conteggi delle sole rilevazioni nuove per periodo"""
+    partial = {}
+    for sample in samples:
+        for g in READING_GRANULARITIES:
+            key = (sample["id_esercente"], g, period_start(sample["rilevato_at"], g))
+            row = partial.get(key)
+            if row is None:
+                row = partial[key] = {"id_esercente": key[0], "granularita": g, "periodo": key[2],
+                                      "campioni": 0, "n_passanti": 0}
+                for m in READING_AVERAGES:
+                    row[f"{m}_sum"], row[f"{m}_count"] = 0.0, 0
+            row["campioni"] += 1
+            row["n_passanti"] += sample.get("n_passanti") or 0
+            for m in READING_AVERAGES:
+                v = sample.get(m)
+                if v is not None:
+                    row[f"{m}_sum"] += float(v)
+                    row[f"{m}_count"] += 1
+    return list(partial.values())
+
+
+def apply_readings(db: Session, samples: List[Dict[str, Any]]):
+    """
+    Merge incrementale delle rilevazioni con un upsert per periodo (somme e conteggi
+    incrementati nel database, come per apply_samples)
+    """
+    if not samples:
+        return
+    table = RilevazioniRollup.__table__
+    stmt = upsert(db, table)
+    t, new = table.c, stmt.excluded
+    values = {name: func.coalesce(t[name], 0) + new[name] for name in ("campioni", "n_passanti")}
+    for m in READING_AVERAGES:
+        for name in (f"{m}_sum", f"{m}_count"):
+            values[name] = func.coalesce(t[name], 0) + new[name]
+    stmt = stmt.on_conflict_do_update(index_elements=["id_esercente", "granularita", "periodo"], set_=values)
+    db.execute(stmt, _partial_reading_buckets(samples))
+
+
+def recompute_reading_buckets(db: Session, id_esercente: int, at: datetime):
+    """
+    Ricalcola dalle rilevazioni grezze i periodi che contengono l'istante at
+    """
+    for g in READING_GRANULARITIES:
+        start = period_start(at, g)
+        rollup = db.query(RilevazioniRollup).populate_existing().filter(
+            RilevazioniRollup.id_esercente == id_esercente,
+            RilevazioniRollup.granularita == g,
+            RilevazioniRollup.periodo == start
+        ).first()
+        rows = (db.query(Rilevazione)
+                  .filter(Rilevazione.id_esercente == id_esercente,
+                          Rilevazione.rilevato_at >= start,
+                          Rilevazione.rilevato_at < period_end(start, g))
+                  .all())
+        if not rows:
+            if rollup is not None:
+                db.delete(rollup)
+            continue
+        if rollup is None:
+            rollup = RilevazioniRollup(id_esercente=id_esercente, granularita=g, periodo=start)
+            db.add(rollup)
+        rollup.campioni = 0
+        rollup.n_passanti = 0
+        for m in READING_AVERAGES:
+            setattr(rollup, f"{m}_sum", 0.0)
+            setattr(rollup, f"{m}_count", 0)
+        for sample in _readings_from_rows(rows):
+            merge_reading(rollup, sample)
+
+
+def rebuild_reading_rollups(db: Session):
+    """
+    Ricostruisce tutti i rollup delle rilevazioni (quelle senza rilevato_at sono escluse)
+    """
+    db.query(RilevazioniRollup).delete(synchronize_session=False)
+    db.flush()
+    query = (db.query(Rilevazione)
+               .filter(Rilevazione.id_esercente.isnot(None), Rilevazione.rilevato_at.isnot(None))
+               .order_by(Rilevazione.id))
+    batch = []
+    for row in query.yield_per(1000):
+        batch.append(row)
+        if len(batch) >= 1000:
+            apply_readings(db, _readings_from_rows(batch))
+            db.flush()
+            batch = []
+    apply_readings(db, _readings_from_rows(batch))
+    db.commit()
+
+
+def reading_rollups_cover_rows(db: Session) -> bool:
+    """
+    True se i periodi giornalieri coprono tutte le rilevazioni con rilevato_at
+    """
+    campioni = (db.query(func.coalesce(func.sum(RilevazioniRollup.campioni), 0))
+                  .filter(RilevazioniRollup.granularita == "day")
+                  .scalar())
+    righe = (db.query(func.count(Rilevazione.id))
+               .filter(Rilevazione.id_esercente.isnot(None), Rilevazione.rilevato_at.isnot(None))
+               .scalar())
+    return campioni == righe
+
+
+def backfill_reading_rollups(db: Session) -> bool:
+    """
+    Come backfill_rollups per le rilevazioni. True se li ha ricostruiti.
+    """
+    if reading_rollups_cover_rows(db):
+        return False
+    rebuild_reading_rollups(db)
+    return True
+
+
+def reading_bucket(rollup: RilevazioniRollup) -> Dict[str, Any]:
+    """Medie del periodo a partire da somme e conteggi"""
+    bucket = {"periodo": rollup.periodo, "campioni": rollup.campioni or 0, "n_passanti": rollup.n_passanti or 0}
+    for m in READING_AVERAGES:
+        count = getattr(rollup, f"{m}_count")
+        bucket[m] = round(getattr(rollup, f"{m}_sum") / count, 4) if count else None
+    return bucket
+
+
+def get_reading_range(db: Session, id_esercente: int, granularity: str,
+                      start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """
+    Aggregati delle rilevazioni di un esercente con periodo in [inizio periodo di start, end]
+    """
+    rows = (db.query(RilevazioniRollup)
+              .filter(RilevazioniRollup.id_esercente == id_esercente,
+                      RilevazioniRollup.granularita == granularity,
+                      RilevazioniRollup.periodo >= period_start(start, granularity),
+                      RilevazioniRollup.periodo <= end)
+              .order_by(RilevazioniRollup.periodo)
+              .all())
+    return [reading_bucket(r) for r in rows]
+
+
+# ---------- Manutenzione automatica ----------
+
+@event.listens_for(Session, "after_flush")
+def _collect_crawled_rows(session, flush_context):
+    new_rows = [obj for obj in session.new if isinstance(obj, DatoCrawled)]
+    if new_rows:
+        add_samples(session, new_rows)
+    new_readings = [obj for obj in session.new if isinstance(obj, Rilevazione)]
+    if new_readings:
+        add_readings(session, new_readings)
+    for obj in chain(session.dirty, session.deleted):
+        if isinstance(obj, DatoCrawled) and obj.data is not None:
+            session.info.setdefault(RECOMPUTE_KEY, set()).add((obj.id_esercente, obj.data))
+            # una modifica della data sposta il campione: ricalcola anche il periodo di origine
+            for old in inspect(obj).attrs.data.history.deleted or ():
+                if old is not None:
+                    session.info[RECOMPUTE_KEY].add((obj.id_esercente, old))
+        elif isinstance(obj, Rilevazione):
+            pending = session.info.setdefault(READINGS_RECOMPUTE_KEY, set())
+            for at in chain([obj.rilevato_at], inspect(obj).attrs.rilevato_at.history.deleted or ()):
+                if at is not None:
+                    pending.add((obj.id_esercente, at))
+
+
+@event.listens_for(Session, "before_commit")
+def _update_rollups(session):
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    samples = session.info.pop(SAMPLES_KEY, None)
+    recompute = session.info.pop(RECOMPUTE_KEY, None)
+    readings = session.info.pop(READINGS_KEY, None)
+    readings_recompute = session.info.pop(READINGS_RECOMPUTE_KEY, None)
+    if samples:
+        apply_samples(session, samples)
+    if readings:
+        apply_readings(session, readings)
+    if recompute or readings_recompute:
+        session.flush()
+        for id_esercente, d in recompute or ():
+            recompute_buckets(session, id_esercente, d)
+        for id_esercente, at in readings_recompute or ():
+            recompute_reading_buckets(session, id_esercente, at)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_crawled_rows(session):
+    session.info.pop(SAMPLES_KEY, None)
+    session.info.pop(RECOMPUTE_KEY, None)
+    session.info.pop(READINGS_KEY, None)
+    session.info.pop(READINGS_RECOMPUTE_KEY, None)
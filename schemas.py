@@ -47,6 +47,7 @@ class EsercenteUpdate(BaseModel):
 
 class Esercente(EsercenteBase):
     id_esercente: int
+    tripadvisor_location_id: Optional[str] = None
     model_config = ConfigDict(from_attributes=True)
 
 # -------- DATI CRAWLED --------
@@ -88,6 +89,7 @@ class RilevazioneBase(BaseModel):
     sorpresa: Optional[Decimal] = None
     neutro: Optional[Decimal] = None
     n_passanti: Optional[int] = None
+    rilevato_at: Optional[datetime] = None  # se assente: istante di ricezione (UTC)
 
 class RilevazioneCreate(RilevazioneBase): 
     pass
@@ -123,6 +125,56 @@ class DashboardOut(VetrinaOut):
     suggerimenti: list[str] = []
 
 
+# -------- METRICHE (rollup) --------
+class MetricheBucket(BaseModel):
+    periodo: date
+    campioni: int
+    n_fan_facebook_min: Optional[int] = None
+    n_fan_facebook_max: Optional[int] = None
+    n_fan_facebook_last: Optional[int] = None
+    n_followers_ig_min: Optional[int] = None
+    n_followers_ig_max: Optional[int] = None
+    n_followers_ig_last: Optional[int] = None
+    stelle_google_min: Optional[Decimal] = None
+    stelle_google_max: Optional[Decimal] = None
+    stelle_google_last: Optional[Decimal] = None
+    tripadvisor_rating_min: Optional[Decimal] = None
+    tripadvisor_rating_max: Optional[Decimal] = None
+    tripadvisor_rating_last: Optional[Decimal] = None
+    tripadvisor_reviews_min: Optional[int] = None
+    tripadvisor_reviews_max: Optional[int] = None
+    tripadvisor_reviews_last: Optional[int] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class MetricheOut(BaseModel):
+    id_esercente: int
+    granularity: str
+    start: date
+    end: date
+    buckets: list[MetricheBucket] = []
+
+
+class RilevazioniBucket(BaseModel):
+    periodo: datetime
+    campioni: int
+    n_passanti: int
+    gioia: Optional[float] = None
+    tristezza: Optional[float] = None
+    paura: Optional[float] = None
+    rabbia: Optional[float] = None
+    disgusto: Optional[float] = None
+    sorpresa: Optional[float] = None
+    neutro: Optional[float] = None
+    sentiment: Optional[float] = None
+
+class RilevazioniAggregateOut(BaseModel):
+    id_esercente: int
+    granularity: str
+    start: datetime
+    end: datetime
+    buckets: list[RilevazioniBucket] = []
+
+
 # -------- BRIGHT DATA SCHEMAS --------
 
 class BrightDataJobBase(BaseModel):
@@ -227,6 +279,8 @@ class TripAdvisorCrawlRequest(BaseModel):
 
 class TripAdvisorResponse(BaseModel):
     success: bool
+    partial: bool = False  # recensioni o dettagli mancanti (errore o timeout)
+    cache: Optional[str] = None  # hit, stale, miss, bypass
     location_id: Optional[str] = None
     name: Optional[str] = None
     rating: Optional[float] = None
@@ -1,5 +1,8 @@
-from typing import Iterable
+from typing import Iterable, Sequence
+import numpy as np
+from sqlalchemy import event
 from models import Rilevazione
+from suggestions import build_indicators, evaluate
 
 def _to_float(x):
     return float(x) if x is not None else None
@@ -13,19 +16,69 @@ def compute_sentiment(r: Rilevazione | None) -> float | None:
     score = max(0.0, min(1.0, 0.5 + (gioia - (neg or 0.0))))
     return round(score, 2)
 
+def _column(values: Sequence) -> np.ndarray:
+    # None -> NaN; accetta anche Decimal (colonne Numeric)
+    if isinstance(values, np.ndarray):
+        return values.astype(np.float64, copy=False)
+    # np.asarray su una lista di Decimal passa da un array di oggetti: molto più lento
+    return np.fromiter((np.nan if v is None else float(v) for v in values), np.float64, count=len(values))
+
+def compute_sentiment_batch(gioia: Sequence, tristezza: Sequence, paura: Sequence,
+                            rabbia: Sequence, disgusto: Sequence) -> np.ndarray:
+    """
+    compute_sentiment su colonne di valori (liste o array, None/NaN = NULL).
+    Stesse regole della versione scalare: gioia nulla vale 0, i negativi
+    nulli sono esclusi dalla media, media 0 se sono tutti nulli.
+    """
+    g = np.nan_to_num(_column(gioia), nan=0.0)
+    neg_sum = np.zeros_like(g)
+    neg_count = np.zeros_like(g)
+    # somma nello stesso ordine della versione scalare: risultati identici bit a bit
+    for col in (tristezza, paura, rabbia, disgusto):
+        v = _column(col)
+        present = ~np.isnan(v)
+        neg_sum = neg_sum + np.where(present, v, 0.0)
+        neg_count += present
+    neg = neg_sum / np.maximum(1.0, neg_count)
+    score = np.clip(0.5 + (g - neg), 0.0, 1.0)
+    rounded = np.round(score, 2)
+    # np.round scala per 100 e può sbagliare i casi a metà: round() di Python su quelli
+    scaled = score * 100
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(ties):
+        rounded[i] = round(float(score[i]), 2)
+    return rounded
+
+def stored_sentiments(rilevazioni: Iterable[Rilevazione]) -> list[float | None]:
+    """
+    stored_sentiment su molte righe: calcola in blocco solo quelle con sentiment NULL
+    """
+    rows = list(rilevazioni)
+    values = [r.sentiment for r in rows]
+    missing = [i for i, v in enumerate(values) if v is None]
+    if missing:
+        scores = compute_sentiment_batch(*(
+            [getattr(rows[i], c) for i in missing]
+            for c in ("gioia", "tristezza", "paura", "rabbia", "disgusto")
+        ))
+        for i, score in zip(missing, scores.tolist()):
+            values[i] = score
+    return values
+
+def stored_sentiment(r: Rilevazione | None) -> float | None:
+    # le righe inserite prima della colonna sentiment hanno NULL: calcolo al volo
+    if not r: return None
+    return r.sentiment if r.sentiment is not None else compute_sentiment(r)
+
 def sentiment_trend(rilevazioni: Iterable[Rilevazione], last_n: int = 7) -> list[float]:
     arr = list(rilevazioni)[-last_n:]
-    return [compute_sentiment(r) or 0.5 for r in arr]
+    return [s or 0.5 for s in stored_sentiments(arr)]
+
+@event.listens_for(Rilevazione, "before_insert")
+@event.listens_for(Rilevazione, "before_update")
+def _persist_sentiment(mapper, connection, target):
+    target.sentiment = compute_sentiment(target)
 
 def build_suggestions(sentiment: float | None, trend: list[float]) -> list[str]:
-    s = sentiment if sentiment is not None else 0.5
-    tips = []
-    if s < 0.4:
-        tips.append("Attiva campagne social mirate e rispondi a recensioni negative.")
-    if trend and len(trend) >= 3 and trend[-1] < trend[0]:
-        tips.append("Il sentiment è in calo: pubblica contenuti positivi e offerte.")
-    if s > 0.7:
-        tips.append("Molto bene! Mantieni la frequenza dei post e incoraggia le recensioni.")
-    if not tips:
-        tips.append("Mantieni costanza nella comunicazione e monitora i KPI settimanali.")
-    return tips
+    # regole in suggestions.RULES; la dashboard legge i suggerimenti precalcolati nello snapshot
+    return evaluate(build_indicators(sentiment, trend))
@@ -0,0 +1,162 @@
+"""
+Read model "ultimo stato" degli esercenti
+
+La tabella esercenti_snapshot contiene, per ogni esercente, l'ultimo dato
+crawlato, l'ultima rilevazione (con il sentiment già calcolato), l'andamento
+del sentiment e i suggerimenti della dashboard (suggestions.py).
+Viene aggiornata al commit di ogni sessione che scrive DatoCrawled o
+Rilevazione, così /vetrina e /dashboard leggono con un solo lookup per
+chiave primaria invece di tre query.
+"""
+from datetime import timedelta
+from itertools import chain
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import upsert
+from models import DatoCrawled, Esercente, EsercenteSnapshot, Rilevazione
+from services import sentiment_trend, stored_sentiment
+from suggestions import GROWTH_WINDOW_DAYS, RULES_VERSION, build_indicators, evaluate
+
+# chiave in Session.info con gli esercenti da riallineare al commit
+PENDING_KEY = "snapshot_esercenti"
+
+# punti dell'andamento del sentiment mostrato in dashboard
+TREND_WINDOW = 7
+
+
+def mark_dirty(db: Session, ids: Iterable[int]):
+    """
+    Segna gli esercenti da riallineare al prossimo commit.
+    Serve ai percorsi che scrivono con insert Core (bypassano gli eventi ORM).
+    """
+    db.info.setdefault(PENDING_KEY, set()).update(i for i in ids if i is not None)
+
+
+def refresh_snapshot(db: Session, id_esercente: int) -> EsercenteSnapshot:
+    """
+    Ricalcola lo snapshot di un esercente dalle tabelle sorgente
+    """
+    last_crawled = (db.query(DatoCrawled)
+                      .filter(DatoCrawled.id_esercente == id_esercente)
+                      .order_by(DatoCrawled.data.desc().nullslast(),
+                                DatoCrawled.ora.desc().nullslast())
+                      .first())
+    # solo le ultime N rilevazioni (indice id_esercente, id), non tutto lo storico
+    recenti = (db.query(Rilevazione)
+                 .filter(Rilevazione.id_esercente == id_esercente)
+                 .order_by(Rilevazione.id.desc())
+                 .limit(TREND_WINDOW)
+                 .all())[::-1]
+    last_ril = recenti[-1] if recenti else None
+    baseline = None
+    if last_crawled is not None and last_crawled.data is not None:
+        baseline = (db.query(DatoCrawled)
+                      .filter(DatoCrawled.id_esercente == id_esercente,
+                              DatoCrawled.data <= last_crawled.data - timedelta(days=GROWTH_WINDOW_DAYS))
+                      .order_by(DatoCrawled.data.desc(), DatoCrawled.ora.desc().nullslast())
+                      .first())
+
+    snap = db.get(EsercenteSnapshot, id_esercente)
+    if snap is None:
+        # due richieste possono costruire insieme lo stesso snapshot: la riga nasce con un upsert
+        db.execute(upsert(db, EsercenteSnapshot.__table__)
+                   .values(id_esercente=id_esercente)
+                   .on_conflict_do_nothing(index_elements=["id_esercente"]))
+        snap = db.get(EsercenteSnapshot, id_esercente)
+
+    snap.id_dato_crawled = last_crawled.id if last_crawled else None
+    snap.data = last_crawled.data if last_crawled else None
+    snap.ora = last_crawled.ora if last_crawled else None
+    snap.n_fan_facebook = last_crawled.n_fan_facebook if last_crawled else None
+    snap.n_followers_ig = last_crawled.n_followers_ig if last_crawled else None
+    snap.stelle_google = last_crawled.stelle_google if last_crawled else None
+    snap.tripadvisor_rating = last_crawled.tripadvisor_rating if last_crawled else None
+    snap.tripadvisor_reviews = last_crawled.tripadvisor_reviews if last_crawled else None
+
+    snap.id_rilevazione = last_ril.id if last_ril else None
+    snap.sentiment = stored_sentiment(last_ril)
+    snap.andamento_sentiment = sentiment_trend(recenti, last_n=TREND_WINDOW)
+
+    apply_suggestions(snap, build_indicators(snap.sentiment, snap.andamento_sentiment, last_crawled, baseline))
+    return snap
+
+
+def apply_suggestions(snap: EsercenteSnapshot, indicators: Dict[str, Any]):
+    """
+    Valuta le regole sugli indicatori e salva i suggerimenti nello snapshot
+    """
+    snap.indicatori = indicators
+    snap.suggerimenti = evaluate(indicators)
+    snap.versione_regole = RULES_VERSION
+
+
+def reevaluate_suggestions(db: Session) -> int:
+    """
+    Ricalcola in un solo passaggio i suggerimenti salvati con una versione
+    diversa delle regole, dagli indicatori già nello snapshot (senza rileggere
+    le tabelle sorgente). Restituisce il numero di snapshot aggiornati.
+    """
+    stale = (db.query(EsercenteSnapshot)
+               .filter((EsercenteSnapshot.versione_regole != RULES_VERSION) |
+                       EsercenteSnapshot.versione_regole.is_(None))
+               .all())
+    for snap in stale:
+        if snap.indicatori is None:
+            # snapshot precedenti agli indicatori
+            refresh_snapshot(db, snap.id_esercente)
+        else:
+            apply_suggestions(snap, snap.indicatori)
+    db.commit()
+    return len(stale)
+
+
+def get_esercente_with_snapshot(db: Session, id_esercente: int) -> Tuple[Optional[Esercente], Optional[EsercenteSnapshot]]:
+    """
+    Legge esercente e snapshot con una sola query.
+    Gli esercenti creati prima dello snapshot (o con suggerimenti di regole
+    precedenti) vengono allineati alla prima lettura.
+    """
+    row = (db.query(Esercente, EsercenteSnapshot)
+             .outerjoin(EsercenteSnapshot, EsercenteSnapshot.id_esercente == Esercente.id_esercente)
+             .filter(Esercente.id_esercente == id_esercente)
+             .first())
+    if not row:
+        return None, None
+
+    e, snap = row
+    if snap is None or snap.indicatori is None:
+        snap = refresh_snapshot(db, id_esercente)
+        db.commit()
+    elif snap.versione_regole != RULES_VERSION:
+        apply_suggestions(snap, snap.indicatori)
+        db.commit()
+    return e, snap
+
+
+# ---------- Manutenzione automatica ----------
+
+@event.listens_for(Session, "after_flush")
+def _collect_dirty_esercenti(session, flush_context):
+    # new/dirty/deleted riflettono ancora lo stato pre-flush
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (DatoCrawled, Rilevazione)):
+            mark_dirty(session, [obj.id_esercente])
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_dirty_snapshots(session):
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    ids = session.info.pop(PENDING_KEY, None)
+    if not ids:
+        return
+    for id_esercente in ids:
+        refresh_snapshot(session, id_esercente)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_dirty_esercenti(session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Verifica del client asincrono Bright Data contro un server stub locale
+
+Lo stub emula /trigger e /snapshot/{id} (status, JSON e NDJSON) e conta
+connessioni TCP e richieste concorrenti. Non serve un token Bright Data
+né il server FastAPI:
+1. API sincrona (wrapper): trigger, status, 404, risultati JSON e NDJSON
+2. Connessioni keep-alive riusate dal pool
+3. Limite di concorrenza (BRIGHTDATA_MAX_CONCURRENCY)
+4. Timeout per operazione (BRIGHTDATA_STATUS_TIMEOUT)
+
+Uso: python test_brightdata_stub.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Configurazione (prima di importare il servizio)
+MAX_CONCURRENCY = 4
+os.environ["BRIGHTDATA_API_TOKEN"] = "stub-token"
+os.environ["BRIGHTDATA_MAX_CONCURRENCY"] = str(MAX_CONCURRENCY)
+os.environ["BRIGHTDATA_STATUS_TIMEOUT"] = "0.5"
+os.environ["BRIGHTDATA_MAX_RETRIES"] = "0"
+os.environ["BRIGHTDATA_RATE_LIMIT"] = "1000"
+
+ROWS = [{"url": f"https://www.instagram.com/locale{i}", "followers": 100 + i, "posts": i} for i in range(25)]
+
+
+class StubState:
+    lock = threading.Lock()
+    connections = set()
+    in_flight = 0
+    max_in_flight = 0
+    delay = 0.0
+    triggers = []
+
+
+class BrightDataStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: str, content_type: str = "application/json"):
+        data = body.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _enter(self):
+        with StubState.lock:
+            StubState.connections.add(self.client_address)
+            StubState.in_flight += 1
+            StubState.max_in_flight = max(StubState.max_in_flight, StubState.in_flight)
+
+    def _exit(self):
+        with StubState.lock:
+            StubState.in_flight -= 1
+
+    def do_POST(self):
+        self._enter()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            url = urlsplit(self.path)
+            if url.path != "/trigger":
+                return self._send(404, "{}")
+            StubState.triggers.append({"query": parse_qs(url.query), "body": body,
+                                       "auth": self.headers.get("Authorization")})
+            self._send(200, json.dumps({"snapshot_id": "s_stub"}))
+        finally:
+            self._exit()
+
+    def do_GET(self):
+        self._enter()
+        try:
+            time.sleep(StubState.delay)
+            url = urlsplit(self.path)
+            job_id = url.path.rsplit("/", 1)[-1]
+            fmt = parse_qs(url.query).get("format", [None])[0]
+            if not url.path.startswith("/snapshot/") or job_id == "missing":
+                return self._send(404, json.dumps({"error": "not found"}))
+            if fmt == "json":
+                return self._send(200, json.dumps(ROWS))
+            if fmt in ("ndjson", "jsonl"):
+                return self._send(200, "\n".join(json.dumps(r) for r in ROWS) + "\n", "application/x-ndjson")
+            self._send(200, json.dumps({"status": "completed", "total_rows": len(ROWS)}))
+        finally:
+            self._exit()
+
+
+def start_stub() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BrightDataStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+failures = []
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"{'✅' if ok else '❌'} {label}" + (f" ({detail})" if detail else ""))
+    if not ok:
+        failures.append(label)
+
+
+def reset_counters():
+    with StubState.lock:
+        StubState.connections.clear()
+        StubState.max_in_flight = 0
+
+
+def main():
+    server = start_stub()
+    os.environ["BRIGHTDATA_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    from brightdata_service import BrightDataService
+    service = BrightDataService()
+
+    print("=" * 60)
+    print("🧪 CLIENT BRIGHT DATA CONTRO LO STUB LOCALE")
+    print("=" * 60)
+
+    print("\n🔁 API sincrona")
+    result = service.trigger_crawl("facebook", ["https://www.facebook.com/locale"], {"num_of_reviews": 5})
+    trigger = StubState.triggers[-1] if StubState.triggers else {}
+    check("trigger restituisce lo snapshot_id", result.get("success") and result.get("job_id") == "s_stub", str(result.get("job_id")))
+    check("trigger invia dataset, payload e token",
+          trigger.get("query", {}).get("dataset_id") == [service.dataset_ids["facebook"]]
+          and trigger.get("body") == [{"url": "https://www.facebook.com/locale", "num_of_reviews": 5}]
+          and trigger.get("auth") == "Bearer stub-token")
+    check("status di un job completato", service.get_job_status("s_stub").get("status") == "completed")
+    check("status di un job inesistente", service.get_job_status("missing").get("status") == "not_found")
+    results = service.get_job_results("s_stub")
+    check("risultati JSON", results.get("success") and results.get("data") == ROWS, f"{len(results.get('data') or [])} righe")
+    chunks = list(service.iter_job_results("s_stub", chunk_size=10))
+    check("risultati NDJSON a blocchi", [len(c) for c in chunks] == [10, 10, 5] and sum(chunks, []) == ROWS,
+          str([len(c) for c in chunks]))
+    try:
+        service.trigger_crawl("tiktok", ["x"])
+        check("piattaforma non supportata rifiutata", False)
+    except ValueError:
+        check("piattaforma non supportata rifiutata", True)
+
+    print("\n🔗 Connessioni in pool")
+    reset_counters()
+    for _ in range(20):
+        service.get_job_status("s_stub")
+    check("20 richieste in sequenza su una sola connessione", len(StubState.connections) == 1,
+          f"{len(StubState.connections)} connessioni")
+
+    print("\n🚦 Limite di concorrenza")
+    reset_counters()
+    StubState.delay = 0.1
+
+    async def burst():
+        jobs = [service.get_job_status_async(f"job{i}") for i in range(40)]
+        return await asyncio.gather(*jobs)
+
+    started = time.perf_counter()
+    statuses = service.loop.run(burst())
+    elapsed = time.perf_counter() - started
+    check("40 richieste concorrenti completate", all(s["status"] == "completed" for s in statuses))
+    check(f"al massimo {MAX_CONCURRENCY} richieste in volo", StubState.max_in_flight <= MAX_CONCURRENCY,
+          f"massimo osservato {StubState.max_in_flight}")
+    check(f"al massimo {MAX_CONCURRENCY} connessioni aperte", len(StubState.connections) <= MAX_CONCURRENCY,
+          f"{len(StubState.connections)} connessioni")
+    print(f"   ⏱️  {elapsed:.2f}s (minimo teorico {40 / MAX_CONCURRENCY * StubState.delay:.2f}s)")
+
+    print("\n⏳ Timeout per operazione")
+    StubState.delay = 1.0
+    started = time.perf_counter()
+    status = service.get_job_status("lento")
+    elapsed = time.perf_counter() - started
+    check("status oltre BRIGHTDATA_STATUS_TIMEOUT in errore", status.get("status") == "error", status.get("error", ""))
+    check("la chiamata non attende la risposta lenta", elapsed < 0.9, f"{elapsed:.2f}s")
+    StubState.delay = 0.0
+
+    service.close()
+    server.shutdown()
+
+    print("\n" + "=" * 60)
+    if failures:
+        print(f"❌ {len(failures)} verifiche fallite: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ TUTTE LE VERIFICHE SUPERATE")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
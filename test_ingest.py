@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Verifica della lettura CSV in streaming di ingest.iter_csv_records
+
+Il body text/csv arriva a blocchi di dimensione arbitraria: le righe lette
+devono coincidere con quelle di csv.reader sul testo intero, anche con
+campi quotati che contengono a capo, virgolette raddoppiate, CRLF, BOM,
+righe vuote e caratteri multibyte spezzati tra due blocchi:
+1. Blocchi di 1, 2, 3, 7, 64 byte e body intero contro csv.reader
+2. POST /data-crawled/batch con un a capo quotato (database SQLite temporaneo)
+
+Uso: python test_ingest.py
+"""
+
+import asyncio
+import csv
+import io
+import os
+import sys
+import tempfile
+
+# database temporaneo (prima di importare i moduli che leggono DATABASE_URL)
+fd, DB_PATH = tempfile.mkstemp(prefix="lookatme_test_", suffix=".db")
+os.close(fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from starlette.requests import Request
+
+from ingest import _csv_row, iter_csv_records
+
+CHUNK_SIZES = (1, 2, 3, 7, 64, None)
+
+CASES = {
+    "a capo quotato": 'id_esercente,note,n_fan_facebook\n1,"prima riga\nseconda riga",10\n2,semplice,20\n',
+    "CRLF e a capo quotato": 'id_esercente,note\r\n1,"uno\r\ndue"\r\n2,tre\r\n',
+    "virgolette raddoppiate": 'id_esercente,note\n1,"detto ""ciao""\ne poi ""a capo"""\n2,"x"\n',
+    "BOM, righe vuote e accenti": '﻿id_esercente,note\n\n1,"perché\n\nè così"\n   \n2,città\n',
+    "ultima riga senza a capo": 'id_esercente,note\n1,"a\nb"\n2,fine',
+    "virgolette non chiuse": 'id_esercente,note\n1,ok\n2,"aperta\nfino alla fine\n',
+}
+
+failures = []
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"{'✅' if ok else '❌'} {label}" + (f" ({detail})" if detail else ""))
+    if not ok:
+        failures.append(label)
+
+
+def streaming_request(body: bytes, chunk_size: int = None) -> Request:
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] if chunk_size else [body]
+    messages = [{"type": "http.request", "body": c, "more_body": i < len(chunks) - 1} for i, c in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0)
+
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": [(b"content-type", b"text/csv")]}
+    return Request(scope, receive)
+
+
+def expected_rows(text: str) -> list:
+    reader = csv.reader(io.StringIO(text.lstrip("﻿"), newline=""))
+    rows = [values for values in reader if any(v.strip() for v in values)]
+    header = [h.strip() for h in rows[0]]
+    return [_csv_row(header, values) for values in rows[1:]]
+
+
+async def read_rows(body: bytes, chunk_size: int = None) -> list:
+    return [row async for row in iter_csv_records(streaming_request(body, chunk_size))]
+
+
+def test_chunks():
+    print("\n1. Body a blocchi contro csv.reader sul testo intero")
+    for label, text in CASES.items():
+        expected = expected_rows(text)
+        mismatches = [size for size in CHUNK_SIZES
+                      if asyncio.run(read_rows(text.encode("utf-8"), size)) != expected]
+        check(f"{label}: {len(expected)} righe", not mismatches,
+              f"diverse con blocchi {mismatches}" if mismatches else "")
+
+
+def test_batch_endpoint():
+    print("\n2. POST /data-crawled/batch con un a capo quotato")
+    from fastapi.testclient import TestClient
+
+    import auth
+    import main
+    import models
+
+    headers = {"Authorization": f"Bearer {auth.create_access_token('admin@example.com')}",
+               "Content-Type": "text/csv"}
+    with TestClient(main.app) as client:
+        id_esercente = client.post("/esercenti", json={"nome": "Esercente CSV"},
+                                   headers={"Authorization": headers["Authorization"]}).json()["id_esercente"]
+        body = (f'id_esercente,note,n_fan_facebook\n'
+                f'{id_esercente},"nota su\ndue righe",100\n'
+                f'{id_esercente},"senza a capo",110\n')
+        result = client.post("/data-crawled/batch", content=body.encode("utf-8"), headers=headers).json()
+        check("2 righe inserite, nessun errore", result.get("inserted") == 2 and not result.get("errors"), f"{result}")
+        db = main.SessionLocal()
+        try:
+            fans = sorted(r.n_fan_facebook for r in db.query(models.DatoCrawled)
+                          .filter(models.DatoCrawled.id_esercente == id_esercente))
+        finally:
+            db.close()
+        check("valori salvati", fans == [100, 110], f"{fans}")
+
+
+def main():
+    print("=" * 60)
+    print("🧪 TEST LETTURA CSV IN STREAMING")
+    print("=" * 60)
+    try:
+        test_chunks()
+        test_batch_endpoint()
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(DB_PATH + suffix):
+                os.remove(DB_PATH + suffix)
+
+    print("\n" + "=" * 60)
+    if failures:
+        print(f"❌ {len(failures)} verifiche fallite: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ Tutte le verifiche superate")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Verifica di rate limit, retry e circuit breaker (outbound.py) contro uno stub con guasti
+
+Lo stub risponde a TripAdvisor (/location/{id}/details) e Bright Data
+(/trigger) seguendo una sequenza programmata di status code e header.
+Non servono credenziali né il server FastAPI:
+1. Retry su 503 fino al successo
+2. Retry su 429 rispettando Retry-After
+3. Trigger Bright Data (non idempotente): nessun retry su 500, retry su 429
+4. Circuit breaker: apertura, fail fast, prova half-open e chiusura
+5. Token bucket: richieste distribuite al rate configurato
+6. Contatori e stato esposti da outbound.stats()
+
+Uso: python test_outbound_stub.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Configurazione (prima di importare i servizi)
+for provider in ("TRIPADVISOR", "BRIGHTDATA"):
+    os.environ[f"{provider}_MAX_RETRIES"] = "3"
+    os.environ[f"{provider}_BACKOFF_BASE"] = "0.05"
+    os.environ[f"{provider}_BACKOFF_MAX"] = "2"
+    os.environ[f"{provider}_BREAKER_THRESHOLD"] = "3"
+    os.environ[f"{provider}_BREAKER_RESET"] = "1"
+    os.environ[f"{provider}_RATE_LIMIT"] = "1000"
+os.environ["TRIPADVISOR_API_KEY"] = "stub-key"
+os.environ["TRIPADVISOR_CACHE_PERSIST"] = "0"
+os.environ["BRIGHTDATA_API_TOKEN"] = "stub-token"
+
+
+class FaultScript:
+    """Per endpoint: lista di (status, header) consumata a ogni richiesta, poi status di default"""
+    lock = threading.Lock()
+    steps = defaultdict(list)
+    default = {}
+    hits = defaultdict(int)
+
+    @classmethod
+    def program(cls, endpoint: str, steps: list = (), default: int = 200):
+        with cls.lock:
+            cls.steps[endpoint] = list(steps)
+            cls.default[endpoint] = default
+            cls.hits[endpoint] = 0
+
+    @classmethod
+    def next(cls, endpoint: str):
+        with cls.lock:
+            cls.hits[endpoint] += 1
+            if cls.steps[endpoint]:
+                return cls.steps[endpoint].pop(0)
+            return cls.default.get(endpoint, 200), {}
+
+
+class FaultStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        path = urlsplit(self.path).path
+        endpoint = "trigger" if path.endswith("/trigger") else path.rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        status, headers = FaultScript.next(endpoint)
+        if status != 200:
+            body = {"error": status}
+        elif endpoint == "trigger":
+            body = {"snapshot_id": "s_stub"}
+        else:
+            body = {"name": "Locale", "rating": "4.0", "num_reviews": "10"}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+
+def start_stub() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FaultStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+failures = []
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"{'✅' if ok else '❌'} {label}" + (f" ({detail})" if detail else ""))
+    if not ok:
+        failures.append(label)
+
+
+def timed(call):
+    started = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - started
+
+
+def main():
+    server = start_stub()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["TRIPADVISOR_BASE_URL"] = f"{base_url}/api/v1"
+    os.environ["BRIGHTDATA_BASE_URL"] = base_url
+    import httpx
+    import outbound
+    from brightdata_service import BrightDataService
+    from tripadvisor_service import TripAdvisorService
+    tripadvisor = TripAdvisorService()
+    brightdata = BrightDataService()
+    details = lambda: tripadvisor.get_location_details("123")
+    trigger = lambda: brightdata.trigger_crawl("facebook", ["https://www.facebook.com/locale"])
+
+    print("=" * 60)
+    print("🧪 CHIAMATE IN USCITA CONTRO LO STUB CON GUASTI")
+    print("=" * 60)
+
+    print("\n🔁 Retry su 503")
+    FaultScript.program("details", [(503, {}), (503, {})])
+    result = details()
+    check("successo al terzo tentativo", result["success"] and FaultScript.hits["details"] == 3,
+          f"{FaultScript.hits['details']} richieste")
+
+    print("\n🐢 Retry su 429 con Retry-After")
+    FaultScript.program("details", [(429, {"Retry-After": "0.6"})])
+    result, elapsed = timed(details)
+    check("successo dopo il 429", result["success"] and FaultScript.hits["details"] == 2)
+    check("attesa almeno Retry-After (0.6s)", elapsed >= 0.6, f"{elapsed:.2f}s")
+
+    print("\n🚀 Trigger Bright Data (non idempotente)")
+    FaultScript.program("trigger", [(500, {})])
+    result = trigger()
+    check("500 non ritentato: il job potrebbe essere già partito",
+          not result["success"] and FaultScript.hits["trigger"] == 1, f"{FaultScript.hits['trigger']} richieste")
+    FaultScript.program("trigger", [(429, {"Retry-After": "0.1"})])
+    result = trigger()
+    check("429 ritentato", result["success"] and FaultScript.hits["trigger"] == 2,
+          f"{FaultScript.hits['trigger']} richieste")
+
+    print("\n🔌 Circuit breaker")
+    gate = outbound.get_gate("tripadvisor")
+    FaultScript.program("details", default=503)
+    for _ in range(3):
+        details()
+    hits = FaultScript.hits["details"]
+    check("circuito aperto dopo 3 chiamate fallite", gate.breaker.state == outbound.OPEN,
+          f"{hits} richieste, stato {gate.breaker.state}")
+    result, elapsed = timed(details)
+    check("fail fast a circuito aperto", result.get("error") == "Circuit Open" and FaultScript.hits["details"] == hits
+          and elapsed < 0.05, f"{elapsed * 1000:.1f}ms")
+    time.sleep(1.1)
+    FaultScript.program("details", default=200)
+    result = details()
+    check("prova half-open riuscita: circuito chiuso", result["success"] and gate.breaker.state == outbound.CLOSED,
+          gate.breaker.state)
+
+    print("\n🪣 Token bucket")
+    limited = outbound.OutboundGate("prova", rate=5, burst=1)
+
+    async def burst():
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            await asyncio.gather(*(limited.request(lambda: client.get("/api/v1/location/1/details"))
+                                   for _ in range(6)))
+
+    FaultScript.program("details")
+    _, elapsed = timed(lambda: asyncio.run(burst()))
+    check("6 richieste a 5/s con burst 1 in almeno 1s", elapsed >= 0.95, f"{elapsed:.2f}s")
+
+    print("\n📊 Statistiche")
+    stats = outbound.stats()
+    ta = stats.get("tripadvisor", {})
+    check("gate di entrambi i provider", {"tripadvisor", "brightdata"} <= set(stats))
+    check("contatori TripAdvisor", ta.get("rejected") == 1 and ta.get("status_429") == 1 and ta.get("retries", 0) >= 3,
+          f"retries {ta.get('retries')}, 429 {ta.get('status_429')}, 5xx {ta.get('status_5xx')}, rejected {ta.get('rejected')}")
+    check("circuito aperto una volta", ta.get("circuit", {}).get("times_opened") == 1)
+    print(f"   ⏱️  attesa per rate limit 'prova': {limited.stats()['throttled_seconds']}s")
+
+    tripadvisor.close()
+    brightdata.close()
+    server.shutdown()
+
+    print("\n" + "=" * 60)
+    if failures:
+        print(f"❌ {len(failures)} verifiche fallite: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ TUTTE LE VERIFICHE SUPERATE")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
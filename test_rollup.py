@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Verifica dei rollup incrementali contro la ricostruzione da dati_crawled
+
+I rollup aggiornati al commit (apply_samples, recompute_buckets) devono
+coincidere con quelli di rebuild_rollups su un database SQLite temporaneo:
+1. Campione fuori ordine con la metrica NULL nel campione più recente
+2. Commit casuali fuori ordine con metriche NULL, modifiche ed eliminazioni
+3. Rollup precedenti a {metrica}_last_at (colonna vuota)
+
+Uso: python test_rollup.py [--commits 200] [--seed 13]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, time, timedelta
+from decimal import Decimal
+
+# database temporaneo (prima di importare i moduli che leggono DATABASE_URL)
+fd, DB_PATH = tempfile.mkstemp(prefix="lookatme_test_", suffix=".db")
+os.close(fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import rollup
+from database import SessionLocal, engine
+from models import Base, DatoCrawled, Esercente, MetricheRollup
+
+COLUMNS = ["campioni", "ultimo_at"] + [f"{m}_{suffix}" for m in rollup.METRICS
+                                      for suffix in ("min", "max", "last", "last_at")]
+
+failures = []
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"{'✅' if ok else '❌'} {label}" + (f" ({detail})" if detail else ""))
+    if not ok:
+        failures.append(label)
+
+
+def snapshot_rollups(db) -> dict:
+    db.expire_all()
+    return {(r.id_esercente, r.granularita, r.periodo): tuple(getattr(r, c) for c in COLUMNS)
+            for r in db.query(MetricheRollup).all()}
+
+
+def differences(incremental: dict, rebuilt: dict) -> list:
+    diffs = []
+    for key in sorted(set(incremental) | set(rebuilt), key=str):
+        a, b = incremental.get(key), rebuilt.get(key)
+        if a is None or b is None:
+            diffs.append((key, a, b))
+            continue
+        diffs.extend((key, c, x, y) for c, x, y in zip(COLUMNS, a, b) if x != y)
+    return diffs
+
+
+def compare_with_rebuild(db, label: str):
+    incremental = snapshot_rollups(db)
+    rollup.rebuild_rollups(db)
+    rebuilt = snapshot_rollups(db)
+    diffs = differences(incremental, rebuilt)
+    check(label, not diffs, f"{len(rebuilt)} periodi" if not diffs else f"{len(diffs)} differenze, es. {diffs[:2]}")
+
+
+def crawled(id_esercente: int, d: date, at: time, **metrics) -> DatoCrawled:
+    return DatoCrawled(id_esercente=id_esercente, data=d, ora=at, **metrics)
+
+
+def test_null_in_latest_sample(db, id_esercente: int):
+    print("\n1. Campione fuori ordine, metrica NULL nel campione più recente")
+    d = date(2024, 3, 13)
+    db.add_all([crawled(id_esercente, d, time(10), stelle_google=Decimal("4.0"), n_fan_facebook=100),
+                crawled(id_esercente, d, time(12), stelle_google=None, n_fan_facebook=120)])
+    db.commit()
+    db.add(crawled(id_esercente, d, time(11), stelle_google=Decimal("4.5"), n_fan_facebook=110))
+    db.commit()
+    db.expire_all()
+    for g in rollup.GRANULARITIES:
+        r = rollup.get_range(db, id_esercente, g, d, d)[0]
+        check(f"{g}: stelle_google_last incrementale", r.stelle_google_last == Decimal("4.5"),
+              f"{r.stelle_google_last}")
+        check(f"{g}: n_fan_facebook_last dal campione delle 12:00", r.n_fan_facebook_last == 120,
+              f"{r.n_fan_facebook_last}")
+    compare_with_rebuild(db, "incrementale = rebuild_rollups")
+
+    # recompute_buckets (modifica di una riga) deve dare lo stesso risultato
+    row = db.query(DatoCrawled).filter(DatoCrawled.id_esercente == id_esercente,
+                                       DatoCrawled.ora == time(12)).one()
+    row.n_fan_facebook = 121
+    db.commit()
+    r = rollup.get_range(db, id_esercente, "day", d, d)[0]
+    check("recompute_buckets: stelle_google_last", r.stelle_google_last == Decimal("4.5"), f"{r.stelle_google_last}")
+    compare_with_rebuild(db, "recompute_buckets = rebuild_rollups")
+
+
+def random_metrics(rng: random.Random) -> dict:
+    maybe = lambda value: None if rng.random() < 0.4 else value
+    return {
+        "n_fan_facebook": maybe(rng.randint(100, 5000)),
+        "n_followers_ig": maybe(rng.randint(100, 8000)),
+        "stelle_google": maybe(Decimal(rng.randint(10, 50)) / 10),
+        "tripadvisor_rating": maybe(Decimal(rng.randint(10, 50)) / 10),
+        "tripadvisor_reviews": maybe(rng.randint(0, 500)),
+    }
+
+
+def test_random_commits(db, ids: list, commits: int, seed: int):
+    print(f"\n2. {commits} commit casuali fuori ordine")
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    for _ in range(commits):
+        for _ in range(rng.randint(1, 8)):
+            d = start + timedelta(days=rng.randint(0, 75))
+            db.add(crawled(rng.choice(ids), d, time(rng.randint(0, 23), rng.choice((0, 30))), **random_metrics(rng)))
+        if rng.random() < 0.15:
+            row = db.query(DatoCrawled).filter(DatoCrawled.id_esercente.in_(ids)).order_by(DatoCrawled.id).offset(
+                rng.randint(0, 20)).first()
+            if row is not None:
+                if rng.random() < 0.5:
+                    db.delete(row)
+                else:
+                    row.stelle_google = random_metrics(rng)["stelle_google"]
+        db.commit()
+    compare_with_rebuild(db, "incrementale = rebuild_rollups")
+
+
+def test_legacy_rollups(db, id_esercente: int):
+    print("\n3. Rollup senza {metrica}_last_at (database precedenti)")
+    d = date(2024, 5, 6)
+    db.add(crawled(id_esercente, d, time(9), stelle_google=Decimal("3.0"), n_fan_facebook=50))
+    db.commit()
+    last_at_columns = {f"{m}_last_at": None for m in rollup.METRICS}
+    db.query(MetricheRollup).filter(MetricheRollup.id_esercente == id_esercente).update(last_at_columns)
+    db.commit()
+    db.add_all([crawled(id_esercente, d, time(8), stelle_google=Decimal("2.0")),
+                crawled(id_esercente, d, time(10), n_fan_facebook=60)])
+    db.commit()
+    db.expire_all()
+    r = rollup.get_range(db, id_esercente, "day", d, d)[0]
+    check("campione precedente non sovrascrive stelle_google_last", r.stelle_google_last == Decimal("3.0"),
+          f"{r.stelle_google_last}")
+    check("campione successivo aggiorna n_fan_facebook_last", r.n_fan_facebook_last == 60, f"{r.n_fan_facebook_last}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🧪 TEST ROLLUP INCREMENTALI")
+    print("=" * 60)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        esercenti = [Esercente(nome=f"Esercente {i}") for i in range(5)]
+        db.add_all(esercenti)
+        db.commit()
+        ids = [e.id_esercente for e in esercenti]
+        test_null_in_latest_sample(db, ids[0])
+        test_random_commits(db, ids[1:4], args.commits, args.seed)
+        test_legacy_rollups(db, ids[4])
+    finally:
+        db.close()
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(DB_PATH + suffix):
+                os.remove(DB_PATH + suffix)
+
+    print("\n" + "=" * 60)
+    if failures:
+        print(f"❌ {len(failures)} verifiche fallite: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ Tutte le verifiche superate")
+
+
+if __name__ == "__main__":
+    main()
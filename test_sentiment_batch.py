@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Verifica di compute_sentiment_batch contro compute_sentiment
+
+Genera righe casuali di emozioni (con NULL, Decimal come le colonne
+Numeric(3,2) e float arbitrari) e controlla che la versione vettoriale
+dia esattamente lo stesso punteggio della versione scalare, riga per riga:
+1. Righe casuali
+2. Griglia dei casi a metà (arrotondamento)
+3. stored_sentiments con sentiment già salvato o NULL
+4. Tempo delle due versioni
+
+Uso: python test_sentiment_batch.py [--rows 300000] [--seed 42]
+"""
+
+import argparse
+import random
+import sys
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from services import compute_sentiment, compute_sentiment_batch, stored_sentiments
+
+COLUMNS = ("gioia", "tristezza", "paura", "rabbia", "disgusto")
+
+
+def random_value(rng: random.Random):
+    kind = rng.random()
+    if kind < 0.2:
+        return None
+    if kind < 0.6:
+        # valore come arriva da una colonna Numeric(3,2)
+        return Decimal(rng.randint(0, 100)) / 100
+    return rng.random()
+
+
+def random_rows(rng: random.Random, n: int) -> list:
+    return [SimpleNamespace(**{c: random_value(rng) for c in COLUMNS}) for _ in range(n)]
+
+
+def half_step_rows() -> list:
+    # gioia - negativi che cade a metà tra due centesimi
+    rows = []
+    for g in range(0, 101):
+        for n in range(0, 101, 5):
+            rows.append(SimpleNamespace(gioia=g / 100 + 0.005, tristezza=n / 100, paura=None,
+                                        rabbia=None, disgusto=None))
+            rows.append(SimpleNamespace(gioia=Decimal(g) / 100, tristezza=Decimal(n) / 100,
+                                        paura=Decimal("0.01"), rabbia=None, disgusto=Decimal("0.02")))
+    return rows
+
+
+def mismatches(rows: list) -> list:
+    batch = compute_sentiment_batch(*([getattr(r, c) for r in rows] for c in COLUMNS)).tolist()
+    return [(r, compute_sentiment(r), b) for r, b in zip(rows, batch) if compute_sentiment(r) != b]
+
+
+def report(label: str, rows: list) -> bool:
+    wrong = mismatches(rows)
+    print(f"{'✅' if not wrong else '❌'} {label}: {len(rows)} righe, {len(wrong)} differenze")
+    for r, scalar, batch in wrong[:5]:
+        print(f"   {vars(r)} -> scalare {scalar}, batch {batch}")
+    return not wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    print("=" * 60)
+    print("🧪 SENTIMENT BATCH CONTRO SCALARE")
+    print("=" * 60)
+
+    rows = random_rows(rng, args.rows)
+    ok = report("righe casuali", rows)
+    ok &= report("casi a metà", half_step_rows())
+
+    stored = random_rows(rng, 1000)
+    for r in stored:
+        r.sentiment = round(rng.random(), 2) if rng.random() < 0.5 else None
+    expected = [r.sentiment if r.sentiment is not None else compute_sentiment(r) for r in stored]
+    same = stored_sentiments(stored) == expected
+    print(f"{'✅' if same else '❌'} stored_sentiments con sentiment salvati e NULL")
+    ok &= same
+
+    print("\n⏱️  Tempo")
+    started = time.perf_counter()
+    for r in rows:
+        compute_sentiment(r)
+    scalar = time.perf_counter() - started
+    columns = [[getattr(r, c) for r in rows] for c in COLUMNS]
+    started = time.perf_counter()
+    compute_sentiment_batch(*columns)
+    batch = time.perf_counter() - started
+    print(f"   scalare: {scalar:.3f}s, batch: {batch:.3f}s ({scalar / batch:.1f}x)")
+
+    print("\n" + "=" * 60)
+    if not ok:
+        print("❌ VERIFICHE FALLITE")
+        sys.exit(1)
+    print("✅ TUTTE LE VERIFICHE SUPERATE")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
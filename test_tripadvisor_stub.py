@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Verifica delle chiamate concorrenti a TripAdvisor contro un server stub locale
+
+Lo stub emula /location/{id}/reviews e /location/{id}/details con una
+latenza configurabile per endpoint. Non serve una API key né il server
+FastAPI:
+1. Recensioni e dettagli in parallelo: tempo ≈ la chiamata più lenta
+2. Timeout di una chiamata: risultato parziale con l'altra parte
+3. Errore HTTP di una chiamata: risultato parziale
+4. Deadline complessiva rispettata anche con timeout per chiamata più lunghi
+5. Più location in parallelo sul pool condiviso
+
+Uso: python test_tripadvisor_stub.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Configurazione (prima di importare il servizio)
+os.environ["TRIPADVISOR_API_KEY"] = "stub-key"
+os.environ["TRIPADVISOR_TIMEOUT"] = "1"
+os.environ["TRIPADVISOR_DEADLINE"] = "1.5"
+os.environ["TRIPADVISOR_CACHE_PERSIST"] = "0"
+os.environ["TRIPADVISOR_MAX_RETRIES"] = "0"
+os.environ["TRIPADVISOR_RATE_LIMIT"] = "1000"
+os.environ["TRIPADVISOR_BREAKER_THRESHOLD"] = "1000"
+
+
+class StubState:
+    delays = {"reviews": 0.0, "details": 0.0}
+    status = {"reviews": 200, "details": 200}
+
+
+class TripAdvisorStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.split("/")
+        location_id, kind = parts[-2], parts[-1]
+        time.sleep(StubState.delays.get(kind, 0))
+        status = StubState.status.get(kind, 200)
+        if status != 200:
+            body = {"error": "stub"}
+        elif kind == "reviews":
+            body = {"data": [{"id": i, "text": f"recensione {i}"} for i in range(7)]}
+        else:
+            body = {"name": f"Locale {location_id}", "rating": "4.5", "num_reviews": "321"}
+        data = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # il client ha già rinunciato (timeout)
+            pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # backlog ampio: con il default (5) le connessioni in più aspettano la ritrasmissione del SYN
+    request_queue_size = 128
+
+
+def start_stub() -> ThreadingHTTPServer:
+    server = StubServer(("127.0.0.1", 0), TripAdvisorStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+failures = []
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"{'✅' if ok else '❌'} {label}" + (f" ({detail})" if detail else ""))
+    if not ok:
+        failures.append(label)
+
+
+def fetch(service, location_id: str):
+    started = time.perf_counter()
+    data = service.get_combined_data(location_id, bypass_cache=True)
+    return data, time.perf_counter() - started
+
+
+def set_stub(reviews_delay: float, details_delay: float, reviews_status: int = 200, details_status: int = 200):
+    StubState.delays = {"reviews": reviews_delay, "details": details_delay}
+    StubState.status = {"reviews": reviews_status, "details": details_status}
+
+
+def main():
+    server = start_stub()
+    os.environ["TRIPADVISOR_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/api/v1"
+    from tripadvisor_service import TripAdvisorService
+    service = TripAdvisorService()
+
+    print("=" * 60)
+    print("🧪 TRIPADVISOR CONTRO LO STUB LOCALE")
+    print("=" * 60)
+
+    # riscaldamento: pool e loop del client
+    fetch(service, "99")
+
+    print("\n⚡ Chiamate in parallelo")
+    set_stub(0.3, 0.5)
+    data, elapsed = fetch(service, "100")
+    check("dati completi", data["success"] and not data["partial"] and data["name"] == "Locale 100"
+          and data["reviews_count"] == 7)
+    check("tempo ≈ la chiamata più lenta (0.5s), non la somma (0.8s)", elapsed < 0.7, f"{elapsed:.2f}s")
+
+    print("\n⏳ Timeout di una chiamata")
+    set_stub(0.1, 3.0)
+    data, elapsed = fetch(service, "101")
+    check("risultato parziale con le recensioni", data["success"] and data["partial"] and data["reviews_count"] == 7)
+    check("dettagli in timeout", data["raw_details"].get("error") == "Timeout", data["raw_details"].get("error"))
+    check("attesa limitata da TRIPADVISOR_TIMEOUT (1s)", elapsed < 1.3, f"{elapsed:.2f}s")
+
+    print("\n💥 Errore HTTP di una chiamata")
+    set_stub(0.1, 0.1, reviews_status=500)
+    data, _ = fetch(service, "102")
+    check("risultato parziale con i dettagli", data["success"] and data["partial"] and data["name"] == "Locale 102")
+    check("errore delle recensioni riportato", data["raw_reviews"].get("error") == "API Error: 500",
+          data["raw_reviews"].get("error"))
+
+    print("\n🛑 Deadline complessiva")
+    service.timeout, service.deadline = 5.0, 0.8
+    set_stub(2.0, 2.0)
+    data, elapsed = fetch(service, "103")
+    check("nessun dato entro la deadline", not data["success"] and data["error"] == "Timeout", data.get("error"))
+    check("risposta entro la deadline (0.8s)", elapsed < 1.1, f"{elapsed:.2f}s")
+    service.timeout, service.deadline = 1.0, 1.5
+
+    print("\n🔗 Più location in parallelo")
+    set_stub(0.3, 0.3)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(lambda i: service.get_combined_data(str(200 + i), bypass_cache=True), range(5)))
+    elapsed = time.perf_counter() - started
+    check("5 location complete", all(r["success"] and not r["partial"] for r in results))
+    check("10 chiamate sul pool da 10 connessioni in ≈ 0.3s", elapsed < 0.8, f"{elapsed:.2f}s")
+
+    service.close()
+    server.shutdown()
+
+    print("\n" + "=" * 60)
+    if failures:
+        print(f"❌ {len(failures)} verifiche fallite: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ TUTTE LE VERIFICHE SUPERATE")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Miniature degli asset degli esercenti (logo e immagini delle certificazioni)
+
+Quando un asset cambia (assets.py) le varianti 64/128/512 px in WebP e PNG
+vengono generate da un worker in background, dopo il commit: create e
+update dell'esercente non aspettano Pillow. /assets/...?size=N serve la
+variante più piccola che copre N nel formato scelto dall'header Accept;
+finché le varianti non sono pronte risponde con l'originale, che resta la
+risposta definitiva per le immagini che Pillow non sa aprire (es. SVG).
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain
+from typing import List, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cache import LRUCache
+from database import SessionLocal
+from models import EsercenteAsset, EsercenteAssetVariante
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = (64, 128, 512)
+VARIANT_FORMATS = {"webp": "image/webp", "png": "image/png"}
+
+# formati che Pillow sa ridimensionare: per gli altri (es. SVG) si serve sempre l'originale
+RENDERABLE_TYPES = frozenset({"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp"})
+
+# chiave in Session.info con gli asset (id_esercente, campo) da rigenerare dopo il commit
+PENDING_KEY = "thumbnails_asset"
+
+# sha256 dei contenuti che Pillow non è riuscito ad aprire: non vengono ritentati a ogni richiesta
+unrenderable = LRUCache(max_bytes=1024 * 1024, ttl=float(os.getenv("THUMBNAIL_FAILURE_TTL", str(24 * 3600))),
+                        max_entries=10000)
+
+
+def render_variants(data: bytes) -> List[Tuple[int, str, bytes]]:
+    """
+    (larghezza, formato, byte) per ogni variante. Mantiene le proporzioni e non ingrandisce.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        # Pillow oltre MAX_IMAGE_PIXELS emette solo un warning: qui è già un'immagine da non decodificare
+        if Image.MAX_IMAGE_PIXELS and source.width * source.height > Image.MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(
+                f"{source.width}x{source.height} px oltre il limite di {Image.MAX_IMAGE_PIXELS} px")
+        source.seek(0)
+        image = source.convert("RGBA")
+    variants = []
+    for size in VARIANT_SIZES:
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for fmt in VARIANT_FORMATS:
+            out = io.BytesIO()
+            if fmt == "webp":
+                resized.save(out, "WEBP", quality=85, method=4)
+            else:
+                resized.save(out, "PNG", optimize=True)
+            variants.append((size, fmt, out.getvalue()))
+    return variants
+
+
+def size_bucket(size: int) -> int:
+    """Dimensione della variante che serve per un lato richiesto di size px"""
+    return next((s for s in VARIANT_SIZES if s >= size), VARIANT_SIZES[-1])
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """WebP se il client lo accetta, altrimenti PNG"""
+    for part in (accept or "").split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        if media.lower() == "image/webp" and not any(p.replace(" ", "") in ("q=0", "q=0.0") for p in params):
+            return "webp"
+    return "png"
+
+
+def can_render(asset: EsercenteAsset) -> bool:
+    """Le miniature dell'asset possono essere generate (formato supportato, nessun errore precedente)"""
+    return asset.content_type in RENDERABLE_TYPES and unrenderable.get(asset.hash) is None
+
+
+def pick_variant(db: Session, asset: EsercenteAsset, size: int, fmt: str) -> Optional[EsercenteAssetVariante]:
+    """
+    Variante più piccola con lato >= size (o la più grande), generata dall'asset corrente
+    """
+    variants = (db.query(EsercenteAssetVariante)
+                  .filter(EsercenteAssetVariante.id_esercente == asset.id_esercente,
+                          EsercenteAssetVariante.campo == asset.campo,
+                          EsercenteAssetVariante.formato == fmt,
+                          EsercenteAssetVariante.hash_originale == asset.hash)
+                  .order_by(EsercenteAssetVariante.larghezza)
+                  .all())
+    if not variants:
+        return None
+    return next((v for v in variants if v.larghezza >= size), variants[-1])
+
+
+class ThumbnailWorker:
+    """Genera le varianti in un pool di thread dedicato, una richiesta in coda per asset"""
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or int(os.getenv("THUMBNAIL_WORKERS", "1"))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, id_esercente: int, campo: str):
+        key = (id_esercente, campo)
+        with self._lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="thumbnails")
+            self._executor.submit(self._run, key)
+
+    def _run(self, key: Tuple[int, str]):
+        with self._lock:
+            # dopo questo punto una nuova modifica dell'asset rimette in coda il lavoro
+            self._queued.discard(key)
+        db = SessionLocal()
+        try:
+            generate_variants(db, *key)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Errore nella generazione delle miniature {key}: {e}")
+        finally:
+            db.close()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def generate_variants(db: Session, id_esercente: int, campo: str):
+    """
+    Allinea le varianti all'asset corrente: rigenera quelle di immagini precedenti, elimina le orfane
+    """
+    asset = db.get(EsercenteAsset, (id_esercente, campo))
+    existing = {
+        (v.larghezza, v.formato): v
+        for v in db.query(EsercenteAssetVariante).filter(EsercenteAssetVariante.id_esercente == id_esercente,
+                                                         EsercenteAssetVariante.campo == campo)
+    }
+    if asset is not None and len(existing) == len(VARIANT_SIZES) * len(VARIANT_FORMATS) and \
+            all(v.hash_originale == asset.hash for v in existing.values()):
+        return
+
+    rendered = []
+    if asset is not None and can_render(asset):
+        try:
+            rendered = render_variants(asset.dati)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            # immagine corrotta, troppo grande da decodificare o variante del formato non supportata:
+            # si serve sempre l'originale
+            unrenderable.set(asset.hash, True, size=len(asset.hash))
+            logger.info(f"Miniature non generate per {id_esercente}/{campo}: {e}")
+    for size, fmt, data in rendered:
+        variant = existing.pop((size, fmt), None)
+        if variant is None:
+            variant = EsercenteAssetVariante(id_esercente=id_esercente, campo=campo, larghezza=size, formato=fmt)
+            db.add(variant)
+        variant.hash_originale = asset.hash
+        variant.content_type = VARIANT_FORMATS[fmt]
+        variant.dimensione = len(data)
+        variant.dati = data
+        variant.created_at = datetime.utcnow()
+    for variant in existing.values():
+        db.delete(variant)
+    db.commit()
+
+
+thumbnail_worker = ThumbnailWorker()
+
+
+# ---------- Manutenzione automatica ----------
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_assets(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, EsercenteAsset):
+            session.info.setdefault(PENDING_KEY, set()).add((obj.id_esercente, obj.campo))
+
+
+@event.listens_for(Session, "after_commit")
+def _schedule_thumbnails(session):
+    for id_esercente, campo in session.info.pop(PENDING_KEY, ()):
+        thumbnail_worker.schedule(id_esercente, campo)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_assets(session):
+    session.info.pop(PENDING_KEY, None)
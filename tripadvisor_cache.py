@@ -0,0 +1,141 @@
+"""
+Cache delle risposte TripAdvisor (recensioni e dettagli di una location)
+
+I dati di una location cambiano al massimo una volta al giorno: ogni
+chiamata all'API consuma quota e aggiunge centinaia di ms. Le risposte
+vengono tenute in un LRU in memoria per (location_id, lingua, valuta) e,
+se TRIPADVISOR_CACHE_PERSIST è attivo, nella tabella tripadvisor_cache,
+così sopravvivono ai riavvii.
+
+Una entry è fresca per TRIPADVISOR_CACHE_TTL secondi; per altri
+TRIPADVISOR_CACHE_STALE secondi viene ancora servita mentre un refresh in
+background la aggiorna (stale-while-revalidate). I refresh sono
+condizionali quando l'API ha restituito ETag/Last-Modified; se una delle
+due chiamate fallisce si riusa la parte in cache, ma la entry non è
+considerata fresca.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from cache import LRUCache
+from database import SessionLocal
+from models import TripAdvisorCache as TripAdvisorCacheRow
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]  # (location_id, lingua, valuta)
+
+COUNTERS = ("fresh_hits", "stale_hits", "db_hits", "misses", "bypasses", "revalidations",
+            "not_modified", "upstream_calls", "upstream_errors")
+
+
+def _epoch(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TripAdvisorCache:
+    """
+    Entry: {"reviews": risposta, "details": risposta, "fetched_at": epoch}.
+    Le risposte hanno la forma di get_location_reviews/get_location_details.
+    """
+
+    def __init__(self, fresh_ttl: float = None, stale_ttl: float = None, max_bytes: int = None,
+                 persist: bool = None):
+        self.fresh_ttl = fresh_ttl or float(os.getenv("TRIPADVISOR_CACHE_TTL", str(6 * 3600)))
+        self.stale_ttl = stale_ttl or float(os.getenv("TRIPADVISOR_CACHE_STALE", str(24 * 3600)))
+        self.persist = persist if persist is not None else os.getenv("TRIPADVISOR_CACHE_PERSIST", "1") == "1"
+        self.memory = LRUCache(
+            max_bytes=max_bytes or int(os.getenv("TRIPADVISOR_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+            ttl=self.fresh_ttl + self.stale_ttl,
+        )
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(COUNTERS, 0)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    @staticmethod
+    def is_complete(entry: Dict[str, Any]) -> bool:
+        # entrambe le parti riuscite e aggiornate dall'ultima chiamata (non riprese dalla cache per un errore)
+        return all(entry[kind]["success"] and not entry[kind].get("stale") for kind in ("reviews", "details"))
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return self.is_complete(entry) and time.time() - entry["fetched_at"] < self.fresh_ttl
+
+    def is_usable(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["fetched_at"] < self.fresh_ttl + self.stale_ttl
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """
+        Entry in memoria o, se assente, dalla tabella (None se manca o è troppo vecchia)
+        """
+        entry = self.memory.get(key)
+        if entry is None and self.persist:
+            entry = self._load(key)
+            if entry is not None:
+                self.count("db_hits")
+                self._remember(key, entry)
+        if entry is None or not self.is_usable(entry):
+            return None
+        return entry
+
+    def put(self, key: CacheKey, entry: Dict[str, Any]):
+        self._remember(key, entry)
+        if self.persist:
+            self._store(key, entry)
+
+    def _remember(self, key: CacheKey, entry: Dict[str, Any]):
+        # scade dalla memoria quando non è più servibile nemmeno come stale
+        ttl = entry["fetched_at"] + self.fresh_ttl + self.stale_ttl - time.time()
+        if ttl > 0:
+            self.memory.set(key, entry, ttl=ttl)
+
+    def _load(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            row = db.get(TripAdvisorCacheRow, key)
+            if row is None or not row.recensioni or not row.dettagli:
+                return None
+            return {"reviews": row.recensioni, "details": row.dettagli, "fetched_at": _epoch(row.aggiornato_at)}
+        except SQLAlchemyError as e:
+            logger.error(f"Errore lettura cache TripAdvisor {key}: {e}")
+            return None
+        finally:
+            db.close()
+
+    def _store(self, key: CacheKey, entry: Dict[str, Any]):
+        location_id, lingua, valuta = key
+        db = SessionLocal()
+        try:
+            db.merge(TripAdvisorCacheRow(
+                location_id=location_id, lingua=lingua, valuta=valuta,
+                recensioni=entry["reviews"], dettagli=entry["details"],
+                aggiornato_at=datetime.utcfromtimestamp(entry["fetched_at"]),
+            ))
+            db.commit()
+        except SQLAlchemyError as e:
+            # la copia in memoria resta valida
+            db.rollback()
+            logger.error(f"Errore scrittura cache TripAdvisor {key}: {e}")
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        served = counters["fresh_hits"] + counters["stale_hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": round((counters["fresh_hits"] + counters["stale_hits"]) / served, 4) if served else None,
+            "fresh_ttl_seconds": self.fresh_ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+            "persistent": self.persist,
+            "memory": self.memory.stats(),
+        }